@@ -0,0 +1,160 @@
+# Copyright (c) 2014, Stanford University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+'''
+End-to-end throughput benchmark of EdxForumScrubber. Converts a
+.bson forum dump, typically one written by synth_forum.py, into a
+scratch table of the EdxForum db, just as a production run would,
+and reports:
+
+   - posts/sec over the whole conversion,
+   - peak RSS of this process, and of the largest child process
+         (anonymization workers, mongorestore),
+   - the time spent in each stage of the conversion (see StageStats).
+
+With --loadUsers, the users file that synth_forum.py wrote next to
+the dump is first loaded into the users table, so that poster and
+classmate name redaction find their names.
+
+Example:
+    python synth_forum.py /tmp/forum1M.bson 1M
+    python benchmark_forum_etl.py --loadUsers --workers 4 /tmp/forum1M.bson
+
+The regular MySQL setup of extractor.py is needed: the EdxForum db,
+and EdxPrivate.idInt2Forum().
+'''
+
+import argparse
+import os
+import resource
+import sys
+import time
+
+from extractor import EdxForumScrubber
+from forum_writers import BatchInsertWriter
+from synth_forum import usersFileNameFor
+
+
+# Scratch tables, so that benchmarks never touch the real forum table:
+BENCHMARK_FORUM_TABLE = 'contents_benchmark'
+BENCHMARK_USERS_TABLE = 'EdxForum.BenchmarkUsers'
+
+def loadUsers(mydb, usersTableName, usersFileName):
+    '''
+    (Re)create the users table, and fill it from a
+    users file written by synth_forum.py.
+    '''
+    mydb.execute('DROP TABLE IF EXISTS %s' % usersTableName)
+    mydb.execute('CREATE TABLE %s (user_int_id int NOT NULL PRIMARY KEY, ' % usersTableName +
+                 'name varchar(255) NOT NULL, screen_name varchar(255) NOT NULL, ' +
+                 'anon_screen_name varchar(40) NOT NULL) ENGINE=MyISAM')
+    mydb.execute("LOAD DATA LOCAL INFILE '%s' INTO TABLE %s CHARACTER SET utf8 " % (usersFileName, usersTableName) +
+                 "FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' " +
+                 "(user_int_id, name, screen_name, anon_screen_name);")
+
+def peakRssMB(who):
+    # ru_maxrss is in KB on Linux:
+    return resource.getrusage(who).ru_maxrss / 1024.0
+
+def runBenchmark(bsonFileName, usersTableName=BENCHMARK_USERS_TABLE, loadUsersFile=False, **scrubberArgs):
+    '''
+    Convert the given dump, and return a report of the run.
+
+    :param bsonFileName: dump to convert
+    :type bsonFileName: String
+    :param usersTableName: fully qualified name of the users table
+    :type usersTableName: String
+    :param loadUsersFile: if True, the synth_forum.py users file of the
+        dump is loaded into usersTableName first
+    :type loadUsersFile: Bool
+    :param scrubberArgs: further keyword arguments for EdxForumScrubber,
+        such as numWorkers or pipelined
+    :returns: lines of the report
+    :rtype: [String]
+    '''
+    scrubberArgs.setdefault('forumTableName', BENCHMARK_FORUM_TABLE)
+    # Every run starts from scratch: no saved user
+    # cache, no checkpoints, no progress reports:
+    scrubberArgs.setdefault('userCacheDir', None)
+    scrubberArgs.setdefault('checkpointDir', None)
+    scrubberArgs.setdefault('statsInterval', 0)
+    scrubber = EdxForumScrubber(bsonFileName,
+                                allUsersTableName=usersTableName,
+                                allowAnonScreenName=True,
+                                **scrubberArgs)
+    if loadUsersFile:
+        loadUsers(scrubber.mydb, usersTableName, usersFileNameFor(bsonFileName))
+
+    startTime = time.time()
+    scrubber.runConversion()
+    wallSecs = time.time() - startTime
+
+    numPosts = scrubber.counter
+    return ['%s: %d posts, %d rows written in %.1f sec: %.1f posts/sec' %
+            (os.path.basename(bsonFileName), numPosts, scrubber.numRecordsInserted,
+             wallSecs, numPosts / wallSecs if wallSecs > 0 else 0.0),
+            'Peak RSS: %.1f MB; largest child process: %.1f MB' %
+            (peakRssMB(resource.RUSAGE_SELF), peakRssMB(resource.RUSAGE_CHILDREN)),
+            'Stages: %s' % scrubber.stats.report(numPosts, wallSecs)]
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]), formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--loadUsers',
+                        help='First load the users file that synth_forum.py wrote next to the dump\n' +
+                             'into the users table. Default: False',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('--usersTable',
+                        help='Fully qualified users table. Default: %s' % BENCHMARK_USERS_TABLE,
+                        default=BENCHMARK_USERS_TABLE)
+    parser.add_argument('--forumTable',
+                        help='Scratch table in EdxForum for the posts. Default: %s' % BENCHMARK_FORUM_TABLE,
+                        default=BENCHMARK_FORUM_TABLE)
+    parser.add_argument('-w', '--workers',
+                        help='Number of anonymization processes. Default: 1',
+                        type=int,
+                        default=1)
+    parser.add_argument('--pipeline',
+                        help='Read, anonymize, and write in separate threads. Default: False',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('-b', '--batchSize',
+                        help='Posts per INSERT. Default: %d' % BatchInsertWriter.DEFAULT_BATCH_SIZE,
+                        type=int,
+                        default=BatchInsertWriter.DEFAULT_BATCH_SIZE)
+    parser.add_argument('-l', '--loadInfile',
+                        help='Write with LOAD DATA LOCAL INFILE. Default: False',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('-c', '--redactClassmates',
+                        help='Redact classmate names as well. Default: False',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('-p', '--postersOnly',
+                        help='Only cache the users who post in the dump. Default: False',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('bsonFile',
+                        help='The .bson forum dump to convert')
+    args = parser.parse_args();
+
+    for line in runBenchmark(args.bsonFile,
+                             usersTableName=args.usersTable,
+                             loadUsersFile=args.loadUsers,
+                             forumTableName=args.forumTable,
+                             numWorkers=args.workers,
+                             pipelined=args.pipeline,
+                             insertBatchSize=args.batchSize,
+                             bulkLoad=args.loadInfile,
+                             redactClassmateNames=args.redactClassmates,
+                             usersFromDumpOnly=args.postersOnly):
+        print(line)
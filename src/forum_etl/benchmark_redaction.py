@@ -0,0 +1,148 @@
+# Copyright (c) 2014, Stanford University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+Compares the speed of PIIRedactor (redaction.py) with the
+multi-pass phone/zip/email redaction that EdxForumScrubber
+used before. The old chain is reproduced here as the baseline.
+
+In 'adversarial' mode, bodies crafted to make regular expressions
+backtrack are redacted at growing sizes. PIIRedactor's time per
+character must stay flat, i.e. its runtime must be linear in the body
+length. The script then prints the worst case time for the longest
+possible post, and exits with status 1 if any input grows worse
+than linearly.
+
+Usage: python benchmark_redaction.py [numBodies [bodyWords]]
+       python benchmark_redaction.py adversarial
+'''
+
+import random
+import re
+import sys
+import timeit
+
+from redaction import PIIRedactor
+
+
+# ------------------ Baseline: the former redaction chain -------------
+
+LEGACY_PHONE_PATTERN = '((?:(?:\+?1\s*(?:[.-]\s*)?)?(?:\(\s*([2-9]1[02-9]|[2-9][02-8]1|[2-9][02-8][02-9])\s*\)|([2-9]1[02-9]|[2-9][02-8]1|[2-9][02-8][02-9]))\s*(?:[.-]\s*)?)?([2-9]1[02-9]|[2-9][02-9]1|[2-9][02-9]{2})\s*(?:[.-]\s*)?([0-9]{4})(?:\s*(?:#|x\.?|ext\.?|extension)\s*(\d+))?)'
+LEGACY_ZIP_PATTERN = '\d{5}(?:[-\s]\d{4})?'
+LEGACY_EMAIL_PATTERN = '(.*)\s+([a-zA-Z0-9\(\.\-]+)[@]([a-zA-Z0-9\.]+)(.)(edu|com)\\s*(.*)'
+
+def legacyRedact(body):
+    for phoneMatchHit in re.findall(LEGACY_PHONE_PATTERN, body):
+        body = body.replace(phoneMatchHit[0], "<phoneRedac>")
+    for zipcodeMatchHit in re.findall(LEGACY_ZIP_PATTERN, body):
+        body = body.replace(zipcodeMatchHit[0], "<zipRedac>")
+    if re.compile(LEGACY_EMAIL_PATTERN).match(body) is not None:
+        new_body = " "
+        for emailMatchHit in re.findall(LEGACY_EMAIL_PATTERN, body):
+            new_body += emailMatchHit[0] + " <emailRedac> " + emailMatchHit[-1]
+        body = new_body
+    return body
+
+# ------------------ Test data -------------
+
+WORDS = ['the', 'circuit', 'voltage', 'homework', 'question', 'thanks', 'I', 'think',
+         'answer', 'is', 'wrong', 'because', 'resistor', 'current', 'lecture', 'video']
+PII = ['650-333-4567', '(415) 555-0199', '94305', '10027-1234', 'joe@comcast.com', 'ann.lee@cs.stanford.edu']
+
+def makeBodies(numBodies, bodyWords, piiProbability=0.02, seed=4711):
+    rand = random.Random(seed)
+    bodies = []
+    for _ in range(numBodies):
+        words = [rand.choice(PII) if rand.random() < piiProbability else rand.choice(WORDS)
+                 for _ in range(bodyWords)]
+        bodies.append(' '.join(words))
+    return bodies
+
+def timeRedaction(redactFunc, bodies, repeat=3):
+    return min(timeit.repeat(lambda: [redactFunc(body) for body in bodies], number=1, repeat=repeat))
+
+# ------------------ Adversarial bodies -------------
+
+# Each entry creates a body of about n characters that is hard
+# on one of the patterns: long runs of whitespace or of address
+# characters, many potential match starts, and near misses:
+ADVERSARIAL_BODIES = {
+    'whitespace run'      : lambda n: ' ' * n + '@',
+    'many short words'    : lambda n: 'x ' * (n // 2) + '@',
+    'long local part'     : lambda n: ' ' + 'a' * n + ' @',
+    'long domain'         : lambda n: ' a@' + 'a' * n,
+    'dotted domain'       : lambda n: ' a@' + 'a.' * (n // 2),
+    'repeated @'          : lambda n: ' ' + 'a@' * (n // 2),
+    'near miss emails'    : lambda n: ' ab@cd.ed' * (n // 9),
+    'digit runs'          : lambda n: '2' * n,
+    'spaced digits'       : lambda n: ('1' + ' ' * 50) * (n // 51),
+    'open paren, spaces'  : lambda n: '(' + ' ' * n + '1',
+    'country code, spaces': lambda n: '+1' + ' ' * (n // 2) + '-' + ' ' * (n // 2),
+    'long extension'      : lambda n: '650-333-4567 x' + '1' * n,
+    }
+
+ADVERSARIAL_SIZES = [1000, 10000, 100000, 1000000]
+
+# The multi-pass baseline is quadratic or worse on some of the
+# bodies; it is only timed on small ones:
+LEGACY_SIZES = [1000, 2000, 4000]
+
+# Largest post body: EdxForum.contents.body is a MySQL TEXT column:
+MAX_BODY_LEN = 65535
+
+# Max ratio of time per char between largest and smallest body
+# that still counts as linear (leaves room for timing noise and
+# cache effects):
+LINEARITY_TOLERANCE = 3.0
+
+def nanosPerChar(redactFunc, body, repeat=3):
+    return timeRedaction(redactFunc, [body], repeat) / len(body) * 1e9
+
+def runAdversarial():
+    '''
+    Time PIIRedactor, and (on the smaller sizes) the multi-pass
+    baseline, on all adversarial bodies. Returns True if
+    PIIRedactor stayed linear on all of them.
+    '''
+    redactor = PIIRedactor()
+    allLinear = True
+    worstNanosPerChar = 0.0
+    print('ns per char at body sizes %s' % ', '.join([str(size) for size in ADVERSARIAL_SIZES]))
+    for name in sorted(ADVERSARIAL_BODIES.keys()):
+        makeBody = ADVERSARIAL_BODIES[name]
+        nanos = [nanosPerChar(redactor.redact, makeBody(size)) for size in ADVERSARIAL_SIZES]
+        worstNanosPerChar = max(worstNanosPerChar, max(nanos))
+        growth = nanos[-1] / nanos[0]
+        isLinear = growth <= LINEARITY_TOLERANCE
+        allLinear = allLinear and isLinear
+        legacyNanos = [nanosPerChar(legacyRedact, makeBody(size), repeat=1) for size in LEGACY_SIZES]
+        print('%-20s PIIRedactor %s  growth %4.1fx %s' %
+              (name, ' '.join(['%7.1f' % nano for nano in nanos]), growth, 'ok' if isLinear else 'NOT LINEAR'))
+        print('%-20s multi-pass  %s  (sizes %s)' %
+              ('', ' '.join(['%7.1f' % nano for nano in legacyNanos]), ', '.join([str(size) for size in LEGACY_SIZES])))
+    print('Worst case for a %d char post: %.1f ms' % (MAX_BODY_LEN, worstNanosPerChar * MAX_BODY_LEN / 1e6))
+    return allLinear
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'adversarial':
+        sys.exit(0 if runAdversarial() else 1)
+
+    numBodies = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    bodyWords = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    redactor = PIIRedactor()
+
+    print('%d bodies of %d words' % (numBodies, bodyWords))
+    # Share of words that are a phone number, zip code, or email address:
+    for piiProbability in [0.0, 0.002, 0.02, 0.1]:
+        bodies = makeBodies(numBodies, bodyWords, piiProbability)
+        legacySecs = timeRedaction(legacyRedact, bodies)
+        engineSecs = timeRedaction(redactor.redact, bodies)
+        print('PII density %5.3f: multi-pass %7.3f sec, PIIRedactor %7.3f sec, speedup %5.1fx' %
+              (piiProbability, legacySecs, engineSecs, legacySecs / engineSecs))
@@ -0,0 +1,157 @@
+# Copyright (c) 2014, Stanford University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+Reads a mongodump .bson file of OpenEdX Forum posts directly,
+without first restoring it into a MongoDB.
+
+A .bson dump is simply a concatenation of BSON documents. Each
+document starts with its own total length as a little-endian
+int32, so we can read one document at a time, decode it, and
+hand it out. Only one document is ever in memory, no matter how
+large the dump.
+
+BsonForumReader offers the same query()/close() calls that
+EdxForumScrubber.forumMongoToRelational() uses on a
+json_to_relation MongoDB object, so either can serve as the
+source of forum posts.
+
+A reader can be limited to a subset of the documents, given by
+their byte offsets in the file. indexByField() collects such
+offsets, for instance per course, in one pass over the file.
+'''
+
+from array import array
+import struct
+
+from bson import BSON
+
+
+class BsonForumReader(object):
+
+    # Number of bytes in the length prefix of each BSON document:
+    BSON_LEN_PREFIX_SIZE = 4
+
+    def __init__(self, bsonFileName, docOffsets=None):
+        '''
+        :param bsonFileName: full path to a .bson file created by mongodump
+        :type bsonFileName: String
+        :param docOffsets: if provided, only the documents that start at these
+            byte offsets are read, in the given order. Default: all documents.
+        :type docOffsets: [int]
+        '''
+        self.bsonFileName = bsonFileName
+        self.docOffsets = docOffsets
+        # Number of documents handed out so far in
+        # the current (or most recent) pass over the file:
+        self.numDocsRead = 0
+
+    def query(self, queryDict=None):
+        '''
+        Iterator over all documents in the .bson file, in
+        file order. Mimics MongoDB.query(); only the empty
+        query is supported.
+
+        :param queryDict: must be None or {}
+        :type queryDict: {}
+        :returns: generator of forum post dicts
+        :rtype: generator
+        '''
+        if queryDict:
+            raise ValueError("BsonForumReader only supports the empty query; got %s" % str(queryDict))
+        return self.__iter__()
+
+    def __iter__(self):
+        self.numDocsRead = 0
+        with open(self.bsonFileName, 'rb') as bsonFd:
+            if self.docOffsets is not None:
+                for docOffset in self.docOffsets:
+                    bsonFd.seek(docOffset)
+                    docBytes = self.readDocBytes(bsonFd)
+                    if docBytes is None:
+                        raise ValueError("No BSON document at offset %d of %s" % (docOffset, self.bsonFileName))
+                    self.numDocsRead += 1
+                    yield BSON(docBytes).decode()
+                return
+            while True:
+                docBytes = self.readDocBytes(bsonFd)
+                if docBytes is None:
+                    # Clean end of file:
+                    return
+                self.numDocsRead += 1
+                yield BSON(docBytes).decode()
+
+    def readDocBytes(self, bsonFd):
+        '''
+        Read the raw bytes of the BSON document at the current
+        position of bsonFd. Returns None at the end of the file.
+        '''
+        lenPrefix = bsonFd.read(BsonForumReader.BSON_LEN_PREFIX_SIZE)
+        if len(lenPrefix) == 0:
+            return None
+        if len(lenPrefix) < BsonForumReader.BSON_LEN_PREFIX_SIZE:
+            raise ValueError("Truncated BSON document length after %d documents in %s" %
+                             (self.numDocsRead, self.bsonFileName))
+        docLen = struct.unpack('<i', lenPrefix)[0]
+        docRest = bsonFd.read(docLen - BsonForumReader.BSON_LEN_PREFIX_SIZE)
+        if len(docRest) < docLen - BsonForumReader.BSON_LEN_PREFIX_SIZE:
+            raise ValueError("Truncated BSON document after %d documents in %s" %
+                             (self.numDocsRead, self.bsonFileName))
+        return lenPrefix + docRest
+
+    def indexByField(self, fieldName):
+        '''
+        Scan the whole file, and return the byte offsets of
+        the documents for each value of the given top level
+        field. Offsets are kept in compact arrays, 8 bytes
+        per document. Documents without the field are listed
+        under None.
+
+        :param fieldName: name of a top level document field. Ex: 'course_id'
+        :type fieldName: String
+        :returns: field value --> ascending offsets of the documents with that value
+        :rtype: {<any> : array}
+        '''
+        offsetsByValue = {}
+        with open(self.bsonFileName, 'rb') as bsonFd:
+            while True:
+                docOffset = bsonFd.tell()
+                docBytes = self.readDocBytes(bsonFd)
+                if docBytes is None:
+                    return offsetsByValue
+                value = BSON(docBytes).decode().get(fieldName)
+                try:
+                    offsetsByValue[value].append(docOffset)
+                except KeyError:
+                    offsetsByValue[value] = array('l', [docOffset])
+
+    def distinctValues(self, fieldName):
+        '''
+        Scan the whole file, and return the set of distinct
+        values of the given top level field. Documents without
+        the field contribute nothing. Only the set is kept
+        in memory, not the documents.
+
+        :param fieldName: name of a top level document field. Ex: 'author_id'
+        :type fieldName: String
+        :returns: distinct values
+        :rtype: set
+        '''
+        values = set()
+        for doc in self:
+            value = doc.get(fieldName)
+            if value is not None:
+                values.add(value)
+        return values
+
+    def close(self):
+        # Nothing to release; file is closed when
+        # iteration ends. Present for symmetry with MongoDB:
+        pass
@@ -0,0 +1,84 @@
+# Copyright (c) 2014, Stanford University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+'''
+Checkpoints of a running forum conversion. Each time the writer
+has flushed a batch to MySQL, EdxForumScrubber records how many
+posts of the source are done, and the _id of the last of them.
+An interrupted run can then be resumed from there, rather than
+started over.
+'''
+
+import json
+import os
+
+
+class ConversionCheckpoint(object):
+
+    def __init__(self, fileName):
+        '''
+        :param fileName: path of the checkpoint file
+        :type fileName: String
+        '''
+        self.fileName = fileName
+
+    def save(self, bsonFileName, numPostsDone, lastPostId, loadTableName=None, batchSize=None):
+        '''
+        Record progress. The file is written under a temporary name,
+        and then renamed, so an interruption during save() leaves the
+        previous checkpoint intact.
+
+        :param bsonFileName: the .bson file being converted
+        :type bsonFileName: String
+        :param numPostsDone: number of posts from the start of the source
+            that are in the table
+        :type numPostsDone: int
+        :param lastPostId: _id of the last of those posts
+        :type lastPostId: String
+        :param loadTableName: table the posts are loaded into, if
+            not the forum table itself. Ex: 'contents_staging'
+        :type loadTableName: String
+        :param batchSize: most rows the writer sends to MySQL at once. An
+            interruption leaves at most that many rows beyond numPostsDone.
+        :type batchSize: int
+        '''
+        tmpFileName = self.fileName + '.tmp'
+        with open(tmpFileName, 'w') as fd:
+            json.dump({'bsonFileName' : bsonFileName,
+                       'numPostsDone' : numPostsDone,
+                       'lastPostId'   : lastPostId,
+                       'loadTableName': loadTableName,
+                       'batchSize'    : batchSize}, fd)
+        os.rename(tmpFileName, self.fileName)
+
+    def load(self):
+        '''
+        Return the most recently saved progress as a dict with keys
+        bsonFileName, numPostsDone, and lastPostId, plus loadTableName
+        and batchSize in checkpoints that record them. None if there is no checkpoint,
+        or it cannot be read.
+
+        :rtype: {dict | None}
+        '''
+        try:
+            with open(self.fileName, 'r') as fd:
+                state = json.load(fd)
+        except (IOError, ValueError):
+            return None
+        if not isinstance(state, dict) or not all([key in state for key in ('bsonFileName', 'numPostsDone', 'lastPostId')]):
+            return None
+        return state
+
+    def remove(self):
+        try:
+            os.remove(self.fileName)
+        except OSError:
+            pass
@@ -0,0 +1,289 @@
+# Copyright (c) 2014, Stanford University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+'''
+Converts a multi-course forum dump with one EdxForumScrubber per
+course, running in a pool of processes, so that a large dump takes
+about as long as its largest course rather than the sum of all.
+
+One pass over the .bson file indexes the byte offsets of each
+course's posts (BsonForumReader.indexByField()). Each course is then
+handed to a pool process, which runs an ordinary scrubber that reads
+just that course's posts. Courses are dispatched largest first,
+so the long ones never start last.
+
+Output goes either into one table, EdxForum.contents by default, or
+into one table per course, named contents_<course>. In single table
+mode, the parent creates the forum table fresh, and the courses fill
+it in place. With stagingSwap among the scrubber arguments (see
+EdxForumScrubber), the parent has a staging table created fresh
+instead, and the courses' scrubbers add to it. Once all courses
+succeeded, the parent indexes it, and swaps it in for the forum table.
+If a course failed, the forum table is left as it was. Per course
+tables are rebuilt by their courses' scrubbers, staged or not.
+
+Each course's scrubber opens its own MySQL connection, and each
+process logs to its own file in EdxForumScrubber.LOG_DIR. The parent loads the user cache
+once, before the courses start, so that the courses' scrubbers find
+a saved copy rather than each loading all users from MySQL.
+
+Incremental and resumed runs are not supported, and nor is reading
+via MongoDB. Pool processes cannot start their own workers, so each
+course is anonymized in a single process.
+
+Usage: python course_driver.py [options] bson_filename
+'''
+
+import argparse
+import hashlib
+import logging
+import multiprocessing
+import os
+import re
+import sys
+import time
+import traceback
+
+from bson_reader import BsonForumReader
+from extractor import EdxForumScrubber
+
+
+def _convertCourse(courseTask):
+    '''
+    Pool process side of CourseParallelDriver.run(): convert
+    the posts of one course. Failures are returned rather than
+    raised, so that one bad course does not stop the others.
+
+    :param courseTask: (bsonFileName, courseId, docOffsets, forumTableName, appendToTable, scrubberArgs)
+    :type courseTask: tuple
+    :returns: (courseId, number of rows written, seconds, error message or None)
+    :rtype: (String, int, float, {String | None})
+    '''
+    bsonFileName, courseId, docOffsets, forumTableName, appendToTable, scrubberArgs = courseTask
+    startTime = time.time()
+    try:
+        scrubber = EdxForumScrubber(bsonFileName,
+                                    forumTableName=forumTableName,
+                                    appendToTable=appendToTable,
+                                    sourceDocOffsets=docOffsets,
+                                    **scrubberArgs)
+        scrubber.runConversion()
+        return (courseId, scrubber.numRecordsInserted, time.time() - startTime, None)
+    except Exception:
+        return (courseId, 0, time.time() - startTime, traceback.format_exc())
+
+
+class CourseParallelDriver(object):
+
+    # Longest MySQL table name:
+    MAX_TABLE_NAME_LEN = 64
+
+    # Number of hex digits of the hash that ends
+    # shortened course table names:
+    TABLE_NAME_HASH_LEN = 8
+
+    def __init__(self,
+                 bsonFileName,
+                 numProcesses=None,
+                 forumTableName='contents',
+                 perCourseTables=False,
+                 scrubberArgs=None):
+        '''
+        :param bsonFileName: full path to a .bson forum dump
+        :type bsonFileName: String
+        :param numProcesses: number of courses converted at a time. Default: number of CPUs
+        :type numProcesses: int
+        :param forumTableName: table for all posts, or prefix of the per-course tables
+        :type forumTableName: String
+        :param perCourseTables: if True, each course goes into its own table
+            <forumTableName>_<course>, else all go into forumTableName
+        :type perCourseTables: Bool
+        :param scrubberArgs: further keyword arguments for each course's
+            EdxForumScrubber, such as anonymize or bulkLoad
+        :type scrubberArgs: {String : <any>}
+        '''
+        self.bsonFileName = bsonFileName
+        self.numProcesses = numProcesses if numProcesses is not None else multiprocessing.cpu_count()
+        self.forumTableName = forumTableName
+        self.perCourseTables = perCourseTables
+        self.scrubberArgs = dict(scrubberArgs) if scrubberArgs is not None else {}
+        for argName in ['incremental', 'resume', 'loadViaMongo', 'parquetDir']:
+            if self.scrubberArgs.get(argName):
+                raise ValueError("The course driver does not support %s" % argName)
+        if self.scrubberArgs.get('numWorkers', 1) > 1:
+            raise ValueError("Pool processes cannot start anonymization workers; use numProcesses instead")
+        # Several scrubbers fill the same table, so a checkpoint
+        # per table would be overwritten by each of them:
+        self.scrubberArgs['checkpointDir'] = None
+        self.logger = logging.getLogger(os.path.basename(__file__))
+
+    def courseTableName(self, courseId):
+        '''
+        Table for one course's posts: 'MITx/6.002x/2012_Fall' --> contents_MITx_6_002x_2012_Fall
+        Names leave room for the suffixes of the scrubber's staging and
+        retired tables. Longer names are cut short, and end in a hash
+        of the full name, so that courses with a long common prefix
+        still get tables of their own.
+        '''
+        tableName = '%s_%s' % (self.forumTableName, re.sub('[^0-9A-Za-z_]', '_', str(courseId)))
+        maxLen = CourseParallelDriver.MAX_TABLE_NAME_LEN - max(len(EdxForumScrubber.STAGING_TABLE_SUFFIX),
+                                                               len(EdxForumScrubber.RETIRED_TABLE_SUFFIX))
+        if len(tableName) <= maxLen:
+            return tableName
+        nameHash = hashlib.md5(tableName).hexdigest()[:CourseParallelDriver.TABLE_NAME_HASH_LEN]
+        return '%s_%s' % (tableName[:maxLen - len(nameHash) - 1], nameHash)
+
+    def indexCourses(self):
+        '''
+        Return (courseId, document offsets) for each course
+        in the dump, largest course first.
+        '''
+        offsetsByCourse = BsonForumReader(self.bsonFileName).indexByField('course_id')
+        return sorted(offsetsByCourse.items(), key=lambda (courseId, docOffsets): len(docOffsets), reverse=True)
+
+    def prepareTable(self, tableName):
+        '''
+        Have a scrubber create the given table fresh, and load the
+        user cache, so that the courses' scrubbers find a saved copy
+        of the cache rather than each loading all users from MySQL
+        at the same time. In per course table mode, the table is
+        that of the first course, whose own scrubber recreates it.
+
+        :param tableName: table in the forum db to create
+        :type tableName: String
+        :returns: name of the table the posts are to be loaded into: tableName,
+            or its staging table
+        :rtype: String
+        '''
+        scrubber = EdxForumScrubber(self.bsonFileName, forumTableName=tableName, **self.scrubberArgs)
+        if scrubber.userCacheDir is not None and not scrubber.usersFromDumpOnly:
+            scrubber.populateUserCache()
+        scrubber.mydb.close()
+        return scrubber.loadTableName
+
+    def swapInTable(self, stagingTableName):
+        '''
+        Index the staging table that the courses filled, and swap
+        it in for the forum table.
+
+        :param stagingTableName: table in the forum db that holds all posts
+        :type stagingTableName: String
+        '''
+        # Only makes sure the forum table exists;
+        # the staging table is left alone:
+        scrubber = EdxForumScrubber(self.bsonFileName, forumTableName=self.forumTableName, appendToTable=True, **self.scrubberArgs)
+        try:
+            scrubber.swapInStagingTable(stagingTableName)
+        finally:
+            scrubber.mydb.close()
+
+    def run(self):
+        '''
+        Convert all courses.
+
+        :returns: (courseId, number of rows written, seconds, error message or None)
+            for each course, in order of completion
+        :rtype: [(String, int, float, {String | None})]
+        '''
+        startTime = time.time()
+        courses = self.indexCourses()
+        self.logger.info("%d posts in %d courses; largest: %s with %d posts" %
+                         (sum([len(docOffsets) for _, docOffsets in courses]), len(courses),
+                          courses[0][0] if len(courses) > 0 else None, len(courses[0][1]) if len(courses) > 0 else 0))
+        loadTableName = None
+        if not self.perCourseTables:
+            loadTableName = self.prepareTable(self.forumTableName)
+        elif len(courses) > 0:
+            self.prepareTable(self.courseTableName(courses[0][0]))
+
+        courseTasks = [(self.bsonFileName,
+                        courseId,
+                        docOffsets,
+                        self.courseTableName(courseId) if self.perCourseTables else loadTableName,
+                        not self.perCourseTables,
+                        self.scrubberArgs)
+                       for courseId, docOffsets in courses]
+        results = []
+        pool = multiprocessing.Pool(self.numProcesses)
+        try:
+            # One course per task, dispatched in list order, i.e. largest first:
+            for courseId, numRows, secs, errorMsg in pool.imap_unordered(_convertCourse, courseTasks, chunksize=1):
+                if errorMsg is None:
+                    self.logger.info("%s: %d rows in %.1f sec" % (courseId, numRows, secs))
+                else:
+                    self.logger.error("%s failed after %.1f sec: %s" % (courseId, secs, errorMsg))
+                results.append((courseId, numRows, secs, errorMsg))
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        numFailed = len([result for result in results if result[3] is not None])
+        if loadTableName is not None and loadTableName != self.forumTableName:
+            if numFailed == 0:
+                self.swapInTable(loadTableName)
+            else:
+                self.logger.error("%s left as it was; the posts of the courses that succeeded are in %s" %
+                                  (self.forumTableName, loadTableName))
+        self.logger.info("Converted %d courses in %.1f sec; %d failed" %
+                         (len(results), time.time() - startTime, numFailed))
+        return results
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]), formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('-n', '--processes',
+                        help='Number of courses converted at a time. Default: number of CPUs',
+                        type=int,
+                        default=None)
+    parser.add_argument('--perCourseTables',
+                        help='Put each course into its own table, contents_<course>,\n' +
+                             'rather than all into EdxForum.contents. Default: False',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('-l', '--loadInfile',
+                        help='Write with LOAD DATA LOCAL INFILE. Default: False',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('--pipeline',
+                        help='Within each course, read, anonymize, and write in separate threads. Default: False',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('-c', '--redactClassmates',
+                        help='Redact classmate names as well. Default: False',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('-p', '--postersOnly',
+                        help='Each course only caches the users who post in it. Default: False',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('--staging',
+                        help='Load a staging table, and swap it in for the forum table once\n' +
+                             'all courses are done. Default: False',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('bson_filename',
+                        help='Full path to MongoDB dump of Forum in .bson format.')
+    args = parser.parse_args();
+
+    logging.basicConfig(level=logging.INFO, format="%(name)s: %(asctime)s;%(levelname)s: %(message)s")
+    driver = CourseParallelDriver(args.bson_filename,
+                                  numProcesses=args.processes,
+                                  perCourseTables=args.perCourseTables,
+                                  scrubberArgs={'allowAnonScreenName' : True,
+                                                'bulkLoad' : args.loadInfile,
+                                                'pipelined' : args.pipeline,
+                                                'redactClassmateNames' : args.redactClassmates,
+                                                'usersFromDumpOnly' : args.postersOnly,
+                                                'stagingSwap' : args.staging})
+    results = driver.run()
+    sys.exit(1 if any([errorMsg is not None for _, _, _, errorMsg in results]) else 0)
@@ -9,31 +9,47 @@
 # THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import MySQLdb
-from UserDict import DictMixin
+import MySQLdb.cursors
 import argparse
-from collections import OrderedDict
+from collections import OrderedDict, deque
 from datetime import datetime
 import getpass
+import hashlib
 import logging
+import multiprocessing
+from operator import attrgetter
 import os
 from pymongo import MongoClient
 import re
 import subprocess
 import sys
+import time
 import warnings
 
-from json_to_relation.mongodb import MongoDB
-
+from bson_reader import BsonForumReader
+from checkpoint import ConversionCheckpoint
+from forum_writers import BatchInsertWriter, LoadDataInfileWriter, ParquetWriter, deleteRowsByKey
+from lru_cache import LRUCache
+from pipeline import StagedPipeline
+from post_hashes import PostHashIndex, UnchangedPostFilter, postKey
+from profiling import ConversionProfiler
 from pymysql_utils.pymysql_utils import MySQLDB
+from redaction import NameRedactor, PIIRedactor
+from sharded_reader import ShardedMongoReader
+from stage_stats import StageStats
+from user_cache import UserCache
+from watermarks import WatermarkFilter
 
 
 class EdxForumScrubber(object):
     '''
 
-    Given a .bson file of OpenEdX Forum posts, load the file
-    into a MongoDB. Then pull a post at a time, anonymize, and
-    insert a selection of fields into a MySQL db. The MongoDb
-    entries look like this::
+    Given a .bson file of OpenEdX Forum posts, read the file
+    one post at a time, anonymize, and insert a selection of
+    fields into a MySQL db. By default the .bson file is decoded
+    directly (see bson_reader.py). Alternatively the file is first
+    loaded into a MongoDB, from which the posts are then pulled.
+    The post entries look like this::
 
     {
     	"_id" : ObjectId("51b75a48f359c40a00000028"),
@@ -75,13 +91,107 @@ class EdxForumScrubber(object):
 
     LOG_DIR = '/home/dataman/Data/EdX/NonTransformLogs'
 
-    # Pattern for email id - strings of alphabets/numbers/dots/hyphens followed
-    # by an @ or at followed by combinations of dot/. followed by the edu/com
-    # also, allow for spaces
-
-    emailPattern='(.*)\s+([a-zA-Z0-9\(\.\-]+)[@]([a-zA-Z0-9\.]+)(.)(edu|com)\\s*(.*)'
-    #emailPattern='(.*)\\s+([a-zA-Z0-9\\.]+)\\s*(\\(f.*b.*)?(@)\\s*([a-zA-Z0-9\\.\\s;]+)\\s*(\\.)\\s*(edu|com)\\s+(.*)'
-    compiledEmailPattern = re.compile(emailPattern);
+    # Number of author ids sent to MySQL per INSERT when
+    # prefetching forum_uids (see prefetchForumUids()):
+    FORUM_UID_PREFETCH_CHUNK = 10000
+
+    # Number of raw posts handed to an anonymization
+    # worker process at a time (see numWorkers in __init__()):
+    WORKER_BATCH_SIZE = 500
+
+    # Number of such batches per worker process that may
+    # be handed out before their results are collected:
+    WORKER_BATCHES_IN_FLIGHT = 2
+
+    # Seconds to wait for each batch in flight when
+    # anonymization ends early, e.g. after an error:
+    WORKER_SHUTDOWN_TIMEOUT = 60
+
+    # Number of such batches that may wait between two
+    # stages of a pipelined conversion (see pipelined
+    # in __init__()):
+    PIPELINE_QUEUE_SIZE = StagedPipeline.DEFAULT_QUEUE_SIZE
+
+    # Default number of posters whose compiled name patterns
+    # are cached (see getPosterNamePattern()):
+    POSTER_NAME_CACHE_SIZE = 10000
+
+    # Default number of redacted bodies that are memoized, so that
+    # repeated bodies by the same poster (reposts, '+1', copied
+    # assignment text) are only redacted once. Bodies longer than
+    # REDACTION_MEMO_MAX_BODY_LEN are not memoized; that bounds
+    # the memo's memory, and long bodies rarely repeat:
+    REDACTION_MEMO_SIZE = 10000
+    REDACTION_MEMO_MAX_BODY_LEN = 8192
+
+    # Where populateUserCache() keeps copies of the user cache
+    # between runs. See userCacheDir in __init__():
+    USER_CACHE_DIR = os.path.expanduser('~/.forum_etl')
+
+    # Mode of the directories created for the user cache, post
+    # hashes, and checkpoints. The user cache holds real names,
+    # so only the owner may list or enter them:
+    PRIVATE_DIR_MODE = 0700
+
+    # Number of rows fetched per round trip from
+    # server-side cursors (see streamQuery()):
+    STREAM_FETCH_SIZE = 10000
+
+    # Default number of seconds between progress reports
+    # in the log. See statsInterval in __init__():
+    STATS_INTERVAL = 60
+
+    # Number of posts between checks whether a progress
+    # report is due:
+    STATS_CHECK_EVERY = 1000
+
+    # Number of user_int_ids per IN (...) list when loading
+    # only the posters of a dump (see populateUserCache()):
+    USER_FETCH_CHUNK = 1000
+
+    # Table in the forum db that holds each course's
+    # high-water mark for incremental runs:
+    WATERMARK_TABLE = 'ForumWatermarks'
+
+    # Default directory for checkpoints of running
+    # conversions. See checkpointDir in __init__():
+    CHECKPOINT_DIR = os.path.expanduser('~/.forum_etl')
+
+    # Default directory for the content hashes of the posts
+    # of the last run. See skipUnchanged in __init__():
+    POST_HASH_DIR = os.path.expanduser('~/.forum_etl')
+
+    # Staged rebuilds of the forum table (see stagingSwap in
+    # __init__()) load into <forumTableName>_staging. The table
+    # it replaces is briefly kept as <forumTableName>_old:
+    STAGING_TABLE_SUFFIX = '_staging'
+    RETIRED_TABLE_SUFFIX = '_old'
+
+    # Secondary indexes of staged forum tables: index name --> column.
+    # They are built in one pass after all posts are loaded, rather
+    # than maintained row by row during the load:
+    DEFERRED_INDEXES = OrderedDict([('forumUidIdx', 'forum_uid'),
+                                    ('courseDisplayNameIdx', 'course_display_name'),
+                                    ('createdAtIdx', 'created_at'),
+                                    ('commentThreadIdIdx', 'comment_thread_id')])
+
+    # Top level fields of raw posts that the conversion reads:
+    # ForumRecord, plus updated_at for the incremental and the
+    # skip-unchanged filters. When posts are pulled from MongoDB,
+    # only these fields are fetched; abuse_flaggers, tags_array,
+    # title, and the like stay on the server. Keep in sync with
+    # ForumRecord.__init__():
+    MONGO_POST_FIELDS = ['_id', '_type', 'anonymous', 'anonymous_to_peers', 'at_position_list',
+                         'author_id', 'author_username', 'body', 'comment_thread_id', 'course_id',
+                         'created_at', 'parent_id', 'parent_ids', 'sk', 'updated_at', 'votes']
+
+    # Redaction of phone numbers, zip codes, and email addresses
+    # from post bodies in a single scan. Patterns are compiled
+    # once, here. The single-kind redactors serve prune_numbers()
+    # and prune_zipcode(). See redaction.py:
+    piiRedactor = PIIRedactor()
+    phoneRedactor = PIIRedactor([PIIRedactor.PHONE])
+    zipRedactor = PIIRedactor([PIIRedactor.ZIP])
 
     # Pattern for replacing embedded double quotes in post bodies,
     # unless they are already escaped w/ a backslash. The
@@ -93,9 +203,8 @@ class EdxForumScrubber(object):
 
     # Schema of EdxForum.contents: an ordered dict that is
     # used twice: the table creation MySQL command is constructed
-    # from this dict, and the dict is used to ensure that
-    # all its keys (i.e. future column names) are present
-    # in each MongoDB object. See also createForumTable().
+    # from this dict, and the dict's keys are the slots of
+    # each ForumRecord. See also createForumTable().
     # In createForumTable() either entry anon_screen_name,
     # or screen_name in the dict below will be deleted, based
     # on whether we are asked to anonymize or not:
@@ -133,7 +242,34 @@ class EdxForumScrubber(object):
                  forumTableName='contents',
                  allUsersTableName='EdxPrivate.UserGrade',
                  anonymize=True,
-                 allowAnonScreenName=False):
+                 allowAnonScreenName=False,
+                 loadViaMongo=False,
+                 mongoShards=1,
+                 mongoCursorBatchSize=ShardedMongoReader.DEFAULT_CURSOR_BATCH_SIZE,
+                 mongoIdOrder=False,
+                 mongoCursorTimeout=False,
+                 insertBatchSize=BatchInsertWriter.DEFAULT_BATCH_SIZE,
+                 bulkLoad=False,
+                 spoolDir=None,
+                 numWorkers=1,
+                 pipelined=False,
+                 redactClassmateNames=False,
+                 nameStopWords=None,
+                 posterNameCacheSize=POSTER_NAME_CACHE_SIZE,
+                 redactionMemoSize=REDACTION_MEMO_SIZE,
+                 userCacheDir=USER_CACHE_DIR,
+                 usersFromDumpOnly=False,
+                 incremental=False,
+                 resume=False,
+                 checkpointDir=None,
+                 statsInterval=STATS_INTERVAL,
+                 parquetDir=None,
+                 parquetRowGroupSize=ParquetWriter.DEFAULT_ROW_GROUP_SIZE,
+                 appendToTable=False,
+                 sourceDocOffsets=None,
+                 skipUnchanged=False,
+                 postHashDir=POST_HASH_DIR,
+                 stagingSwap=False):
         '''
         Given a .bson file containing OpenEdX Forum entries, anonymize the entries (if desired),
         and place them into a MySQL table.
@@ -155,6 +291,106 @@ class EdxForumScrubber(object):
             post bodies are replaced by <redacName_<anon_screen_name>>, where anon_screen_name
             is the hash used in other tables of the OpenEdX data.
         :type allow_anon_screen_name: Bool
+        :param loadViaMongo: if True, the .bson file is restored into a local
+            MongoDB via mongorestore, and posts are pulled from there. Else
+            the .bson file is decoded directly, with no mongod involved.
+        :type loadViaMongo: Bool
+        :param mongoShards: with loadViaMongo: number of _id ranges of the collection
+            that are read through parallel cursors. With 1, a single cursor reads all posts.
+        :type mongoShards: int
+        :param mongoCursorBatchSize: with loadViaMongo: number of posts each
+            cursor fetches per round trip
+        :type mongoCursorBatchSize: int
+        :param mongoIdOrder: with loadViaMongo and a single shard: if True, posts are
+            read in _id order, else in the server's natural order, which needs no sort
+        :type mongoIdOrder: Bool
+        :param mongoCursorTimeout: with loadViaMongo: if True, the server may close
+            cursors that sit idle for ten minutes. Default: cursors never time out
+        :type mongoCursorTimeout: Bool
+        :param insertBatchSize: number of posts sent to MySQL in one multi-row INSERT
+        :type insertBatchSize: int
+        :param bulkLoad: if True, posts are spooled into a tab-separated file, which is
+            then loaded into MySQL via LOAD DATA LOCAL INFILE, rather than INSERTed.
+        :type bulkLoad: Bool
+        :param spoolDir: directory for bulkLoad spool files. Default: system temp dir
+        :type spoolDir: String
+        :param numWorkers: number of processes that anonymize posts in parallel. With
+            1, all work is done in this process.
+        :type numWorkers: int
+        :param pipelined: if True, reading posts, anonymizing them, and writing
+            them to MySQL run concurrently, in separate threads, connected by
+            bounded queues. Else each batch is read, anonymized, and written in turn.
+        :type pipelined: Bool
+        :param redactClassmateNames: if True, the first names and screen names of everyone
+            in allUsersTable are redacted from all posts, not just the poster's own name.
+        :type redactClassmateNames: Bool
+        :param nameStopWords: words never redacted as classmate names. Default:
+            NameRedactor.DEFAULT_STOP_WORDS
+        :type nameStopWords: set
+        :param posterNameCacheSize: number of posters whose compiled name
+            redaction pattern is cached
+        :type posterNameCacheSize: int
+        :param redactionMemoSize: number of redacted bodies remembered, keyed by a hash
+            of the body and the poster. 0: no memo; every body is redacted.
+        :type redactionMemoSize: int
+        :param userCacheDir: directory in which the user cache is saved between runs.
+            A saved cache is reused as long as allUsersTable is unchanged. None: always
+            load the cache from allUsersTable, and do not save it.
+        :type userCacheDir: String
+        :param usersFromDumpOnly: if True, runConversion() first collects the ids of all
+            posters in the .bson file, and the user cache is loaded with just those users,
+            rather than with all of allUsersTable. Classmate name redaction then only
+            covers classmates who post.
+        :type usersFromDumpOnly: Bool
+        :param incremental: if True, the forum table is kept, and only posts created or
+            updated since the previous incremental run of their course are loaded. They
+            replace any earlier version of themselves in the table.
+        :type incremental: Bool
+        :param resume: if True, and a checkpoint of an interrupted conversion of the same
+            .bson file is found in checkpointDir, the forum table is kept, and the conversion
+            continues after the last post that the checkpoint records. Else the conversion
+            starts from scratch.
+        :type resume: Bool
+        :param checkpointDir: directory for the checkpoint that is saved after each batch
+            of posts written to MySQL, such as CHECKPOINT_DIR. None (default): no
+            checkpoints; the run cannot be resumed.
+        :type checkpointDir: String
+        :param statsInterval: seconds between progress reports in the log. Each report
+            gives records/sec, and the time spent in each stage of the conversion.
+            None or 0: only report at the end of the run.
+        :type statsInterval: int
+        :param parquetDir: if provided, anonymized posts are written into Parquet files
+            under this directory, partitioned by course and month of creation, rather
+            than into MySQL. MySQL is then only used to look up users. Cannot be
+            combined with incremental or resume.
+        :type parquetDir: String
+        :param parquetRowGroupSize: with parquetDir: rows per Parquet file and row group
+        :type parquetRowGroupSize: int
+        :param appendToTable: if True, the forum table is created only if it does not
+            exist yet, and posts are added to it. Used when several scrubbers fill one
+            table, each with part of the dump. See course_driver.py.
+        :type appendToTable: Bool
+        :param sourceDocOffsets: if provided, only the documents at these byte offsets
+            of the .bson file are converted. See BsonForumReader.indexByField().
+            Not available with loadViaMongo.
+        :type sourceDocOffsets: [int]
+        :param skipUnchanged: if True, posts whose body, author, votes, and updated_at
+            are unchanged since the previous successful skipUnchanged run into the same
+            table are not converted again; their rows stay in place. New and changed posts
+            replace their rows, and rows of posts no longer in the dump are deleted. Without
+            usable hashes of a previous run, the table is rebuilt. Cannot be combined with
+            incremental, resume, appendToTable, or parquetDir.
+        :type skipUnchanged: Bool
+        :param postHashDir: directory where skipUnchanged runs keep the post hashes
+        :type postHashDir: String
+        :param stagingSwap: if True, a run that rebuilds the forum table loads the posts
+            into a staging table without secondary indexes, indexes it in one pass, and
+            then swaps it in for the forum table with an atomic RENAME. Readers of the
+            forum table see the old posts until the new ones are complete. If False
+            (default), the forum table is dropped up front, and filled in place. Runs that add to
+            the table (incremental, appendToTable, or skipUnchanged with hashes of
+            an earlier run) always fill it in place.
+        :type stagingSwap: Bool
         '''
 
         self.bsonFileName = bsonFileName
@@ -163,6 +399,43 @@ class EdxForumScrubber(object):
         self.allUsersTableName = allUsersTableName
         self.anonymize = anonymize
         self.allowAnonScreenName = allowAnonScreenName
+        self.loadViaMongo = loadViaMongo
+        self.mongoShards = mongoShards
+        self.mongoCursorBatchSize = mongoCursorBatchSize
+        self.mongoIdOrder = mongoIdOrder
+        self.mongoCursorTimeout = mongoCursorTimeout
+        self.insertBatchSize = insertBatchSize
+        self.bulkLoad = bulkLoad
+        self.spoolDir = spoolDir
+        self.numWorkers = numWorkers
+        self.pipelined = pipelined
+        self.redactClassmateNames = redactClassmateNames
+        self.nameStopWords = nameStopWords
+        self.userCacheDir = userCacheDir
+        self.usersFromDumpOnly = usersFromDumpOnly
+        self.incremental = incremental
+        self.checkpointDir = checkpointDir
+        self.statsInterval = statsInterval
+        self.parquetDir = parquetDir
+        self.parquetRowGroupSize = parquetRowGroupSize
+        if parquetDir is not None and (incremental or resume):
+            raise ValueError("Parquet output cannot be combined with incremental or resumed runs, which replace rows in MySQL")
+        self.appendToTable = appendToTable
+        self.sourceDocOffsets = sourceDocOffsets
+        if sourceDocOffsets is not None and loadViaMongo:
+            raise ValueError("Document offsets only apply when reading the .bson file directly, not via MongoDB")
+        self.skipUnchanged = skipUnchanged
+        self.postHashDir = postHashDir
+        if skipUnchanged and (incremental or resume or appendToTable or parquetDir is not None):
+            raise ValueError("Skipping unchanged posts cannot be combined with incremental, resumed, appended, or Parquet runs")
+        # Post hashes of the previous run, if usable, and keys
+        # of the posts that MySQL refused in this run:
+        self.previousPostHashes = None
+        self.refusedPostKeys = set()
+        self.stagingSwap = stagingSwap
+        # Table the posts are loaded into: the forum table, or
+        # its staging table. Set by prepDatabase():
+        self.loadTableName = forumTableName
 
         # If not unittest, but regular run, then mysqlDbObj is None
         if mysqlDbObj is None:
@@ -173,13 +446,59 @@ class EdxForumScrubber(object):
         else:
             self.mydb = mysqlDbObj
 
+        # Number of posts handed to the writer, and
+        # number of posts that made it into MySQL:
         self.counter=0
-
-        self.userCache = {}
+        self.numRecordsInserted = 0
+        self.writer = None
+
+        # Wall time and calls per conversion stage, and
+        # the times of conversion start and last report:
+        self.stats = StageStats()
+        self.startTime = None
+        self.lastStatsReportTime = None
+        self.counterAtLastCheck = 0
+
+        # user_int_id --> (full name, screen_name, anon_screen_name):
+        self.userCache = UserCache()
         self.userSet   = set()
+        # Screen names of everyone in the class; only collected
+        # when self.redactClassmateNames is True:
+        self.screenNameSet = set()
+        # Dictionary redactor for classmates' names; built
+        # in populateUserCache() if self.redactClassmateNames:
+        self.nameRedactor = None
+        # forum_int_id --> (anon_screen_name, compiled poster name pattern):
+        self.posterNameCache = LRUCache(posterNameCacheSize)
+        # (body digest, forum_int_id) --> (redacted body, anon_screen_name):
+        self.redactionMemo = LRUCache(redactionMemoSize) if redactionMemoSize > 0 else None
+        # Map user_int_id --> forum_uid, filled by prefetchForumUids():
+        self.forumUidCache = {}
+        # Poster ids found by collectAuthorIds(), and the
+        # source they were collected from:
+        self.authorIds = None
+        self.authorIdsSource = None
+        # _id of the post most recently handed to the writer:
+        self.lastPostId = None
 
         warnings.filterwarnings('ignore', category=MySQLdb.Warning)
         self.setupLogging()
+
+        # Checkpoint of this conversion, and the progress of
+        # the interrupted conversion we are resuming, if any:
+        self.checkpoint = None
+        self.resumeState = None
+        if self.checkpointDir is not None:
+            self.checkpoint = ConversionCheckpoint(os.path.join(self.checkpointDir, 'checkpoint_%s_%s.json' %
+                                                                (self.forumDbName, self.forumTableName)))
+            if resume:
+                self.resumeState = self.loadResumeState()
+        # Number of posts of the source done by the interrupted run:
+        self.numPostsResumed = self.resumeState['numPostsDone'] if self.resumeState is not None else 0
+
+        if self.skipUnchanged:
+            self.previousPostHashes = self.loadPostHashes()
+
         self.prepDatabase()
 
         #******mysqldb.commit();
@@ -191,21 +510,85 @@ class EdxForumScrubber(object):
         so that unittests can create an EdxForumScrubber instance without
         doing the actual work. Instead, unittests call individual methods.
         '''
-        self.populateUserCache();
-
-        self.mongo_database_name = 'TmpForum'
-        self.collection_name = 'contents'
-
-        # Load bson file into Mongodb:
-        self.loadForumIntoMongoDb(self.bsonFileName)
-        self.mongodb = MongoDB(dbName=self.mongo_database_name, collection=self.collection_name)
+        if self.loadViaMongo:
+            self.mongo_database_name = 'TmpForum'
+            self.collection_name = 'contents'
+
+            # Load bson file into Mongodb:
+            self.loadForumIntoMongoDb(self.bsonFileName)
+            if self.mongoShards > 1:
+                self.logInfo('Reading Forum posts through %d parallel cursors' % self.mongoShards)
+            # Only fetch the fields the conversion reads:
+            self.mongodb = ShardedMongoReader(self.mongo_database_name,
+                                              self.collection_name,
+                                              numShards=self.mongoShards,
+                                              cursorBatchSize=self.mongoCursorBatchSize,
+                                              projection=EdxForumScrubber.MONGO_POST_FIELDS,
+                                              idOrder=self.mongoIdOrder,
+                                              noCursorTimeout=not self.mongoCursorTimeout)
+        else:
+            # Stream posts straight out of the .bson file:
+            self.logInfo('Reading Forum posts directly from %s' % self.bsonFileName)
+            self.mongodb = BsonForumReader(self.bsonFileName, docOffsets=self.sourceDocOffsets)
+
+        if self.incremental:
+            # Only pass on posts that are new since the last run. From
+            # MongoDB, only pull the posts that may be new:
+            self.mongodb = WatermarkFilter(self.mongodb, self.loadHighWaterMarks(), pushDown=self.loadViaMongo)
+        elif self.skipUnchanged:
+            # Only pass on posts that are new or changed:
+            self.mongodb = UnchangedPostFilter(self.mongodb,
+                                               self.previousPostHashes if self.previousPostHashes is not None else PostHashIndex())
+
+        if self.usersFromDumpOnly:
+            # Only cache the users who actually post in this dump:
+            self.populateUserCache(self.collectAuthorIds(self.mongodb))
+        else:
+            self.populateUserCache();
 
         # Anonymize each forum record, and transfer to MySQL db:
-        self.forumMongoToRelational(self.mongodb, self.mydb,'contents' )
+        self.forumMongoToRelational(self.mongodb, self.mydb, self.loadTableName)
+        if self.loadTableName != self.forumTableName:
+            self.swapInStagingTable()
+        # Done; nothing left to resume. Until the staging table
+        # is swapped in, a resumed run still has to do that:
+        if self.checkpoint is not None:
+            self.checkpoint.remove()
+
+        if self.incremental:
+            if self.loadViaMongo:
+                self.logInfo('Skipped %d further posts that were loaded by earlier runs; MongoDB did not hand out older ones' %
+                             self.mongodb.numPostsSkipped)
+            else:
+                self.logInfo('Skipped %d posts that were loaded by earlier runs' % self.mongodb.numPostsSkipped)
+            self.saveHighWaterMarks(self.mongodb.newHighWaterMarks)
+        elif self.skipUnchanged:
+            self.finishPostHashes(self.mongodb)
 
         self.mydb.close()
         self.mongodb.close()
-        self.logInfo('Entered %d records into %s' % (self.counter, self.forumDbName + '.' + self.forumTableName))
+        if self.parquetDir is not None:
+            self.logInfo('Wrote %d records into Parquet files under %s' % (self.numRecordsInserted, self.parquetDir))
+        else:
+            self.logInfo('Entered %d records into %s' % (self.numRecordsInserted, self.forumDbName + '.' + self.forumTableName))
+
+    def runProfiledConversion(self, profiler):
+        '''
+        Run runConversion() under the given profiler. The profile
+        is written next to the log file, with the same name and
+        the profiler's extension, such as forum_<date>.prof. The
+        summary of hot functions goes into the log.
+
+        :param profiler: deterministic or sampling profiler
+        :type profiler: ConversionProfiler
+        :returns: path of the profile artifact
+        :rtype: String
+        '''
+        artifactPath = os.path.splitext(self.logFilePath)[0] + profiler.artifactSuffix()
+        self.logInfo('Profiling conversion (%s); profile goes to %s' % (profiler.mode, artifactPath))
+        summary = profiler.run(self.runConversion, artifactPath)
+        self.logInfo('Profile written to %s. Hot functions:\n%s' % (artifactPath, summary))
+        return artifactPath
 
     def loadForumIntoMongoDb(self, bsonFilename):
 
@@ -247,12 +630,12 @@ class EdxForumScrubber(object):
 
     def forumMongoToRelational(self, mongodb, mysqlDbObj, mysqlTable):
         '''
-        Given a pymongo collection object in which Forum posts are stored,
-        and a MySQL db object and table name, anonymize each mongo record,
-        and insert it into the MySQL table.
+        Given a source of Forum posts, and a MySQL db object and table name,
+        anonymize each mongo record, and insert it into the MySQL table.
 
-        :param collection: collection object obtained via a mangoclient object
-        :type collection: Collection
+        :param mongodb: source of posts: either a MongoDB wrapper around the
+            collection in which the posts are stored, or a BsonForumReader
+        :type mongodb: {MongoDB | BsonForumReader}
         :param mysqlDbObj: wrapper to MySQL db. See pymysql_utils.py
         :type mysqlDbObj: MYSQLDB
         :param mysqlTable: name of table where posts are to be deposited.
@@ -264,22 +647,377 @@ class EdxForumScrubber(object):
         #print command
 
         self.logInfo('Will start inserting from mongo collection to MySQL')
+        self.startTime = self.lastStatsReportTime = time.time()
 
-        for mongoForumRec in mongodb.query({}):
-            mongoRecordObj = MongoRecord(mongoForumRec)
+        fullTblName = mysqlDbObj.dbName() + '.' + mysqlTable
+        self.writer = self.makeWriter(mysqlDbObj, fullTblName)
+        # Pulls one row's column values, in table column
+        # order, out of a ForumRecord:
+        self.rowGetter = attrgetter(*EdxForumScrubber.forumSchema.keys())
 
-            try:
-                # Check whether 'up' can be converted to a list
-                list(mongoRecordObj['up'])
-            except Exception as e:
-                self.logInfo("Error in conversion of 'up' field to a list (setting cell to -1):" + `e`)
-                mongoRecordObj['up'] ='-1'
+        # Convert all posters' user_int_ids to forum_uids
+        # up front, rather than one query per post:
+        if self.anonymize:
+            startTime = time.time()
+            self.prefetchForumUids(self.collectAuthorIds(mongodb))
+            self.stats.add('forumUidPrefetch', time.time() - startTime)
+
+        mongoForumRecs = self.stats.timedIter('read', mongodb.query({}))
+        if self.resumeState is not None:
+            mongoForumRecs = self.skipDonePosts(mongoForumRecs)
+
+        if self.pipelined:
+            self.convertInPipeline(mongoForumRecs)
+        elif self.numWorkers > 1:
+            for resultBatch in self.anonymizeInParallel(self.batchPosts(mongoForumRecs)):
+                self.writeResultBatch(resultBatch)
+        else:
+            for mongoForumRec in mongoForumRecs:
+                mongoRecordObj = self.makeMongoRecord(mongoForumRec)
+                self.insert_content_record(mysqlDbObj, mysqlTable, mongoRecordObj);
+
+        # Insert the final, partial batch:
+        startTime = time.time()
+        self.writer.close()
+        self.stats.add('mysqlWrite', time.time() - startTime, 0)
+        self.numRecordsInserted = self.writer.numRowsWritten
+        self.logInfo("Done: %s" % self.stats.report(self.counter, time.time() - self.startTime))
+        if self.anonymize and self.numWorkers <= 1:
+            self.logInfo("Poster name pattern cache: %s" % self.posterNameCache.stats())
+            if self.redactionMemo is not None:
+                self.logInfo("Redaction memo: %s" % self.redactionMemo.stats())
+
+    def makeMongoRecord(self, mongoForumRec):
+        '''
+        Turn one raw post from MongoDB or a .bson file into a
+        ForumRecord that has a field for every forum schema column.
+        Columns the post does not provide are empty strings.
+
+        :param mongoForumRec: raw forum post
+        :type mongoForumRec: dict
+        :returns: the post, not yet anonymized
+        :rtype: ForumRecord
+        '''
+        startTime = time.time()
+        mongoRecordObj = ForumRecord(mongoForumRec)
+        self.stats.add('record', time.time() - startTime)
+        return mongoRecordObj
+
+    def convertInPipeline(self, mongoForumRecs):
+        '''
+        Read, anonymize, and write posts in three concurrent stages:
+        a thread reads batches of WORKER_BATCH_SIZE raw posts from the
+        source; this thread (or, with numWorkers > 1, the worker processes)
+        anonymizes them; and a thread hands the results to self.writer.
+        At most PIPELINE_QUEUE_SIZE batches wait between stages. Rows
+        reach the table in source order.
+
+        Only the writer stage uses the MySQL connection. That requires
+        all forum_uids to have been prefetched.
+
+        :param mongoForumRecs: raw posts
+        :type mongoForumRecs: iterator
+        '''
+        self.logInfo("Converting in a pipeline of reader, anonymizer, and writer stages")
+        pipeline = StagedPipeline(EdxForumScrubber.PIPELINE_QUEUE_SIZE)
+        postBatches = pipeline.readAhead(self.batchPosts(mongoForumRecs))
+        if self.numWorkers > 1:
+            resultBatches = self.anonymizeInParallel(postBatches)
+        else:
+            resultBatches = self.prepareBatches(postBatches)
+        try:
+            pipeline.writeBehind(resultBatches, self.writeResultBatch)
+        finally:
+            resultBatches.close()
+
+    def prepareBatches(self, postBatches):
+        '''
+        Generator that turns batches of raw posts into
+        batches of (rowTuple, ForumRecord), in this process.
+        '''
+        for postBatch in postBatches:
+            yield [self.prepareContentRecord(self.makeMongoRecord(mongoForumRec)) for mongoForumRec in postBatch]
 
-            # Make sure the MongoDB object has all fields that will
-            # be needed for the forum schema:
-            self.ensureSchemaAdherence(mongoRecordObj)
+    def anonymizeInParallel(self, postBatches):
+        '''
+        Generator that anonymizes batches of raw posts in self.numWorkers
+        processes, and yields the batches of (rowTuple, ForumRecord)
+        they produce. Results come back in input order, so the table
+        rows end up in the same order as with serial processing. At
+        most WORKER_BATCHES_IN_FLIGHT batches per worker are handed
+        out ahead of the consumer, which keeps memory use flat.
+
+        Workers are forked, and thereby get a read-only copy of
+        self.userCache and self.forumUidCache. They never talk to
+        MySQL, so all forum_uids must have been prefetched.
+
+        :param postBatches: lists of at most WORKER_BATCH_SIZE raw posts
+        :type postBatches: iterator
+        '''
+        self.logInfo("Anonymizing with %d worker processes" % self.numWorkers)
+        pool = multiprocessing.Pool(self.numWorkers,
+                                    initializer=_initAnonymizationWorker,
+                                    initargs=(self,))
+        # Results of batches handed to the pool, oldest first:
+        pendingResults = deque()
+        maxPendingResults = EdxForumScrubber.WORKER_BATCHES_IN_FLIGHT * self.numWorkers
+        completed = False
+        try:
+            for postBatch in postBatches:
+                pendingResults.append(pool.apply_async(_anonymizeBatch, (postBatch,)))
+                if len(pendingResults) >= maxPendingResults:
+                    yield self.collectWorkerResult(pendingResults.popleft())
+            while len(pendingResults) > 0:
+                yield self.collectWorkerResult(pendingResults.popleft())
+            completed = True
+        finally:
+            # Also reached when the consumer stops early:
+            if completed:
+                pool.close()
+            else:
+                # Let the batches in flight finish first. With tasks
+                # still queued, Pool.terminate() can hang:
+                for pendingResult in pendingResults:
+                    pendingResult.wait(EdxForumScrubber.WORKER_SHUTDOWN_TIMEOUT)
+                pool.terminate()
+            pool.join()
+
+    def collectWorkerResult(self, pendingResult):
+        '''
+        Wait for one batch from an anonymization worker, add the
+        worker's stage times to self.stats, and return the batch.
+        '''
+        resultBatch, workerStageTotals = pendingResult.get()
+        self.stats.merge(workerStageTotals)
+        return resultBatch
+
+    def writeResultBatch(self, resultBatch):
+        '''
+        Hand a batch of anonymized posts to self.writer.
+
+        :param resultBatch: (rowTuple, ForumRecord) of each post
+        :type resultBatch: [((<any>), ForumRecord)]
+        '''
+        startTime = time.time()
+        for rowTuple, mongoRecordObj in resultBatch:
+            self.lastPostId = mongoRecordObj.forum_post_id
+            self.writer.write(rowTuple, mongoRecordObj)
+        self.stats.add('mysqlWrite', time.time() - startTime, len(resultBatch))
+        self.counter += len(resultBatch)
+        self.reportProgress()
+
+    def reportProgress(self):
+        '''
+        Log records/sec and the time spent in each conversion
+        stage, if statsInterval seconds have passed since the
+        last report. Checked every STATS_CHECK_EVERY posts.
+        '''
+        if not self.statsInterval or self.counter - self.counterAtLastCheck < EdxForumScrubber.STATS_CHECK_EVERY:
+            return
+        self.counterAtLastCheck = self.counter
+        now = time.time()
+        if now - self.lastStatsReportTime >= self.statsInterval:
+            self.lastStatsReportTime = now
+            self.logInfo("Progress: %s" % self.stats.report(self.counter, now - self.startTime))
+
+    def batchPosts(self, mongoForumRecs):
+        '''
+        Group an iterator of raw posts into lists of
+        at most WORKER_BATCH_SIZE posts.
+        '''
+        batch = []
+        for mongoForumRec in mongoForumRecs:
+            batch.append(mongoForumRec)
+            if len(batch) >= EdxForumScrubber.WORKER_BATCH_SIZE:
+                yield batch
+                batch = []
+        if len(batch) > 0:
+            yield batch
+
+    def makeWriter(self, mysqlDbObj, fullTblName):
+        '''
+        Create the writer that deposits anonymized posts into MySQL:
+        a LoadDataInfileWriter if self.bulkLoad is True, else a
+        BatchInsertWriter that INSERTs self.insertBatchSize rows at a time.
+        If self.parquetDir is set, a ParquetWriter that writes files
+        there instead.
+        In incremental runs, and runs that update the posts of a previous
+        skipUnchanged run, the writer replaces posts with the same
+        forum_post_id. So it does in a resumed run, until it is past the
+        last batch of the interrupted run, which may be in part. After each
+        batch, the writer has saveCheckpoint() record the progress.
+
+        :param mysqlDbObj: wrapper to MySQL db. See pymysql_utils.py
+        :type mysqlDbObj: MYSQLDB
+        :param fullTblName: fully qualified destination table. Ex: 'EdxForum.contents'
+        :type fullTblName: String
+        :returns: writer with write(), flush(), and close() methods
+        :rtype: {BatchInsertWriter | LoadDataInfileWriter | ParquetWriter}
+        '''
+        if self.parquetDir is not None:
+            colNames = EdxForumScrubber.forumSchema.keys()
+            return ParquetWriter(self.parquetDir,
+                                 colNames,
+                                 [EdxForumScrubber.forumSchema[colName] for colName in colNames],
+                                 rowGroupSize=self.parquetRowGroupSize,
+                                 logInfo=self.logInfo)
+        replaceKeyCol = 'forum_post_id' if self.incremental or self.resumeState is not None or self.previousPostHashes is not None else None
+        flushCallback = self.saveCheckpoint if self.checkpoint is not None else None
+        if self.bulkLoad:
+            return LoadDataInfileWriter(mysqlDbObj,
+                                        fullTblName,
+                                        EdxForumScrubber.forumSchema.keys(),
+                                        spoolDir=self.spoolDir,
+                                        logInfo=self.logInfo,
+                                        replaceKeyCol=replaceKeyCol,
+                                        flushCallback=flushCallback,
+                                        rowErrorCallback=self.logLoadError)
+        return BatchInsertWriter(mysqlDbObj,
+                                 fullTblName,
+                                 EdxForumScrubber.forumSchema.keys(),
+                                 batchSize=self.insertBatchSize,
+                                 rowErrorCallback=self.logInsertError,
+                                 replaceKeyCol=replaceKeyCol,
+                                 flushCallback=flushCallback)
+
+    def postHashIndexKey(self):
+        '''
+        Describes the table and settings that the post hashes are
+        valid for. Rows converted with other settings differ, so
+        hashes saved under another key are not used.
+        '''
+        return '%s.%s anonymize=%s anonScreenName=%s redactClassmates=%s' % \
+            (self.forumDbName, self.forumTableName, self.anonymize, self.allowAnonScreenName, self.redactClassmateNames)
+
+    def postHashFileName(self):
+        return os.path.join(self.postHashDir, 'post_hashes_%s_%s.bin' % (self.forumDbName, self.forumTableName))
+
+    def loadPostHashes(self):
+        '''
+        Return the post hashes saved by the previous successful
+        skipUnchanged run into the forum table. Returns None if
+        there are none, or if the table does not hold exactly as
+        many rows as the hashes list posts, say because the table
+        was changed by some other run in between.
+
+        :rtype: {PostHashIndex | None}
+        '''
+        postHashes = PostHashIndex.load(self.postHashFileName(), self.postHashIndexKey())
+        if postHashes is None:
+            self.logInfo("No post hashes of an earlier run in %s; converting all posts" % self.postHashFileName())
+            return None
+        try:
+            numRows = self.mydb.query('SELECT COUNT(*) FROM %s' % self.forumTableName).next()[0]
+        except (MySQLdb.Error, StopIteration):
+            numRows = None
+        if numRows != len(postHashes):
+            self.logWarn("Table %s has %s rows, but the post hashes of the last run list %d posts; converting all posts" %
+                         (self.forumTableName, numRows, len(postHashes)))
+            return None
+        self.logInfo("Loaded hashes of %d posts of the last run; unchanged posts will be skipped" % len(postHashes))
+        return postHashes
+
+    def finishPostHashes(self, postFilter):
+        '''
+        After a skipUnchanged run: delete the rows of posts that are
+        no longer in the dump, and save the hashes of this run's posts
+        for the next one. Failure to save is only logged; the next run
+        then converts all posts.
+
+        :param postFilter: the filter the posts of this run went through
+        :type postFilter: UnchangedPostFilter
+        '''
+        self.logInfo('Skipped %d unchanged posts' % postFilter.numPostsSkipped)
+        newPostHashes = postFilter.newIndex
+        newPostHashes.finish(dropKeys=self.refusedPostKeys)
+        if self.previousPostHashes is not None and postFilter.numPostsMatched < len(self.previousPostHashes):
+            # Some posts of the last run are gone. The list is complete
+            # before the first delete is sent on the same connection:
+            vanishedPostIds = [postId for (postId,) in self.streamQuery('SELECT forum_post_id FROM %s' % self.forumTableName)
+                               if postKey(postId) not in newPostHashes]
+            self.logInfo('Deleting %d posts that are no longer in the dump' % len(vanishedPostIds))
+            deleteRowsByKey(self.mydb, self.forumTableName, 'forum_post_id', vanishedPostIds)
+        try:
+            if not os.path.isdir(self.postHashDir):
+                os.makedirs(self.postHashDir, EdxForumScrubber.PRIVATE_DIR_MODE)
+            newPostHashes.save(self.postHashFileName(), self.postHashIndexKey())
+        except (IOError, OSError) as e:
+            self.logWarn("Could not save post hashes to %s: %s" % (self.postHashFileName(), `e`))
+
+    def loadResumeState(self):
+        '''
+        Return the progress of an interrupted conversion of
+        self.bsonFileName, or None if there is nothing to resume.
+        '''
+        resumeState = self.checkpoint.load()
+        if resumeState is None:
+            self.logInfo("No checkpoint in %s; converting from the start" % self.checkpoint.fileName)
+            return None
+        if resumeState['bsonFileName'] != self.bsonFileName:
+            self.logWarn("Checkpoint %s is for %s, not %s; converting from the start" %
+                         (self.checkpoint.fileName, resumeState['bsonFileName'], self.bsonFileName))
+            return None
+        self.logInfo("Resuming conversion after post %d (_id %s)" % (resumeState['numPostsDone'], resumeState['lastPostId']))
+        return resumeState
+
+    def saveCheckpoint(self):
+        '''
+        Called by the writer after each batch it sent to MySQL.
+        Records how many posts of the source are done. Failure
+        to save is only logged.
+        '''
+        try:
+            if not os.path.isdir(self.checkpointDir):
+                os.makedirs(self.checkpointDir, EdxForumScrubber.PRIVATE_DIR_MODE)
+            self.checkpoint.save(self.bsonFileName,
+                                 self.numPostsResumed + self.writer.numRowsReceived,
+                                 self.lastPostId,
+                                 self.loadTableName,
+                                 self.writerBatchSize())
+        except (IOError, OSError) as e:
+            self.logWarn("Could not save checkpoint to %s: %s" % (self.checkpoint.fileName, `e`))
+        # Rows that a resumed run may duplicate are confined to the
+        # interrupted run's last batch, which may have been larger than
+        # ours. Once this run is past it, batches are plain inserts again.
+        # Checkpoints that do not record a batch size keep replacing:
+        if self.resumeState is not None and not self.incremental:
+            interruptedBatchSize = self.resumeState.get('batchSize')
+            if interruptedBatchSize is not None and self.writer.numRowsReceived >= interruptedBatchSize:
+                self.writer.replaceKeyCol = None
+
+    def writerBatchSize(self):
+        '''
+        Return the most rows self.writer sends to MySQL at once.
+        '''
+        if isinstance(self.writer, LoadDataInfileWriter):
+            return self.writer.maxRowsPerChunk
+        return self.writer.batchSize
 
-            self.insert_content_record(mysqlDbObj, mysqlTable, mongoRecordObj);
+    def skipDonePosts(self, mongoForumRecs):
+        '''
+        Read past the posts that the interrupted run already converted.
+        Ensures that the source still has the post that the checkpoint
+        recorded as the last one done, in the same place.
+
+        :param mongoForumRecs: raw posts, from the start of the source
+        :type mongoForumRecs: iterator
+        :returns: the remaining raw posts
+        :rtype: iterator
+        '''
+        mongoForumRecs = iter(mongoForumRecs)
+        numPostsDone = self.resumeState['numPostsDone']
+        lastPostId = None
+        for postNum in xrange(numPostsDone):
+            try:
+                lastPostId = str(mongoForumRecs.next().get('_id'))
+            except StopIteration:
+                raise ValueError("Cannot resume: source has only %d posts, but checkpoint records %d as done" %
+                                 (postNum, numPostsDone))
+        if numPostsDone > 0 and lastPostId != self.resumeState['lastPostId']:
+            raise ValueError("Cannot resume: post %d has _id %s, but checkpoint records %s" %
+                             (numPostsDone, lastPostId, self.resumeState['lastPostId']))
+        self.logInfo("Skipped %d posts converted by the interrupted run" % numPostsDone)
+        return mongoForumRecs
 
     def prepDatabase(self):
         '''
@@ -297,13 +1035,44 @@ class EdxForumScrubber(object):
             # which self.mydb is connected, and the forum table name
             # that was established in __init__():
             fullTblName = self.mydb.dbName() + '.' + self.forumTableName
-            # Clear old forum data out of the table:
+            if self.parquetDir is not None:
+                # Posts go to Parquet files; MySQL only
+                # provides the users:
+                self.trimForumSchema(self.anonymize)
+                return
+            if self.appendToTable:
+                # Other scrubbers add to the same table:
+                self.createForumTable(self.anonymize, ifNotExists=True)
+                return
+            if self.incremental or self.resumeState is not None or self.previousPostHashes is not None:
+                if self.resumeState is not None:
+                    # Continue filling the table the interrupted
+                    # run was filling, which may be a staging table:
+                    self.loadTableName = self.resumeState.get('loadTableName') or self.forumTableName
+                # Keep the posts of earlier runs:
+                self.createForumTable(self.anonymize, ifNotExists=True, tableName=self.loadTableName)
+                self.ensureForumPostIdIndex(self.loadTableName)
+                if self.incremental:
+                    self.createWatermarkTable()
+                return
             try:
-                self.mydb.dropTable(fullTblName)
-                # Create MySQL table for the posts. If we are to
-                # anonymize, the poster name column will be 'screen_name',
-                # else it will be 'anon_screen_name':
-                self.createForumTable(self.anonymize)
+                if self.stagingSwap:
+                    # Load into a fresh staging table. The forum table
+                    # keeps serving the old posts until swapInStagingTable().
+                    # Leftovers of an abandoned staged run are dropped:
+                    self.loadTableName = self.forumTableName + EdxForumScrubber.STAGING_TABLE_SUFFIX
+                    self.mydb.dropTable(self.mydb.dbName() + '.' + self.loadTableName)
+                    self.createForumTable(self.anonymize, tableName=self.loadTableName)
+                else:
+                    # Clear old forum data out of the table:
+                    self.mydb.dropTable(fullTblName)
+                    # Create MySQL table for the posts. If we are to
+                    # anonymize, the poster name column will be 'screen_name',
+                    # else it will be 'anon_screen_name':
+                    self.createForumTable(self.anonymize)
+                    if self.skipUnchanged:
+                        # The next run will replace changed posts by id:
+                        self.ensureForumPostIdIndex()
                 self.logDebug("setting and assigning char set complete. Truncation succeeded")
             except ValueError as e:
                 self.logDebug("Failed either to set character codes, or to create forum table %s: %s" % (fullTblName, `e`))
@@ -323,51 +1092,160 @@ class EdxForumScrubber(object):
             return ''
         return password
 
-    def populateUserCache (self) :
+    def populateUserCache (self, userIntIds=None) :
         '''
         Populate the User Cache and preload information on mySQLUser id int, screen name
-        and the actual name
+        and the actual name. Without userIntIds, all users are streamed from
+        self.allUsersTableName through a server-side cursor into a compact UserCache.
+        If self.userCacheDir is set, that cache is saved there, and reused by later runs
+        for as long as the table's checksum (or, if unavailable, its row count on the
+        same day) stays the same.
+
+        :param userIntIds: if provided, only these users are loaded, in chunks of
+            USER_FETCH_CHUNK ids. Such partial caches are not saved.
+        :type userIntIds: set
         '''
         try:
             self.logInfo("Beginning to populate mySQLUser cache");
-            # Cache all in-the-clear mySQLUser names of participants who
-            # might post posts. We get those from the EdxPrivate.UserGrade table
-            # Result tuple positions:                  0        1        2            3
-            for userRow in self.mydb.query('select user_int_id,name,screen_name,anon_screen_name from %s' % self.allUsersTableName):
-                userCacheEntry=[]
-                userCacheEntry.append(userRow[1]) # full name
-                userCacheEntry.append(userRow[2]) # screen_name
-                userCacheEntry.append(userRow[3]) # anon_screen_name
+            if userIntIds is None:
+                self.userCache = self.loadAllUsers()
+            else:
+                self.userCache = self.loadUsers(userIntIds)
 
+            for (userIntId, fullName, screen_name, anon_screen_name) in self.userCache.iterEntries():
                 # Get poster's full name as firstName/lastName array:
-                posterName=userRow[1].split()
+                posterName=fullName.split()
 
                 if len(posterName)>0:
                     # Collect the first name:
                     self.userSet.add(posterName[0])
+                if self.redactClassmateNames and screen_name:
+                    self.screenNameSet.add(screen_name)
 
-                """for word in posterName:
-                    if(len(word)>2 and '\\'    not in repr(word) ):
-                        self.userSet.add(word)
-                        if '-' in word:
-                            l2=word.split('-')
-                            for data in l2:
-                                self.userSet.add(data)"""
-                """if(len(userRow[1])>0):
-                    self.userSet|=set([userRow[1]])
-                    self.userSet|=set(userRow[2])"""
-                # Add a cache entry mapping user_int_id
-                # to the triplet full name/screen_name/anon_screen_name
-                self.userCache[int(userRow[0])] = userCacheEntry;
             self.logInfo("loaded objects in usercache %d"%(len(self.userCache)))
-            # Save the mySQLUser cache in Python pickled format:
-            #pickle.dump( self.userSet, open( "mySQLUser.p", "wb" ) )
-
-            #print self.userSet
+            if self.redactClassmateNames:
+                self.buildNameRedactor()
         except MySQLdb.Error,e:
             self.logInfo("MySql Error while mySQLUser cache exiting %d: %s" % (e.args[0],e.args[1]))
             sys.exit(1)
 
+    def loadAllUsers(self):
+        '''
+        Return a UserCache with all users in self.allUsersTableName;
+        from the saved copy in self.userCacheDir if it is current.
+        '''
+        cacheKey = None
+        cacheFilePath = None
+        if self.userCacheDir is not None:
+            cacheKey = self.getUserTableKey()
+            cacheFilePath = os.path.join(self.userCacheDir, 'userCache_%s.bin' % self.allUsersTableName)
+            userCache = UserCache.load(cacheFilePath, cacheKey)
+            if userCache is not None:
+                self.logInfo("Reusing user cache saved in %s" % cacheFilePath)
+                return userCache
+
+        userCache = UserCache()
+        # Cache all in-the-clear mySQLUser names of participants who
+        # might post posts. We get those from the EdxPrivate.UserGrade table
+        # Result tuple positions:         0        1        2            3
+        for userRow in self.streamQuery('select user_int_id,name,screen_name,anon_screen_name from %s order by user_int_id' %
+                                        self.allUsersTableName):
+            # Add a cache entry mapping user_int_id
+            # to the triplet full name/screen_name/anon_screen_name
+            userCache.add(userRow[0], userRow[1], userRow[2], userRow[3])
+        userCache.finish()
+        if cacheFilePath is not None:
+            self.saveUserCache(userCache, cacheFilePath, cacheKey)
+        return userCache
+
+    def loadUsers(self, userIntIds):
+        '''
+        Return a UserCache with just the given users, fetched
+        from self.allUsersTableName in chunked IN (...) queries.
+
+        :param userIntIds: user_int_ids to load
+        :type userIntIds: set
+        '''
+        userCache = UserCache()
+        userIntIds = sorted(userIntIds)
+        chunkSize = EdxForumScrubber.USER_FETCH_CHUNK
+        for chunkStart in range(0, len(userIntIds), chunkSize):
+            idList = ','.join([str(int(userIntId)) for userIntId in userIntIds[chunkStart:chunkStart + chunkSize]])
+            for userRow in self.mydb.query('select user_int_id,name,screen_name,anon_screen_name from %s where user_int_id in (%s)' %
+                                           (self.allUsersTableName, idList)):
+                userCache.add(userRow[0], userRow[1], userRow[2], userRow[3])
+        userCache.finish()
+        return userCache
+
+    def getUserTableKey(self):
+        '''
+        Return a string that changes whenever self.allUsersTableName
+        changes: its CHECKSUM TABLE value if the server provides one,
+        else its row count, combined with today's date.
+        '''
+        try:
+            checksum = self.mydb.query('CHECKSUM TABLE %s' % self.allUsersTableName).next()[1]
+        except (MySQLdb.Error, StopIteration, IndexError):
+            checksum = None
+        if checksum is not None:
+            return 'checksum %s' % str(checksum)
+        rowCount = self.mydb.query('SELECT COUNT(*) FROM %s' % self.allUsersTableName).next()[0]
+        return 'rows %s on %s' % (str(rowCount), datetime.now().strftime('%Y-%m-%d'))
+
+    def saveUserCache(self, userCache, cacheFilePath, cacheKey):
+        '''
+        Save the user cache for later runs. Failure is only logged.
+        '''
+        try:
+            if not os.path.isdir(self.userCacheDir):
+                os.makedirs(self.userCacheDir, EdxForumScrubber.PRIVATE_DIR_MODE)
+            userCache.save(cacheFilePath, cacheKey)
+            self.logInfo("Saved user cache to %s" % cacheFilePath)
+        except (IOError, OSError) as e:
+            self.logWarn("Could not save user cache to %s: %s" % (cacheFilePath, `e`))
+
+    def streamQuery(self, queryStr):
+        '''
+        Like self.mydb.query(), but rows are pulled from a server-side
+        cursor, STREAM_FETCH_SIZE rows at a time, rather than having
+        the whole result transferred into memory first. Falls back to
+        self.mydb.query() if the raw connection is not available.
+
+        :param queryStr: SELECT statement
+        :type queryStr: String
+        :returns: generator of row tuples
+        :rtype: generator
+        '''
+        connection = getattr(self.mydb, 'connection', None)
+        if connection is None:
+            for row in self.mydb.query(queryStr):
+                yield row
+            return
+        cursor = connection.cursor(MySQLdb.cursors.SSCursor)
+        try:
+            cursor.execute(queryStr)
+            while True:
+                rows = cursor.fetchmany(EdxForumScrubber.STREAM_FETCH_SIZE)
+                if len(rows) == 0:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            cursor.close()
+
+    def buildNameRedactor(self):
+        '''
+        Compile the first names and screen names of everyone in
+        the class into one dictionary redactor for trimnames().
+        First names are only redacted where capitalized, since
+        many of them are also ordinary English words.
+        '''
+        self.nameRedactor = NameRedactor(stopWords=self.nameStopWords)
+        self.nameRedactor.addNames(self.userSet, requireCapitalized=True)
+        self.nameRedactor.addNames(self.screenNameSet, requireCapitalized=False)
+        self.nameRedactor.finalize()
+        self.logInfo("Built classmate name redactor with %d names" % self.nameRedactor.numNames)
+
     def prune_numbers(self, body):
         '''
         Prunes phone numbers from a given string and returns the string with
@@ -378,12 +1256,7 @@ class EdxForumScrubber(object):
         :returns: body with all phone number-like substrings replaced by <phoneRedac>
         :rtype: String
         '''
-        #re from stackoverflow. seems to do an awesome job at capturing all phone nos :)
-        s='((?:(?:\+?1\s*(?:[.-]\s*)?)?(?:\(\s*([2-9]1[02-9]|[2-9][02-8]1|[2-9][02-8][02-9])\s*\)|([2-9]1[02-9]|[2-9][02-8]1|[2-9][02-8][02-9]))\s*(?:[.-]\s*)?)?([2-9]1[02-9]|[2-9][02-9]1|[2-9][02-9]{2})\s*(?:[.-]\s*)?([0-9]{4})(?:\s*(?:#|x\.?|ext\.?|extension)\s*(\d+))?)'
-        match=re.findall(s,body)
-        for phoneMatchHit in match:
-            body=body.replace(phoneMatchHit[0],"<phoneRedac>")
-        return body
+        return EdxForumScrubber.phoneRedactor.redact(body)
 
     def prune_zipcode(self, body):
         '''
@@ -393,40 +1266,23 @@ class EdxForumScrubber(object):
         :param body: forum post
         :type body: String
         '''
-        s='\d{5}(?:[-\s]\d{4})?'
-        match=re.findall(s,body)
-        for zipcodeMatchHit in match:
-            body=body.replace(zipcodeMatchHit[0],"<zipRedac>")
-        return body
+        return EdxForumScrubber.zipRedactor.redact(body)
 
     def trimnames(self, body):
         '''
-        UNTESTED:
         Removes all person names known in the forum from the given
-        post. We currently return the body unchanged, because we
-        found that too many names match regular English words.
+        post: first names (where capitalized) and screen names of
+        everyone in the class. Only done if the scrubber was created
+        with redactClassmateNames=True; else the body is returned
+        unchanged. See NameRedactor in redaction.py for the matching
+        rules and the stop-list of common English words.
+
         :param body: forum post
         :type body: String
         '''
-        return body
-        #Trims all firstnames and last names from the body of the post.
-
-        #print 'processing body %s' %(body)
-        #print 'en %s' %(len(self.userSet))
-        s3=set(body.split())
-        s4=s3&self.userSet
-        #print 's4 is %s' %(s4)
-
-        for s in s4:
-            if len(s)>1 and s[0].isupper():
-                body = re.sub(r"\b%s\b" % s , "NAME_REMOVED", body)
-
-                #body=body.replace(s,"NAME_REMOVED")
-
-
-        return body
-
-
+        if self.nameRedactor is None:
+            return body
+        return self.nameRedactor.redact(body)
 
     def anonymizeRecord(self, mongoRecordObj):
         '''
@@ -442,158 +1298,355 @@ class EdxForumScrubber(object):
                   a simple transformation, which can be reversed in MySQL. That recovered number
                   can then be used as key into the UserGrade table in the private part of the data store where
                   the forum data is deposited.
+        Bodies that the same poster posted before are not redacted again;
+        the earlier result is taken from self.redactionMemo.
 
-        :param mongoRecordObj:
-        :type mongoRecordObj:
+        :param mongoRecordObj: the post; modified in place
+        :type mongoRecordObj: ForumRecord
         '''
 
-        body = mongoRecordObj['body']
-        body = self.prune_numbers(body)
-        body = self.prune_zipcode(body)
-
-        if EdxForumScrubber.compiledEmailPattern.match(body) is not None:
-            #print 'BODY before EMAIL STRIPING %posterNamePart \n'%(body);
-            match = re.findall(EdxForumScrubber.emailPattern, body)
-            new_body = " "
-            for emailMatchHit in match:
-                new_body += emailMatchHit[0] + " <emailRedac> " + emailMatchHit[-1] #print 'NEW BODY AFTER EMAIL STRIPING %posterNamePart \n'%(new_body);
+        stats = self.stats
+        # The same body by the same poster is always redacted the
+        # same way, so repeated bodies are looked up in the memo:
+        memoKey = None
+        memoized = None
+        if self.redactionMemo is not None and len(mongoRecordObj.body) <= EdxForumScrubber.REDACTION_MEMO_MAX_BODY_LEN:
+            startTime = time.time()
+            bodyBytes = mongoRecordObj.body.encode('utf-8') if isinstance(mongoRecordObj.body, unicode) else mongoRecordObj.body
+            memoKey = (hashlib.md5(bodyBytes).digest(), mongoRecordObj.forum_int_id)
+            memoized = self.redactionMemo.get(memoKey)
+            if memoized is not None:
+                stats.add('redactionMemoHit', time.time() - startTime)
+        if memoized is not None:
+            body, anon_screen_name = memoized
+        else:
+            body, anon_screen_name = self.redactBody(mongoRecordObj.body, mongoRecordObj.forum_int_id)
+            if memoKey is not None:
+                self.redactionMemo.put(memoKey, (body, anon_screen_name))
 
-            body = new_body
+        # Update the record instance with the modified body:
+        mongoRecordObj.body = body
+        mongoRecordObj.anon_screen_name = anon_screen_name
 
-        # Redact poster'posterNamePart fullName from the post;
-        # get tuple (fullUserName, screenName, anon_screen_name) from
-        # the fullName cache (which is keyed off user_int_id):
-        fullName, screen_name, anon_screen_name = self.userCache.get(int(mongoRecordObj['forum_int_id']), ('', '', ''))
-            # If not allowed to use hash of other db parts,
-            # then drop anon_screen_name:
-        if not self.allowAnonScreenName:
-            anon_screen_name = '<anon_screen_name_redacted>'
+        # Scramble user_int_id to be different, but recoverable from
+        # the true user_int_id:
         try:
-        # Check whether any part of the poster's
-        # name is in the body, and redact if needed:
-            bodyLowerCase = body.lower()
-            for posterNamePart in fullName.split():
-                if len(posterNamePart) >= 3:
-                    posterNameLowered = posterNamePart.lower().encode('UTF-8', 'replace')
-                    if posterNameLowered in bodyLowerCase: # Look for this loop iteration's part of the name
-                        # the poster's name. The '\b' ensures that
-                        # partial matches don't happen: e.g. name
-                        # "Theo" shouldn't match "Theology"
-                        pat = re.compile(r'\b%s\b' % posterNamePart, re.IGNORECASE)
-                        body = pat.sub("<nameRedac_" + anon_screen_name + ">", body)
-
-        except Exception as e:
-            self.logInfo("Error while redacting poster name in forum post body: %s: %s" % (body, `e`))
+            startTime = time.time()
+            user_int_id = int(mongoRecordObj.forum_int_id)
+            mongoRecordObj.forum_uid = self.lookupForumUid(user_int_id)
+            mongoRecordObj.forum_int_id = None
+            stats.add('forumUidLookup', time.time() - startTime)
+        except IndexError:
+            self.logInfo("In conversion user_int_id to forum_uid via idInt2Forum(), did not obtain expected one-tuple.")
 
-        if len(screen_name) > 0:
-            screenNamePattern = re.compile(screen_name, re.IGNORECASE)
+        return mongoRecordObj
+
+    def redactBody(self, body, forumIntId):
+        '''
+        Run a post body through all redaction stages: phone
+        numbers, zip codes, and emails; the poster's name; and,
+        if requested, the names of classmates.
+
+        :param body: UTF-8 encoded post body
+        :type body: String
+        :param forumIntId: user_int_id of the poster
+        :type forumIntId: {int | String}
+        :returns: the redacted body, and the poster's anon_screen_name
+        :rtype: (String, String)
+        '''
+        stats = self.stats
+        # Phone numbers, zip codes, and email addresses, all in one scan:
+        startTime = time.time()
+        body = EdxForumScrubber.piiRedactor.redact(body)
+        stats.add('piiRedaction', time.time() - startTime)
+
+        # Redact the poster's name from the post. The pattern that
+        # finds all parts of the poster's full name, and the screen
+        # name, is built once per poster, and cached:
+        startTime = time.time()
+        anon_screen_name, posterNamePattern = self.getPosterNamePattern(int(forumIntId))
+        if posterNamePattern is not None:
             try:
-                body = screenNamePattern.sub("<nameRedac_" + anon_screen_name + ">", body)
-            except UnicodeDecodeError:
-                # Damn unicode!
-                body = screenNamePattern.sub("<nameRedac_" + anon_screen_name + ">", body.decode("utf8", "ignore"))
+                body = posterNamePattern.sub("<nameRedac_" + anon_screen_name + ">", body)
+            except Exception as e:
+                self.logInfo("Error while redacting poster name in forum post body: %s: %s" % (body, `e`))
+        stats.add('posterNameRedaction', time.time() - startTime)
 
         # Trim the name of anyone in the class from the
-        # post. This method currently does nothing, b/c
-        # some of the names people give are very common
-        # English words: This method currently does nothing.
-        # Its implementation removes too much:
-        body = self.trimnames(body)
-
-        # Update the record instance with the modified body:
-        mongoRecordObj['body'] = body
-        mongoRecordObj['anon_screen_name'] = anon_screen_name
+        # post. Does nothing unless redactClassmateNames
+        # was requested, b/c some of the names people give
+        # are very common English words:
+        if self.nameRedactor is not None:
+            startTime = time.time()
+            body = self.trimnames(body)
+            stats.add('classmateNameRedaction', time.time() - startTime)
+        return (body, anon_screen_name)
+
+    def collectAuthorIds(self, mongodb):
+        '''
+        Return the set of distinct user_int_ids of all posters
+        in the given source of forum posts. Sources that can
+        produce distinct values themselves (BsonForumReader)
+        are asked to do so. Others are scanned once.
+
+        :param mongodb: source of posts
+        :type mongodb: {MongoDB | BsonForumReader}
+        :returns: set of user_int_ids
+        :rtype: set
+        '''
+        # Each source is only scanned once:
+        if self.authorIdsSource is mongodb:
+            return self.authorIds
+        sourceDistinct = getattr(mongodb, 'distinctValues', None)
+        if sourceDistinct is not None:
+            rawAuthorIds = sourceDistinct('author_id')
+        else:
+            rawAuthorIds = set([mongoForumRec.get('author_id') for mongoForumRec in mongodb.query({})])
+        authorIds = set()
+        for rawAuthorId in rawAuthorIds:
+            try:
+                authorIds.add(int(rawAuthorId))
+            except (TypeError, ValueError):
+                self.logInfo("Author id '%s' is not an integer; skipping it." % str(rawAuthorId))
+        self.logInfo("Found %d distinct posters" % len(authorIds))
+        self.authorIds = authorIds
+        self.authorIdsSource = mongodb
+        return authorIds
+
+    def prefetchForumUids(self, userIntIds):
+        '''
+        Convert the given user_int_ids to forum_uids with a single
+        set-based query, and remember the results in self.forumUidCache.
+        The ids are loaded into a temporary table, which is then
+        selected through EdxPrivate.idInt2Forum().
 
-        # Scramble user_int_id to be different, but recoverable from
-        # the true user_int_id:
+        :param userIntIds: user_int_ids of posters
+        :type userIntIds: set
+        '''
+        userIntIds = [userIntId for userIntId in userIntIds if userIntId not in self.forumUidCache]
+        if len(userIntIds) == 0:
+            return
+        self.logInfo("Prefetching forum_uids for %d posters" % len(userIntIds))
         try:
-            user_int_id = int(mongoRecordObj['forum_int_id'])
-            forum_uid = self.mydb.query('SELECT EdxPrivate.idInt2Forum(%s);' % str(user_int_id)).next()
-            mongoRecordObj['forum_uid'] = forum_uid;
-            del mongoRecordObj['forum_int_id']
+            self.mydb.execute('DROP TEMPORARY TABLE IF EXISTS ForumUidPrefetch;')
+            self.mydb.execute('CREATE TEMPORARY TABLE ForumUidPrefetch (user_int_id int(11) NOT NULL PRIMARY KEY);')
+            chunkSize = EdxForumScrubber.FORUM_UID_PREFETCH_CHUNK
+            for chunkStart in range(0, len(userIntIds), chunkSize):
+                self.mydb.bulkInsert('ForumUidPrefetch',
+                                     ('user_int_id',),
+                                     [(userIntId,) for userIntId in userIntIds[chunkStart:chunkStart + chunkSize]])
+            for userIntId, forum_uid in self.mydb.query('SELECT user_int_id, EdxPrivate.idInt2Forum(user_int_id) FROM ForumUidPrefetch;'):
+                self.forumUidCache[int(userIntId)] = forum_uid
+            self.mydb.execute('DROP TEMPORARY TABLE IF EXISTS ForumUidPrefetch;')
+        except MySQLdb.Error as e:
+            # Not fatal: lookupForumUid() converts
+            # the ids one at a time instead:
+            self.logErr("Could not prefetch forum_uids; will convert one poster at a time: %s" % `e`)
+        # Ensure the cache is complete, so that anonymization
+        # workers never need to query MySQL:
+        for userIntId in userIntIds:
+            if userIntId not in self.forumUidCache:
+                self.lookupForumUid(userIntId)
+        self.logInfo("Prefetched %d forum_uids" % len(self.forumUidCache))
+
+    def lookupForumUid(self, user_int_id):
+        '''
+        Return the forum_uid for the given user_int_id. Normally
+        found in self.forumUidCache. Ids that were not prefetched
+        are converted via EdxPrivate.idInt2Forum(), and added to
+        the cache.
+
+        :param user_int_id: platform user id of a poster
+        :type user_int_id: int
+        :returns: the scrambled, but recoverable forum_uid
+        :rtype: String
+        '''
+        try:
+            return self.forumUidCache[user_int_id]
         except KeyError:
-            self.logInfo("Expected a value in mongo record field 'forum_int_id', but that field not found.")
-        except IndexError:
-            self.logInfo("In conversion user_int_id to forum_uid via idInt2Forum(), did not obtain expected one-tuple.")
+            forum_uid = self.mydb.query('SELECT EdxPrivate.idInt2Forum(%s);' % str(user_int_id)).next()[0]
+            self.forumUidCache[user_int_id] = forum_uid
+            return forum_uid
 
-        return mongoRecordObj
+    def getPosterNamePattern(self, forum_int_id):
+        '''
+        Return the anon_screen_name to use in redaction tokens for the
+        given poster, and one compiled pattern that matches each part
+        of the poster's full name (whole words of at least 3 letters),
+        as well as the poster's screen name, ignoring case. The pattern
+        is None if the poster has no known name. Results are kept in
+        self.posterNameCache, an LRU cache keyed by forum_int_id.
+
+        :param forum_int_id: platform user id of the poster
+        :type forum_int_id: int
+        :returns: anon_screen_name and name pattern
+        :rtype: (String, {re.RegexObject | None})
+        '''
+        cacheEntry = self.posterNameCache.get(forum_int_id)
+        if cacheEntry is not None:
+            return cacheEntry
+
+        # Get tuple (fullUserName, screenName, anon_screen_name) from
+        # the user cache (which is keyed off user_int_id):
+        fullName, screen_name, anon_screen_name = self.userCache.get(forum_int_id, ('', '', ''))
+        # If not allowed to use hash of other db parts,
+        # then drop anon_screen_name:
+        if not self.allowAnonScreenName:
+            anon_screen_name = '<anon_screen_name_redacted>'
+
+        # Bodies are UTF-8 encoded by the time they are
+        # anonymized; so must be the names:
+        alternatives = []
+        for posterNamePart in fullName.split():
+            if len(posterNamePart) >= 3:
+                if isinstance(posterNamePart, unicode):
+                    posterNamePart = posterNamePart.encode('UTF-8', 'replace')
+                # The '\b' ensures that partial matches don't happen:
+                # e.g. name "Theo" shouldn't match "Theology"
+                alternatives.append(r'\b%s\b' % re.escape(posterNamePart))
+        if len(screen_name) > 0:
+            if isinstance(screen_name, unicode):
+                screen_name = screen_name.encode('UTF-8', 'replace')
+            alternatives.append(re.escape(screen_name))
+
+        posterNamePattern = re.compile('|'.join(alternatives), re.IGNORECASE) if len(alternatives) > 0 else None
+        cacheEntry = (anon_screen_name, posterNamePattern)
+        self.posterNameCache.put(forum_int_id, cacheEntry)
+        return cacheEntry
 
     def insert_content_record(self, mysqlDbObj, mysqlTableName, mongoRecordObj):
         '''
         Given all fields of one forum post record, anonymize the post, if self.anonymize is True,
-        and insert the result into EdxForum.contents.
+        and hand the result to self.writer for insertion into EdxForum.contents. The
+        writer inserts posts in batches; forumMongoToRelational() flushes the last batch.
 
         :param mysqlDbObj: MySQLDB instance into which to place transformed forum posts (see pymysql_utils)
         :type mysqlDbObj: MySQLDB
         :param mysqlTableName: Name of table into which record is to be inserted. Ex: 'contents'
         :type mysqlTalbeName: String
         :param mongoRecordObj: a Python object that contains the Forum record fields we export.
-            These instances behave like dicts.
-        :type _type: MongoRecord
+        :type _type: ForumRecord
         '''
 
-        # # Deal with line breaks and commas in forum post body
-        mongoRecordObj['body'] = mongoRecordObj['body'].replace('\n', ' ').replace('\"', "'")
-        # mongoRecordObj['body'] = '"%s"' % mongoRecordObj['body']
-        # mongoRecordObj['votes'] = '"%s"' % mongoRecordObj['votes']
-        # mongoRecordObj['up'] = '"%s"' % mongoRecordObj['up']
-        # mongoRecordObj['down'] = '"%s"' % mongoRecordObj['down']
+        rowTuple, mongoRecordObj = self.prepareContentRecord(mongoRecordObj)
 
-        # Ensure body is UTF-8 only (again!).
-        # I don't know why the encoding we do
-        # in makeDict() isn't enough, but it's not.
-        # Who the hell knows with these encodings:
-        mongoRecordObj['body'] = mongoRecordObj['body'].encode('utf-8').strip();
+        # The writer inserts the row with the next batch; rows
+        # MySQL refuses are reported through logInsertError():
+        self.lastPostId = mongoRecordObj.forum_post_id
+        startTime = time.time()
+        self.writer.write(rowTuple, mongoRecordObj)
+        self.stats.add('mysqlWrite', time.time() - startTime)
 
-        # If present: rename field '_id' to 'forum_post_id'
-        try:
-            mongoRecordObj['forum_post_id'] = mongoRecordObj['_id']
-            del mongoRecordObj['_id']
-        except KeyError:
-            pass
+        self.counter += 1;
+        self.reportProgress()
+
+    def prepareContentRecord(self, mongoRecordObj):
+        '''
+        Clean up the body of the given post, and anonymize the post
+        if self.anonymize is True. Does not touch MySQL as long as
+        all forum_uids were prefetched, so it is safe to call in
+        anonymization worker processes.
+
+        :param mongoRecordObj: the post
+        :type mongoRecordObj: ForumRecord
+        :returns: the post's column values in forum schema column order,
+            and the (possibly anonymized) post itself
+        :rtype: ((<any>), ForumRecord)
+        '''
+
+        # Deal with line breaks and double quotes in forum post body.
+        # Ensure body is UTF-8 only (again!). I don't know why
+        # the decoding in ForumRecord isn't enough, but it's not.
+        # Who the hell knows with these encodings:
+        startTime = time.time()
+        mongoRecordObj.body = mongoRecordObj.body.replace('\n', ' ').replace('\"', "'").encode('utf-8').strip()
+        self.stats.add('bodyCleanup', time.time() - startTime)
 
         if self.anonymize:
             mongoRecordObj = self.anonymizeRecord(mongoRecordObj)
+        else:
+            # Prefer the screen name the platform knows
+            # the poster by, if the poster is in the cache:
+            try:
+                userEntry = self.userCache.get(int(mongoRecordObj.forum_int_id))
+            except (TypeError, ValueError):
+                userEntry = None
+            if userEntry is not None and len(userEntry[1]) > 0:
+                mongoRecordObj.screen_name = userEntry[1]
 
-        try:
-            fullTblName = mysqlDbObj.dbName() + '.' + mysqlTableName
-            self.mydb.insert(fullTblName, mongoRecordObj)
-
-        except MySQLdb.Error as e:
-            self.logErr("MySql error while inserting record %d: author name %s created_at %s: %s" % \
-                         (self.counter, mongoRecordObj.getUserNameClear(), mongoRecordObj['created_at'], `e`))
-            self.logErr("   Corresponding column values: %s" % str(mongoRecordObj.items()))
-            self.logErr("   Original MongoDb obj: %s" % str(mongoRecordObj))
-            return
+        # Column values in table column order:
+        return (self.rowGetter(mongoRecordObj), mongoRecordObj)
 
-        self.counter += 1;
-        if(self.counter%100 == 0):
-            #self.logInfo('inserted record %d'%( self.counter))
-            # print '_type,anonymous,anonymous_to_peers,at_position_list,author_id,body,course_id,created_at,votes
-            #print '%d value \n'%(self.counter);
-            pass
+    def logInsertError(self, mongoRecordObj, recordNum, e):
+        '''
+        Called by the writer for each post that MySQL refused to insert.
+
+        :param mongoRecordObj: the refused post
+        :type mongoRecordObj: ForumRecord
+        :param recordNum: sequence number of the post in this run
+        :type recordNum: int
+        :param e: exception raised by the MySQL insert
+        :type e: MySQLdb.Error
+        '''
+        self.logErr("MySql error while inserting record %d: author name %s created_at %s: %s" % \
+                     (recordNum, mongoRecordObj.getUserNameClear(), mongoRecordObj.created_at, `e`))
+        self.logErr("   Corresponding column values: %s" % str(mongoRecordObj.items()))
+        self.logErr("   Original MongoDb obj: %s" % str(mongoRecordObj))
+        # Leave the post out of the saved hashes, so
+        # that the next run tries it again:
+        self.refusedPostKeys.add(postKey(mongoRecordObj.forum_post_id))
+
+    def logLoadError(self, rowDict, recordNum, e):
+        '''
+        Called by the LoadDataInfileWriter for each post that MySQL
+        skipped or changed while loading.
+
+        :param rowDict: column name --> value of the post as spooled
+        :type rowDict: {String : String}
+        :param recordNum: sequence number of the post in this run
+        :type recordNum: int
+        :param e: MySQL's warnings about the post
+        :type e: MySQLdb.Warning
+        '''
+        self.logErr("MySql warning while loading record %d: forum_post_id %s created_at %s: %s" % \
+                     (recordNum, rowDict.get('forum_post_id'), rowDict.get('created_at'), `e`))
+        self.logErr("   Corresponding column values: %s" % str(rowDict))
+        # Leave the post out of the saved hashes, so
+        # that the next run tries it again:
+        self.refusedPostKeys.add(postKey(rowDict.get('forum_post_id')))
+
+    def trimForumSchema(self, anonymize):
+        '''
+        Either 'anon_screen_name' or 'screen_name' are removed
+        from the schema, depending on whether we are to anonymize
+        or not.
+        '''
+        if anonymize:
+            EdxForumScrubber.forumSchema.pop('screen_name', None)
+        else:
+            EdxForumScrubber.forumSchema.pop('anon_screen_name', None)
 
-    def createForumTable(self, anonymize):
+    def createForumTable(self, anonymize, ifNotExists=False, tableName=None):
         '''
-        Create an empty EdxForum.contents table. Requires
-        CREATE privileges;
+        Create an empty EdxForum table for the posts, named
+        self.forumTableName. Requires CREATE privileges;
 
         :param anonymize: if true, column header for forum poster
             will be 'anon_screen_name', else it will be 'screen_name'
         :type anonymize: Boolean
+        :param ifNotExists: if True, an existing table is left alone
+        :type ifNotExists: Boolean
+        :param tableName: name of the table to create. Default: self.forumTableName
+        :type tableName: String
         '''
+        if tableName is None:
+            tableName = self.forumTableName
 
-        # Either 'anon_screen_name' or 'screen_name' are removed
-        # from the schema, depending on whether we are to anonymize
-        # or not:
-        if anonymize:
-            del EdxForumScrubber.forumSchema['screen_name']
-        else:
-            del EdxForumScrubber.forumSchema['anon_screen_name']
+        self.trimForumSchema(anonymize)
 
         # Construct a MySQL CREATE TABLE command, using the
         # forum schema in EdxForumScrubber.forumSchema:
-        createCmd = "CREATE TABLE contents ("
+        createCmd = "CREATE TABLE %s%s (" % ('IF NOT EXISTS ' if ifNotExists else '', tableName)
         for colName in EdxForumScrubber.forumSchema.keys():
             createCmd += colName + ' ' + EdxForumScrubber.forumSchema.get(colName) + ','
 
@@ -603,23 +1656,122 @@ class EdxForumScrubber(object):
 
         self.mydb.execute(createCmd)
 
-    def ensureSchemaAdherence(self, mongoObj):
+    def ensureForumPostIdIndex(self, tableName=None):
         '''
-        Ensure that given mongoObj has all forum schema's colums
-        as a field. If not present, field is added with value
-        set to None. If already present, the field is unchanged.
-        Reason for doing this: If the mongo object has missing
-        fields, then there won't be a corresponding column in
-        the .csv file for row. This would shift cols left in,
-        for instance, Excel.
+        Incremental runs replace posts by forum_post_id. Index
+        that column, unless an earlier run already did.
 
-        :param mongoObj:
-        :type mongoObj:
+        :param tableName: table to index. Default: self.forumTableName
+        :type tableName: String
         '''
+        if tableName is None:
+            tableName = self.forumTableName
+        if 'forum_post_id' in self.indexedColumns(tableName):
+            return
+        self.logInfo("Indexing %s.forum_post_id for incremental loads" % tableName)
+        self.mydb.execute('ALTER TABLE %s ADD INDEX forumPostIdIdx (forum_post_id);' % tableName)
 
-        for colName in EdxForumScrubber.forumSchema.keys():
-            # Default value: empty string:
-            mongoObj.setdefault(colName, '')
+    def indexedColumns(self, tableName):
+        '''
+        Return the names of the columns of the given table
+        in the forum db that are covered by some index.
+
+        :rtype: set
+        '''
+        return set([colName for (colName,) in
+                    self.mydb.query("SELECT DISTINCT column_name FROM information_schema.statistics " +
+                                    "WHERE table_schema = '%s' AND table_name = '%s';" %
+                                    (self.mydb.dbName(), tableName))])
+
+    def buildDeferredIndexes(self, tableName):
+        '''
+        Add the DEFERRED_INDEXES to the freshly loaded table, and
+        the forum_post_id index that skipUnchanged runs need. All
+        are added by one ALTER TABLE, so that MySQL builds them
+        in a single pass over the rows, sorting rather than
+        inserting one key at a time.
+
+        :param tableName: table in the forum db to index
+        :type tableName: String
+        '''
+        indexes = OrderedDict(EdxForumScrubber.DEFERRED_INDEXES)
+        if self.skipUnchanged:
+            indexes['forumPostIdIdx'] = 'forum_post_id'
+        indexedColumns = self.indexedColumns(tableName)
+        indexClauses = ['ADD INDEX %s (%s)' % (indexName, colName)
+                        for indexName, colName in indexes.items() if colName not in indexedColumns]
+        if len(indexClauses) == 0:
+            return
+        self.logInfo("Indexing %s on %d columns" % (tableName, len(indexClauses)))
+        startTime = time.time()
+        self.mydb.execute('ALTER TABLE %s %s;' % (tableName, ', '.join(indexClauses)))
+        self.logInfo("Indexed %s in %.1f seconds" % (tableName, time.time() - startTime))
+
+    def tableExists(self, tableName):
+        numTables = self.mydb.query("SELECT COUNT(*) FROM information_schema.tables " +
+                                    "WHERE table_schema = '%s' AND table_name = '%s';" %
+                                    (self.mydb.dbName(), tableName)).next()[0]
+        return numTables > 0
+
+    def swapInStagingTable(self, stagingTableName=None):
+        '''
+        After a staged load: index the staging table, and swap it in
+        for the forum table. Both renames happen in one RENAME TABLE,
+        which is atomic; readers see either all old posts or all new
+        ones. The old forum table is dropped afterwards.
+
+        :param stagingTableName: the table that was loaded. Default:
+            self.loadTableName. course_driver.py names the staging table
+            that its courses' scrubbers filled.
+        :type stagingTableName: String
+        '''
+        if stagingTableName is None:
+            stagingTableName = self.loadTableName
+        self.buildDeferredIndexes(stagingTableName)
+        retiredTableName = self.forumTableName + EdxForumScrubber.RETIRED_TABLE_SUFFIX
+        if self.tableExists(self.forumTableName):
+            self.mydb.dropTable(self.mydb.dbName() + '.' + retiredTableName)
+            self.mydb.execute('RENAME TABLE %s TO %s, %s TO %s;' %
+                              (self.forumTableName, retiredTableName, stagingTableName, self.forumTableName))
+            self.mydb.dropTable(self.mydb.dbName() + '.' + retiredTableName)
+        else:
+            self.mydb.execute('RENAME TABLE %s TO %s;' % (stagingTableName, self.forumTableName))
+        self.logInfo("Swapped %s in for %s" % (stagingTableName, self.forumTableName))
+        self.loadTableName = self.forumTableName
+
+    def createWatermarkTable(self):
+        self.mydb.execute('CREATE TABLE IF NOT EXISTS %s (' % EdxForumScrubber.WATERMARK_TABLE +
+                          'course_display_name varchar(100) NOT NULL PRIMARY KEY, ' +
+                          'high_water_mark varchar(26) NOT NULL) engine=MyISAM;')
+
+    def loadHighWaterMarks(self):
+        '''
+        Return the high-water marks that earlier incremental runs left.
+
+        :returns: course_display_name --> normalized time stamp of latest loaded post
+        :rtype: {String : String}
+        '''
+        highWaterMarks = {}
+        for courseName, highWaterMark in self.mydb.query('SELECT course_display_name, high_water_mark FROM %s;' %
+                                                         EdxForumScrubber.WATERMARK_TABLE):
+            highWaterMarks[courseName] = highWaterMark
+        self.logInfo("Found high-water marks for %d courses" % len(highWaterMarks))
+        return highWaterMarks
+
+    def saveHighWaterMarks(self, highWaterMarks):
+        '''
+        Remember how far this run got in each course. Called
+        only after all posts have been written, so that a failed
+        run is redone in full by the next one.
+
+        :param highWaterMarks: course_display_name --> normalized time stamp of latest loaded post
+        :type highWaterMarks: {String : String}
+        '''
+        for courseName, highWaterMark in highWaterMarks.items():
+            self.mydb.execute("REPLACE INTO %s (course_display_name, high_water_mark) VALUES ('%s', '%s');" %
+                              (EdxForumScrubber.WATERMARK_TABLE,
+                               MySQLdb.escape_string(str(courseName)),
+                               MySQLdb.escape_string(highWaterMark)))
 
 #     def prepLogging(self):
 #         logFileName = 'forum_%s.log'%(datetime.now().strftime('%Y-%m-%d-%H-%M-%S'))
@@ -633,7 +1785,9 @@ class EdxForumScrubber(object):
         '''
 
         loggingLevel = logging.INFO
-        logFileName = 'forum_%s.log'%(datetime.now().strftime('%Y-%m-%d-%H-%M-%S'))
+        # The pid tells apart the logs of scrubbers that start in the
+        # same second, such as those of course_driver.py:
+        logFileName = 'forum_%s_%d.log'%(datetime.now().strftime('%Y-%m-%d-%H-%M-%S'), os.getpid())
         self.logFilePath = os.path.join(EdxForumScrubber.LOG_DIR, logFileName)
 
         self.logger = logging.getLogger(os.path.basename(__file__))
@@ -667,75 +1821,124 @@ class EdxForumScrubber(object):
     def logErr(self, msg):
         self.logger.error(msg)
 
-class MongoRecord(DictMixin):
+# Scrubber copy used by anonymization worker processes.
+# See EdxForumScrubber.anonymizeInParallel():
+_workerScrubber = None
+
+def _initAnonymizationWorker(scrubber):
+    '''
+    Runs once in each freshly forked anonymization worker.
+    The worker inherits the parent's MySQL connection with
+    the scrubber; make sure it is never used here.
+    '''
+    global _workerScrubber
+    _workerScrubber = scrubber
+    _workerScrubber.mydb = None
+    _workerScrubber.writer = None
+    # Stage times are reported back to the parent with each batch:
+    _workerScrubber.stats = StageStats()
+
+def _anonymizeBatch(mongoForumRecs):
+    '''
+    Worker side of EdxForumScrubber.anonymizeInParallel(): turn
+    a list of raw posts into a list of (rowTuple, ForumRecord).
+    Returns that list, and the worker's stage times for the batch.
+    '''
+    resultBatch = [_workerScrubber.prepareContentRecord(_workerScrubber.makeMongoRecord(mongoForumRec))
+                   for mongoForumRec in mongoForumRecs]
+    return (resultBatch, _workerScrubber.stats.takeTotals())
+
+class ForumRecord(object):
+    '''
+    One forum post on its way from MongoDB to a table row. There
+    is one slot per forum schema column, so posts need no dict
+    of their own, and prepareContentRecord() can pull a row out of
+    a record with a single attrgetter. Posts are turned into records
+    by the million; keep this class lean.
+    '''
+
+    # All forum schema columns (before createForumTable() removes
+    # one of the screen name columns), plus the poster's platform
+    # id and screen name in the clear:
+    __slots__ = tuple(EdxForumScrubber.forumSchema.keys()) + ('forum_int_id', 'user_name_clear')
 
     def __init__(self, rawMongoStruct):
-        self.nameValueDict = self.makeDict(rawMongoStruct)
+        '''
+        Convert the raw Mongo name/value pairs, converting types
+        where needed. Columns the raw post does not provide are
+        empty strings. The anon_screen_name and screen_name col values
+        are initialized from the true poster screen name. Only one of
+        them is in the table (see trimForumSchema()); anonymization of
+        anon_screen_name happens later.
+
+        :param rawMongoStruct: raw forum post
+        :type rawMongoStruct: dict
+        '''
+        get = rawMongoStruct.get
+        self.forum_post_id = str(get('_id'))
+        self.anon_screen_name = str(get('author_username', ''))
+        self.screen_name = self.anon_screen_name
+        self.type = str(get('_type'))
+        self.anonymous = str(get('anonymous'))
+        self.anonymous_to_peers = str(get('anonymous_to_peers'))
+        self.at_position_list = str(get('at_position_list'))
+        self.forum_uid = ''
+        body = re.sub(EdxForumScrubber.doublQuoteReplPattern, '\\"', get('body'))
+        if not isinstance(body, unicode):
+            # If body is not already Unicode, decode it:
+            body = unicode(body, 'UTF-8', 'replace')
+        self.body = body
+        self.course_display_name = str(get('course_id'))
+        self.created_at = str(get('created_at'))
+        votesObject = get('votes')
+        self.votes = str(votesObject)
+        if votesObject is not None:
+            self.count = votesObject.get('count')
+            self.down_count = votesObject.get('down_count')
+            self.up_count = votesObject.get('up_count')
+            self.up = str(votesObject.get('up')).replace("u","")
+            self.down = str(votesObject.get('down')).replace("u","")
+        else:
+            self.count = self.down_count = self.up_count = self.down = ''
+            # As ever, posts without votes are marked in the up column:
+            self.up = '-1'
+        self.comment_thread_id = str(get('comment_thread_id'))
+        self.parent_id = str(get('parent_id'))
+        self.parent_ids = str(get('parent_ids'))
+        self.sk = str(get('sk'))
+        self.confusion = ''
+        self.happiness = ''
+        self.forum_int_id = get('author_id') # numeric id
         # Get the screen name in the clear:
-        self.user_name_clear = rawMongoStruct.get('author_username')
+        self.user_name_clear = get('author_username')
 
     def getUserNameClear(self):
         return self.user_name_clear
 
-    def makeDict(self, mongoRecordStruct):
-
-        # Create a dict of the raw Mongo name/value pairs, converting
-        # types where needed. Recall: dict.get(key,[default]) returns
-        # None if no default is provided. Need an ordered dict of these
-        # column names, so that they match up with column values elsewhere.
-        # The anon_user_name col value is initialized from the true poster
-        # screen name. Anonymization of this column happens later:
-        mongoRecordDict = OrderedDict(
-                         {
-                           '_id' : str(mongoRecordStruct.get('_id')),
-                           'anon_screen_name' : str(mongoRecordStruct.get('author_username', '')),
-                           'type' : str(mongoRecordStruct.get('_type')),
-                		   'anonymous' : str(mongoRecordStruct.get('anonymous')),
-                		   'anonymous_to_peers' : str(mongoRecordStruct.get('anonymous_to_peers')),
-                		   'at_position_list' : str(mongoRecordStruct.get('at_position_list')),
-                		   'forum_int_id' : mongoRecordStruct.get('author_id'), # numeric id
-                           'body' : re.sub(EdxForumScrubber.doublQuoteReplPattern, '\\"', mongoRecordStruct.get('body')),
-                		   'course_display_name' : str(mongoRecordStruct.get('course_id')),
-                		   'created_at' : str(mongoRecordStruct.get('created_at')),
-                		   'votes' : str(mongoRecordStruct.get('votes')),
-                           })
+    def __getitem__(self, key):
         try:
-            # If body is not already UTF-8, encode it:
-            mongoRecordDict['body'] = unicode(mongoRecordDict['body'], 'UTF-8', 'replace')
-        except TypeError:
-            # Body was already in Unicode, so all is well:
-            pass
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
 
-        votesObject= mongoRecordStruct.get('votes')
-        if votesObject is not None:
-            mongoRecordDict['count'] = votesObject.get('count')
-            mongoRecordDict['down_count'] = votesObject.get('down_count')
-            mongoRecordDict['up_count'] = votesObject.get('up_count')
-            mongoRecordDict['up'] = str(votesObject.get('up'))
-            if mongoRecordDict['up'] is not None:
-                mongoRecordDict['up'] = mongoRecordDict['up'].replace("u","")
-            mongoRecordDict['down'] = str(votesObject.get('down'))
-            if mongoRecordDict['down'] is not None:
-                mongoRecordDict['down'] = mongoRecordDict['down'].replace("u","")
-
-        mongoRecordDict['sk'] = str(mongoRecordStruct.get('sk'))
-        mongoRecordDict['comment_thread_id'] = str(mongoRecordStruct.get('comment_thread_id'))
-        mongoRecordDict['parent_id'] = str(mongoRecordStruct.get('parent_id'))
-        mongoRecordDict['parent_ids'] = str(mongoRecordStruct.get('parent_ids'))
-
-        return mongoRecordDict
+    def keys(self):
+        return list(ForumRecord.__slots__)
 
-    def __getitem__(self, key):
-        return self.nameValueDict[key]
+    def items(self):
+        return [(key, getattr(self, key)) for key in ForumRecord.__slots__]
 
-    def __setitem__(self, key, value):
-        self.nameValueDict[key] = value
+    def __repr__(self):
+        return str(dict(self.items()))
 
-    def __delitem__(self, key):
-        del self.nameValueDict[key]
+    # Slotted instances have no __dict__ to pickle. Records
+    # travel between anonymization worker processes:
 
-    def keys(self):
-        return self.nameValueDict.keys()
+    def __getstate__(self):
+        return tuple([getattr(self, key) for key in ForumRecord.__slots__])
+
+    def __setstate__(self, state):
+        for key, value in zip(ForumRecord.__slots__, state):
+            setattr(self, key, value)
 
 #        ObjectId("519461545924670200000005")
 #    ],
@@ -765,6 +1968,154 @@ if __name__ == '__main__':
                         action='store_true',
                         default=False
                         );
+    parser.add_argument('-m', '--viaMongo',
+                        help='Restore the .bson file into a local MongoDB, and read posts from there,\n' +
+                             'rather than decoding the .bson file directly. Default: False',
+                        action='store_true',
+                        default=False
+                        );
+    parser.add_argument('--shards',
+                        help='With --viaMongo: number of _id ranges of the collection read\n' +
+                             'through parallel cursors. Default: 1',
+                        type=int,
+                        default=1
+                        );
+    parser.add_argument('--cursorBatchSize',
+                        help='With --viaMongo: posts fetched per cursor round trip. Default: %d' %
+                             ShardedMongoReader.DEFAULT_CURSOR_BATCH_SIZE,
+                        type=int,
+                        default=ShardedMongoReader.DEFAULT_CURSOR_BATCH_SIZE
+                        );
+    parser.add_argument('--idOrder',
+                        help='With --viaMongo and a single shard: read posts in _id order rather than\n' +
+                             'the natural order of the collection. Default: natural order',
+                        action='store_true',
+                        default=False
+                        );
+    parser.add_argument('--cursorTimeout',
+                        help='With --viaMongo: let the server close cursors that are idle for ten minutes.\n' +
+                             'Default: cursors never time out',
+                        action='store_true',
+                        default=False
+                        );
+    parser.add_argument('-b', '--batchSize',
+                        help='Number of posts inserted into MySQL with a single INSERT statement. Default: %d' % BatchInsertWriter.DEFAULT_BATCH_SIZE,
+                        type=int,
+                        default=BatchInsertWriter.DEFAULT_BATCH_SIZE
+                        );
+    parser.add_argument('-l', '--loadInfile',
+                        help='Spool posts into a tab-separated file, and load it with LOAD DATA LOCAL INFILE,\n' +
+                             'rather than INSERTing them. Fastest for full reloads. Default: False',
+                        action='store_true',
+                        default=False
+                        );
+    parser.add_argument('--spoolDir',
+                        help='Directory for --loadInfile spool files. Default: system temp directory',
+                        default=None
+                        );
+    parser.add_argument('-w', '--workers',
+                        help='Number of processes that anonymize posts in parallel. Default: 1',
+                        type=int,
+                        default=1
+                        );
+    parser.add_argument('--pipeline',
+                        help='Read, anonymize, and write posts concurrently, in separate threads. Default: False',
+                        action='store_true',
+                        default=False
+                        );
+    parser.add_argument('--statsInterval',
+                        help='Seconds between progress reports (records/sec, time per conversion stage)\n' +
+                             'in the log. 0: only report at the end. Default: %d' % EdxForumScrubber.STATS_INTERVAL,
+                        type=int,
+                        default=EdxForumScrubber.STATS_INTERVAL
+                        );
+    parser.add_argument('--parquetDir',
+                        help='Write the anonymized posts into Parquet files under this directory,\n' +
+                             'partitioned by course and month, rather than into MySQL. Default: MySQL',
+                        default=None
+                        );
+    parser.add_argument('--rowGroupSize',
+                        help='With --parquetDir: rows per Parquet file and row group. Default: %d' % ParquetWriter.DEFAULT_ROW_GROUP_SIZE,
+                        type=int,
+                        default=ParquetWriter.DEFAULT_ROW_GROUP_SIZE
+                        );
+    parser.add_argument('-u', '--skipUnchanged',
+                        help='Only convert posts that are new or changed since the previous --skipUnchanged\n' +
+                             'run; rows of unchanged posts stay in place. Default: False',
+                        action='store_true',
+                        default=False
+                        );
+    parser.add_argument('--postHashDir',
+                        help='Directory for the post hashes of --skipUnchanged runs. Default: %s' % EdxForumScrubber.POST_HASH_DIR,
+                        default=EdxForumScrubber.POST_HASH_DIR
+                        );
+    parser.add_argument('--staging',
+                        help='When rebuilding the forum table, load a staging table that is indexed and then\n' +
+                             'swapped in, rather than dropping the forum table up front and filling it in place.\n' +
+                             'Readers see the old posts until the new ones are complete. Default: False',
+                        action='store_true',
+                        default=False
+                        );
+    parser.add_argument('-c', '--redactClassmates',
+                        help='Redact first names and screen names of everyone in the class from all posts,\n' +
+                             'not just the poster\'s own name. Default: False',
+                        action='store_true',
+                        default=False
+                        );
+    parser.add_argument('--nameCacheSize',
+                        help='Number of posters whose name redaction pattern is cached. Default: %d' % EdxForumScrubber.POSTER_NAME_CACHE_SIZE,
+                        type=int,
+                        default=EdxForumScrubber.POSTER_NAME_CACHE_SIZE
+                        );
+    parser.add_argument('--redactionMemoSize',
+                        help='Number of redacted bodies remembered, so that repeated bodies by the same\n' +
+                             'poster are redacted only once. 0: off. Default: %d' % EdxForumScrubber.REDACTION_MEMO_SIZE,
+                        type=int,
+                        default=EdxForumScrubber.REDACTION_MEMO_SIZE
+                        );
+    parser.add_argument('--userCacheDir',
+                        help='Directory where the user cache is kept between runs. Default: %s' % EdxForumScrubber.USER_CACHE_DIR,
+                        default=EdxForumScrubber.USER_CACHE_DIR
+                        );
+    parser.add_argument('-i', '--incremental',
+                        help='Keep the forum table, and only load posts created or updated since\n' +
+                             'the previous incremental run. Changed posts replace their old version. Default: False',
+                        action='store_true',
+                        default=False
+                        );
+    parser.add_argument('--resume',
+                        help='Continue an interrupted conversion of the same .bson file from its\n' +
+                             'last checkpoint, rather than starting over. Default: False',
+                        action='store_true',
+                        default=False
+                        );
+    parser.add_argument('--checkpointDir',
+                        help='Directory for checkpoints of running conversions. Default: %s' % EdxForumScrubber.CHECKPOINT_DIR,
+                        default=EdxForumScrubber.CHECKPOINT_DIR
+                        );
+    parser.add_argument('--profile',
+                        help='Profile the conversion with cProfile. The profile is written next to\n' +
+                             'the log file, and the hottest functions are logged. Default: False',
+                        action='store_true',
+                        default=False
+                        );
+    parser.add_argument('--sampleRate',
+                        help='With --profile: use the low overhead sampling profiler instead of cProfile,\n' +
+                             'taking this many stack samples per second. Ex: %d' % ConversionProfiler.DEFAULT_SAMPLE_RATE,
+                        type=int,
+                        default=None
+                        );
+    parser.add_argument('--profileTopN',
+                        help='With --profile: number of hot functions listed in the log. Default: %d' % ConversionProfiler.DEFAULT_TOP_N,
+                        type=int,
+                        default=ConversionProfiler.DEFAULT_TOP_N
+                        );
+    parser.add_argument('-p', '--postersOnly',
+                        help='Pre-scan the .bson file for poster ids, and only load those users\n' +
+                             'into the user cache, rather than all users. Default: False',
+                        action='store_true',
+                        default=False
+                        );
     parser.add_argument('bson_filename',
                         help='Full path to MongoDB dump of Forum in .bson format.',
                         )
@@ -776,6 +2127,37 @@ if __name__ == '__main__':
 
     #*************
     #extractor = EdxForumScrubber(args.bson_filename, allowAnonScreenName=args.relatable)
-    extractor = EdxForumScrubber(args.bson_filename, allowAnonScreenName=True)
+    extractor = EdxForumScrubber(args.bson_filename, allowAnonScreenName=True,
+                                 loadViaMongo=args.viaMongo,
+                                 mongoShards=args.shards,
+                                 mongoCursorBatchSize=args.cursorBatchSize,
+                                 mongoIdOrder=args.idOrder,
+                                 mongoCursorTimeout=args.cursorTimeout,
+                                 insertBatchSize=args.batchSize,
+                                 bulkLoad=args.loadInfile,
+                                 spoolDir=args.spoolDir,
+                                 numWorkers=args.workers,
+                                 pipelined=args.pipeline,
+                                 redactClassmateNames=args.redactClassmates,
+                                 posterNameCacheSize=args.nameCacheSize,
+                                 redactionMemoSize=args.redactionMemoSize,
+                                 userCacheDir=args.userCacheDir,
+                                 usersFromDumpOnly=args.postersOnly,
+                                 incremental=args.incremental,
+                                 resume=args.resume,
+                                 checkpointDir=args.checkpointDir,
+                                 statsInterval=args.statsInterval,
+                                 parquetDir=args.parquetDir,
+                                 parquetRowGroupSize=args.rowGroupSize,
+                                 skipUnchanged=args.skipUnchanged,
+                                 postHashDir=args.postHashDir,
+                                 stagingSwap=args.staging)
     #*************
-    extractor.runConversion()
+    if args.profile:
+        if args.sampleRate is None:
+            profiler = ConversionProfiler(ConversionProfiler.DETERMINISTIC, topN=args.profileTopN)
+        else:
+            profiler = ConversionProfiler(ConversionProfiler.SAMPLING, sampleRate=args.sampleRate, topN=args.profileTopN)
+        extractor.runProfiledConversion(profiler)
+    else:
+        extractor.runConversion()
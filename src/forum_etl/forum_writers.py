@@ -0,0 +1,551 @@
+# Copyright (c) 2014, Stanford University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+Writers that take anonymized forum rows from EdxForumScrubber,
+and deposit them into their final home.
+
+Each writer accepts rows through write(), and must be given a
+final flush() once the last row was written. Rows are tuples whose
+values are in the column order that was passed to the writer's
+constructor; normally the column order of EdxForumScrubber.forumSchema.
+
+Given a replaceKeyCol, writers replace rather than add rows: before
+each batch goes in, table rows whose key column value equals one
+in the batch are deleted. That turns the writers into upserters
+for incremental runs. The key column should be indexed.
+
+Given a flushCallback, writers call it without arguments each time
+a batch has been sent to MySQL. All rows received so far are then
+in the table (or were refused).
+
+ParquetWriter deposits rows into partitioned Parquet files instead
+of MySQL. It needs pyarrow, which is only imported if installed.
+'''
+
+from datetime import datetime
+import MySQLdb
+import os
+import re
+import tempfile
+import urllib
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    # Only needed for ParquetWriter:
+    pyarrow = None
+
+# Number of key values per DELETE ... IN (...) statement
+# when replacing rows. See deleteRowsByKey():
+DELETE_CHUNK_SIZE = 1000
+
+def deleteRowsByKey(mysqlDbObj, fullTblName, keyColName, keys):
+    '''
+    Delete all rows whose keyColName value is among the given keys.
+
+    :param mysqlDbObj: MySQLDB instance (see pymysql_utils)
+    :type mysqlDbObj: MySQLDB
+    :param fullTblName: fully qualified table name. Ex.: 'EdxForum.contents'
+    :type fullTblName: String
+    :param keyColName: name of the key column. Ex.: 'forum_post_id'
+    :type keyColName: String
+    :param keys: key values of rows to delete
+    :type keys: [String]
+    '''
+    for chunkStart in range(0, len(keys), DELETE_CHUNK_SIZE):
+        keyList = ','.join(["'%s'" % MySQLdb.escape_string(str(key))
+                            for key in keys[chunkStart:chunkStart + DELETE_CHUNK_SIZE]])
+        mysqlDbObj.execute('DELETE FROM %s WHERE %s IN (%s);' % (fullTblName, keyColName, keyList))
+
+
+class BatchInsertWriter(object):
+    '''
+    Collects rows, and sends each batch of batchSize rows to
+    MySQL as a single multi-row INSERT. If a batch is refused,
+    its rows are inserted one at a time, so that only the offending
+    row(s) are lost. Each such row is reported to the rowErrorCallback
+    that was passed to the constructor.
+    '''
+
+    DEFAULT_BATCH_SIZE = 1000
+
+    def __init__(self, mysqlDbObj, fullTblName, colNames, batchSize=None, rowErrorCallback=None, replaceKeyCol=None,
+                 flushCallback=None):
+        '''
+        :param mysqlDbObj: MySQLDB instance into which rows are inserted (see pymysql_utils)
+        :type mysqlDbObj: MySQLDB
+        :param fullTblName: fully qualified table name. Ex.: 'EdxForum.contents'
+        :type fullTblName: String
+        :param colNames: column names in the order of the values in each row
+        :type colNames: [String]
+        :param batchSize: number of rows per INSERT statement. Default: DEFAULT_BATCH_SIZE
+        :type batchSize: int
+        :param rowErrorCallback: function called with (recordObj, recordNum, exception)
+            for every row that MySQL refuses when inserted by itself.
+        :type rowErrorCallback: function
+        :param replaceKeyCol: if provided, existing rows with the same value in this
+            column as a written row are replaced. Default: rows are only added.
+        :type replaceKeyCol: String
+        :param flushCallback: function called after each batch was sent to MySQL
+        :type flushCallback: function
+        '''
+        self.mysqlDbObj = mysqlDbObj
+        self.fullTblName = fullTblName
+        self.colNames = tuple(colNames)
+        self.batchSize = batchSize if batchSize is not None else BatchInsertWriter.DEFAULT_BATCH_SIZE
+        if self.batchSize < 1:
+            raise ValueError("Insert batch size must be at least 1; was %s" % str(self.batchSize))
+        self.rowErrorCallback = rowErrorCallback
+        self.replaceKeyCol = replaceKeyCol
+        if replaceKeyCol is not None:
+            self.keyColIndex = self.colNames.index(replaceKeyCol)
+        self.flushCallback = flushCallback
+
+        # Rows waiting to be inserted, and the objects
+        # they came from, for error reporting:
+        self.pendingRows = []
+        self.pendingRecordObjs = []
+        # Count of rows handed to write(), and of rows
+        # that actually made it into the table:
+        self.numRowsReceived = 0
+        self.numRowsWritten = 0
+
+    def write(self, rowTuple, recordObj=None):
+        '''
+        Queue one row for insertion. Sends the batch
+        to MySQL once batchSize rows are queued.
+
+        :param rowTuple: column values in colNames order
+        :type rowTuple: (<any>)
+        :param recordObj: object from which the row was created. Only
+            used to report insertion errors.
+        :type recordObj: <any>
+        '''
+        self.pendingRows.append(rowTuple)
+        self.pendingRecordObjs.append(recordObj)
+        self.numRowsReceived += 1
+        if len(self.pendingRows) >= self.batchSize:
+            self.flush()
+
+    def flush(self):
+        '''
+        Insert all queued rows.
+        '''
+        if len(self.pendingRows) == 0:
+            return
+        if self.replaceKeyCol is not None:
+            deleteRowsByKey(self.mysqlDbObj, self.fullTblName, self.replaceKeyCol,
+                            [rowTuple[self.keyColIndex] for rowTuple in self.pendingRows])
+        try:
+            self.mysqlDbObj.bulkInsert(self.fullTblName, self.colNames, self.pendingRows)
+            self.numRowsWritten += len(self.pendingRows)
+        except MySQLdb.Error:
+            # Some row in the batch is bad. Fall back to
+            # inserting one row at a time to find it:
+            self.insertRowByRow()
+        self.pendingRows = []
+        self.pendingRecordObjs = []
+        if self.flushCallback is not None:
+            self.flushCallback()
+
+    def insertRowByRow(self):
+        # Number of the first pending record among all
+        # records received so far:
+        firstRecordNum = self.numRowsReceived - len(self.pendingRows)
+        for offset, (rowTuple, recordObj) in enumerate(zip(self.pendingRows, self.pendingRecordObjs)):
+            try:
+                self.mysqlDbObj.insert(self.fullTblName, dict(zip(self.colNames, rowTuple)))
+                self.numRowsWritten += 1
+            except MySQLdb.Error as e:
+                if self.rowErrorCallback is not None:
+                    self.rowErrorCallback(recordObj, firstRecordNum + offset, e)
+
+    def close(self):
+        self.flush()
+
+
+class LoadDataInfileWriter(object):
+    '''
+    Streams rows into a tab-separated spool file, and loads
+    the file into MySQL with a single LOAD DATA LOCAL INFILE.
+    Large runs are split into spool chunks of at most
+    maxRowsPerChunk rows; each full chunk is loaded and
+    deleted before the next one is started.
+
+    Values are escaped for MySQL's default field and line
+    handling (FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\'
+    LINES TERMINATED BY '\\n'), so embedded tabs, newlines,
+    backslashes and quotes arrive in the table unchanged.
+    None is written as \\N, i.e. as SQL NULL.
+
+    The MySQL connection must permit LOCAL INFILE.
+
+    MySQL does not refuse a load for bad rows. It skips or truncates
+    them, and leaves a warning. After each load, the warnings that
+    name a row are reported to the rowErrorCallback, and only the
+    rows MySQL reports as loaded count as written.
+    '''
+
+    DEFAULT_ROWS_PER_CHUNK = 1000000
+
+    # Characters that have special meaning within a spool
+    # file field, and their escaped replacements. Backslash
+    # must be handled first:
+    ESCAPES = [('\\', '\\\\'),
+               ('\0', '\\0'),
+               ('\t', '\\t'),
+               ('\n', '\\n'),
+               ('\r', '\\r'),
+               ('\x1a', '\\Z')
+               ]
+
+    # Finds the row number in MySQL warnings such as "Data truncated
+    # for column 'body' at row 3" or "Row 3 was truncated; ...":
+    WARNING_ROW_PATTERN = re.compile(r'\b[Rr]ow (\d+)')
+
+    def __init__(self, mysqlDbObj, fullTblName, colNames, spoolDir=None, maxRowsPerChunk=None, logInfo=None, replaceKeyCol=None,
+                 flushCallback=None, rowErrorCallback=None):
+        '''
+        :param mysqlDbObj: MySQLDB instance into which rows are loaded (see pymysql_utils)
+        :type mysqlDbObj: MySQLDB
+        :param fullTblName: fully qualified table name. Ex.: 'EdxForum.contents'
+        :type fullTblName: String
+        :param colNames: column names in the order of the values in each row
+        :type colNames: [String]
+        :param spoolDir: directory for the spool files. Default: system temp dir
+        :type spoolDir: String
+        :param maxRowsPerChunk: number of rows after which the spool file is
+            loaded, and a new one is started. Default: DEFAULT_ROWS_PER_CHUNK
+        :type maxRowsPerChunk: int
+        :param logInfo: function for progress messages
+        :type logInfo: function
+        :param replaceKeyCol: if provided, existing rows with the same value in this
+            column as a written row are replaced. Default: rows are only added.
+        :type replaceKeyCol: String
+        :param flushCallback: function called after each batch was sent to MySQL
+        :type flushCallback: function
+        :param rowErrorCallback: function called with (column name --> spooled value,
+            recordNum, MySQLdb.Warning) for every row that MySQL skipped or changed
+            while loading. Record objects are not kept for the length of a chunk,
+            so the row's values stand in for them.
+        :type rowErrorCallback: function
+        '''
+        self.mysqlDbObj = mysqlDbObj
+        self.fullTblName = fullTblName
+        self.colNames = tuple(colNames)
+        self.rowErrorCallback = rowErrorCallback
+        self.spoolDir = spoolDir
+        self.maxRowsPerChunk = maxRowsPerChunk if maxRowsPerChunk is not None else LoadDataInfileWriter.DEFAULT_ROWS_PER_CHUNK
+        if self.maxRowsPerChunk < 1:
+            raise ValueError("Spool chunk size must be at least 1; was %s" % str(self.maxRowsPerChunk))
+        self.logInfo = logInfo
+        self.replaceKeyCol = replaceKeyCol
+        if replaceKeyCol is not None:
+            self.keyColIndex = self.colNames.index(replaceKeyCol)
+        self.flushCallback = flushCallback
+        # Key values of the rows in the current chunk; only
+        # kept when replacing:
+        self.chunkKeys = []
+
+        self.spoolFd = None
+        self.numRowsInChunk = 0
+        self.numRowsReceived = 0
+        self.numRowsWritten = 0
+
+    def write(self, rowTuple, recordObj=None):
+        '''
+        Append one row to the current spool chunk. The recordObj
+        is accepted for interface compatibility with BatchInsertWriter.
+        '''
+        if self.spoolFd is None:
+            self.spoolFd = tempfile.NamedTemporaryFile(prefix='forumSpool', suffix='.tsv', dir=self.spoolDir, delete=False)
+        self.spoolFd.write('\t'.join([LoadDataInfileWriter.escapeValue(value) for value in rowTuple]) + '\n')
+        if self.replaceKeyCol is not None:
+            self.chunkKeys.append(rowTuple[self.keyColIndex])
+        self.numRowsInChunk += 1
+        self.numRowsReceived += 1
+        if self.numRowsInChunk >= self.maxRowsPerChunk:
+            self.flush()
+
+    def flush(self):
+        '''
+        Load the current spool chunk into MySQL, and remove it.
+        '''
+        if self.spoolFd is None:
+            return
+        spoolFileName = self.spoolFd.name
+        self.spoolFd.close()
+        try:
+            if self.logInfo is not None:
+                self.logInfo("Bulk loading %d rows from %s into %s" % (self.numRowsInChunk, spoolFileName, self.fullTblName))
+            if self.replaceKeyCol is not None:
+                deleteRowsByKey(self.mysqlDbObj, self.fullTblName, self.replaceKeyCol, self.chunkKeys)
+            loadCmd = "LOAD DATA LOCAL INFILE '%s' INTO TABLE %s CHARACTER SET utf8 " % (spoolFileName, self.fullTblName) + \
+                      "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' " + \
+                      "(%s);" % ','.join(self.colNames)
+            connection = getattr(self.mysqlDbObj, 'connection', None)
+            if connection is None:
+                # No way to learn the outcome; assume all rows went in:
+                self.mysqlDbObj.execute(loadCmd)
+                self.numRowsWritten += self.numRowsInChunk
+            else:
+                self.loadAndCheck(connection, loadCmd, spoolFileName)
+            if self.flushCallback is not None:
+                self.flushCallback()
+        finally:
+            os.remove(spoolFileName)
+            self.spoolFd = None
+            self.numRowsInChunk = 0
+            self.chunkKeys = []
+
+    def loadAndCheck(self, connection, loadCmd, spoolFileName):
+        '''
+        Run the LOAD DATA statement on a cursor of the raw
+        connection. Count the rows MySQL loaded, and report
+        the rows it warned about.
+        '''
+        cursor = connection.cursor()
+        try:
+            cursor.execute(loadCmd)
+            numRowsLoaded = max(cursor.rowcount, 0)
+            cursor.execute('SHOW WARNINGS;')
+            mysqlWarnings = cursor.fetchall()
+        finally:
+            cursor.close()
+        connection.commit()
+        self.numRowsWritten += numRowsLoaded
+        if numRowsLoaded < self.numRowsInChunk and self.logInfo is not None:
+            self.logInfo("MySQL skipped %d of %d rows loaded into %s" %
+                         (self.numRowsInChunk - numRowsLoaded, self.numRowsInChunk, self.fullTblName))
+        if len(mysqlWarnings) == 0:
+            return
+        # Row number in the chunk --> warning messages:
+        rowWarnings = {}
+        for _, code, message in mysqlWarnings:
+            rowMatch = LoadDataInfileWriter.WARNING_ROW_PATTERN.search(message)
+            if rowMatch is None:
+                if self.logInfo is not None:
+                    self.logInfo("MySQL warning while loading %s: %s %s" % (self.fullTblName, code, message))
+                continue
+            rowWarnings.setdefault(int(rowMatch.group(1)), []).append('%s %s' % (code, message))
+        if self.rowErrorCallback is None or len(rowWarnings) == 0:
+            return
+        # Number of the chunk's first record among all records received:
+        firstRecordNum = self.numRowsReceived - self.numRowsInChunk
+        with open(spoolFileName, 'rb') as spoolFd:
+            for rowNum, line in enumerate(spoolFd, 1):
+                if rowNum in rowWarnings:
+                    self.rowErrorCallback(dict(zip(self.colNames, line.rstrip('\n').split('\t'))),
+                                          firstRecordNum + rowNum - 1,
+                                          MySQLdb.Warning('; '.join(rowWarnings[rowNum])))
+
+    def close(self):
+        self.flush()
+
+    @staticmethod
+    def escapeValue(value):
+        '''
+        Turn one column value into its spool file representation.
+
+        :param value: column value
+        :type value: {String | unicode | int | long | float | None}
+        :returns: UTF-8 encoded, escaped string
+        :rtype: String
+        '''
+        if value is None:
+            return '\\N'
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        else:
+            value = str(value)
+        for specialChar, replacement in LoadDataInfileWriter.ESCAPES:
+            if specialChar in value:
+                value = value.replace(specialChar, replacement)
+        return value
+
+
+class ParquetWriter(object):
+    '''
+    Writes rows into a directory tree of Parquet files, partitioned
+    Hive style by course and month of creation:
+
+       <outDir>/course_display_name=MITx%2F6.002x%2F2012_Fall/created_month=2013-05/part-00000.parquet
+
+    Partition values are URL-quoted, because course names contain
+    slashes. As is the Hive convention, the course_display_name
+    column is not repeated inside the files; dataset readers such as
+    pyarrow.parquet.ParquetDataset or Spark restore it from the path.
+
+    Rows are buffered per partition. Each time a partition has
+    rowGroupSize rows, they are written as one file holding a single
+    row group. If all buffers together reach maxBufferedRows, the
+    largest one is written early, which caps memory when there are
+    many partitions. close() writes the remaining partial buffers.
+
+    Column types follow the MySQL types given to the constructor:
+    int columns become int64, datetime columns timestamps, and
+    everything else strings.
+    '''
+
+    DEFAULT_ROW_GROUP_SIZE = 100000
+    DEFAULT_MAX_BUFFERED_ROWS = 500000
+
+    COURSE_COL = 'course_display_name'
+    TIME_COL = 'created_at'
+
+    def __init__(self, outDir, colNames, colTypes, rowGroupSize=None, maxBufferedRows=None, logInfo=None):
+        '''
+        :param outDir: root directory of the partitioned files. Created if
+            needed; must not contain files from an earlier run.
+        :type outDir: String
+        :param colNames: column names in the order of the values in each row
+        :type colNames: [String]
+        :param colTypes: MySQL type of each column, as in EdxForumScrubber.forumSchema
+        :type colTypes: [String]
+        :param rowGroupSize: number of rows per file. Default: DEFAULT_ROW_GROUP_SIZE
+        :type rowGroupSize: int
+        :param maxBufferedRows: total number of rows buffered in memory across
+            all partitions. Default: DEFAULT_MAX_BUFFERED_ROWS
+        :type maxBufferedRows: int
+        :param logInfo: function for progress messages
+        :type logInfo: function
+        '''
+        if pyarrow is None:
+            raise ImportError("Writing Parquet files requires pyarrow; please install it (pip install pyarrow)")
+        self.outDir = outDir
+        self.colNames = tuple(colNames)
+        self.rowGroupSize = rowGroupSize if rowGroupSize is not None else ParquetWriter.DEFAULT_ROW_GROUP_SIZE
+        if self.rowGroupSize < 1:
+            raise ValueError("Parquet row group size must be at least 1; was %s" % str(self.rowGroupSize))
+        self.maxBufferedRows = max(self.rowGroupSize,
+                                   maxBufferedRows if maxBufferedRows is not None else ParquetWriter.DEFAULT_MAX_BUFFERED_ROWS)
+        self.logInfo = logInfo
+        self.courseColIndex = self.colNames.index(ParquetWriter.COURSE_COL)
+        self.timeColIndex = self.colNames.index(ParquetWriter.TIME_COL)
+
+        # Indexes of the columns stored in the files, and their
+        # Arrow types; timestamp columns need their strings parsed:
+        self.fileColIndexes = [colIndex for colIndex, colName in enumerate(self.colNames)
+                               if colName != ParquetWriter.COURSE_COL]
+        self.schema = pyarrow.schema([pyarrow.field(self.colNames[colIndex], ParquetWriter.arrowType(colTypes[colIndex]))
+                                      for colIndex in self.fileColIndexes])
+        self.timestampColIndexes = set([colIndex for colIndex in self.fileColIndexes
+                                        if colTypes[colIndex].startswith('datetime')])
+
+        if os.path.isdir(outDir) and len(os.listdir(outDir)) > 0:
+            raise ValueError("Parquet output directory %s is not empty; rows of an earlier run would mix with this one" % outDir)
+
+        # (course, month) --> rows waiting to be written, and
+        # number of files written to the partition so far:
+        self.partitionRows = {}
+        self.partitionFileCounts = {}
+        self.numRowsBuffered = 0
+        self.numRowsReceived = 0
+        self.numRowsWritten = 0
+        self.numFilesWritten = 0
+        # Present for interface compatibility with the MySQL writers;
+        # partitioned files cannot replace earlier rows:
+        self.replaceKeyCol = None
+
+    def write(self, rowTuple, recordObj=None):
+        '''
+        Buffer one row in its partition. The recordObj is accepted
+        for interface compatibility with BatchInsertWriter.
+        '''
+        # Month from the leading 'YYYY-MM' of the creation time:
+        partitionKey = (rowTuple[self.courseColIndex], str(rowTuple[self.timeColIndex])[:7])
+        try:
+            rows = self.partitionRows[partitionKey]
+        except KeyError:
+            rows = self.partitionRows[partitionKey] = []
+        rows.append(rowTuple)
+        self.numRowsBuffered += 1
+        self.numRowsReceived += 1
+        if len(rows) >= self.rowGroupSize:
+            self.writePartition(partitionKey)
+        elif self.numRowsBuffered >= self.maxBufferedRows:
+            self.writePartition(max(self.partitionRows.keys(), key=lambda key: len(self.partitionRows[key])))
+
+    def writePartition(self, partitionKey):
+        '''
+        Write the buffered rows of one partition as a new file.
+        '''
+        rows = self.partitionRows.pop(partitionKey)
+        self.numRowsBuffered -= len(rows)
+        courseName, month = partitionKey
+        partitionDir = os.path.join(self.outDir,
+                                    '%s=%s' % (ParquetWriter.COURSE_COL, ParquetWriter.quotePartitionValue(courseName)),
+                                    'created_month=%s' % ParquetWriter.quotePartitionValue(month))
+        if not os.path.isdir(partitionDir):
+            os.makedirs(partitionDir)
+        fileNum = self.partitionFileCounts.get(partitionKey, 0)
+        self.partitionFileCounts[partitionKey] = fileNum + 1
+
+        columns = []
+        for colIndex, field in zip(self.fileColIndexes, self.schema):
+            values = [rowTuple[colIndex] for rowTuple in rows]
+            if colIndex in self.timestampColIndexes:
+                values = [ParquetWriter.parseTimestamp(value) for value in values]
+            columns.append(pyarrow.array(values, type=field.type))
+        table = pyarrow.Table.from_arrays(columns, schema=self.schema)
+        fileName = os.path.join(partitionDir, 'part-%05d.parquet' % fileNum)
+        pyarrow.parquet.write_table(table, fileName, row_group_size=len(rows))
+        self.numRowsWritten += len(rows)
+        self.numFilesWritten += 1
+
+    def flush(self):
+        '''
+        Write all buffered rows, one file per partition.
+        '''
+        for partitionKey in sorted(self.partitionRows.keys()):
+            self.writePartition(partitionKey)
+
+    def close(self):
+        self.flush()
+        if self.logInfo is not None:
+            self.logInfo("Wrote %d rows into %d Parquet files under %s" % (self.numRowsWritten, self.numFilesWritten, self.outDir))
+
+    @staticmethod
+    def arrowType(mysqlType):
+        '''
+        Arrow type for a MySQL column type. Ex.: 'int(11) NOT NULL' --> int64
+        '''
+        if mysqlType.startswith('int'):
+            return pyarrow.int64()
+        if mysqlType.startswith('datetime'):
+            return pyarrow.timestamp('us')
+        return pyarrow.string()
+
+    @staticmethod
+    def parseTimestamp(value):
+        '''
+        Parse a creation time as str() renders a datetime
+        ('2013-05-16 04:32:20.868000'), or as Mongo's JSON
+        has it ('2013-05-16T04:32:20.868Z'). Returns None
+        for values that are neither.
+
+        :rtype: {datetime | None}
+        '''
+        try:
+            timestamp = datetime.strptime(str(value)[:19].replace('T', ' '), '%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            return None
+        fraction = str(value)[20:26].rstrip('Z')
+        if fraction.isdigit():
+            timestamp = timestamp.replace(microsecond=int(fraction.ljust(6, '0')))
+        return timestamp
+
+    @staticmethod
+    def quotePartitionValue(value):
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        return urllib.quote(str(value), safe='')
@@ -0,0 +1,78 @@
+# Copyright (c) 2014, Stanford University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+A small, bounded cache that evicts the least recently used
+entry when full, and counts its hits and misses, so that its
+size can be tuned from the logs.
+'''
+
+from collections import OrderedDict
+
+
+class LRUCache(object):
+
+    def __init__(self, maxSize):
+        '''
+        :param maxSize: maximum number of entries. Once reached, each new
+            entry evicts the least recently used one.
+        :type maxSize: int
+        '''
+        if maxSize < 1:
+            raise ValueError("Cache size must be at least 1; was %s" % str(maxSize))
+        self.maxSize = maxSize
+        # Least recently used entry first:
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        '''
+        Return the value cached under key, and mark it as most
+        recently used. Return default if key is not cached.
+        '''
+        try:
+            value = self.entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self.entries[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        '''
+        Cache value under key, evicting the least recently
+        used entry if the cache is full.
+        '''
+        if key in self.entries:
+            del self.entries[key]
+        elif len(self.entries) >= self.maxSize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        self.entries[key] = value
+
+    def hitRatio(self):
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups > 0 else 0.0
+
+    def stats(self):
+        '''
+        One-line summary for the log.
+        '''
+        return "%d entries (max %d), %d hits, %d misses (hit ratio %.1f%%), %d evictions" % \
+               (len(self.entries), self.maxSize, self.hits, self.misses, 100 * self.hitRatio(), self.evictions)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
@@ -0,0 +1,170 @@
+# Copyright (c) 2014, Stanford University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+'''
+Threads and bounded queues that let the stages of a forum conversion
+overlap: while one batch of posts is anonymized, the next is read
+from the source, and the previous one is written to MySQL.
+
+StagedPipeline.readAhead() moves iteration over a source into a
+background thread. StagedPipeline.writeBehind() hands the items of an
+iterator to a function that runs in another background thread. Between
+stages sit queues of at most queueSize items, so a slow stage makes
+the others wait rather than pile up items in memory.
+
+An exception in any stage ends the whole pipeline. An exception in
+a reader stage is raised again by the generator that readAhead()
+returned. writeBehind() raises the first exception of any background
+stage, so that it surfaces even if the reader's consumer was cut short.
+'''
+
+import Queue
+import sys
+import threading
+
+
+class StagedPipeline(object):
+
+    DEFAULT_QUEUE_SIZE = 8
+
+    # Seconds between checks for a stopped pipeline
+    # while a stage waits on a full or empty queue:
+    POLL_INTERVAL = 0.5
+
+    # Marks the end of a stage's output:
+    END_OF_STAGE = object()
+
+    def __init__(self, queueSize=DEFAULT_QUEUE_SIZE):
+        '''
+        :param queueSize: max number of items waiting between two stages
+        :type queueSize: int
+        '''
+        if queueSize < 1:
+            raise ValueError("Pipeline queue size must be at least 1; was %s" % str(queueSize))
+        self.queueSize = queueSize
+        # Set when any stage fails, or the pipeline is abandoned:
+        self.stopEvent = threading.Event()
+        # exc_info of the first failed background stage:
+        self.failure = None
+
+    def readAhead(self, iterable):
+        '''
+        Iterate over iterable in a background thread, and return
+        a generator over the items it produces.
+
+        :param iterable: source of items; iterated in the background thread only
+        :type iterable: iterable
+        :rtype: generator
+        '''
+        itemQueue = Queue.Queue(self.queueSize)
+        # Receives the exc_info of a failure in the reader thread:
+        readerFailure = []
+        readerThread = threading.Thread(target=self.runReader, args=(iterable, itemQueue, readerFailure))
+        readerThread.daemon = True
+        readerThread.start()
+        reachedEnd = False
+        try:
+            while True:
+                item = self.get(itemQueue)
+                if item is StagedPipeline.END_OF_STAGE:
+                    reachedEnd = True
+                    break
+                yield item
+        finally:
+            if not reachedEnd:
+                # Consumer gave up early; so must the reader:
+                self.stopEvent.set()
+            readerThread.join()
+        if len(readerFailure) > 0:
+            excType, excValue, excTraceback = readerFailure[0]
+            raise excType, excValue, excTraceback
+
+    def writeBehind(self, iterable, consumeFunc):
+        '''
+        Call consumeFunc on each item of iterable. The calls run
+        in a background thread, while this thread goes on producing
+        items. Returns after all items are consumed.
+
+        :param iterable: items to consume; iterated in the calling thread
+        :type iterable: iterable
+        :param consumeFunc: function called with each item
+        :type consumeFunc: function
+        '''
+        itemQueue = Queue.Queue(self.queueSize)
+        writerThread = threading.Thread(target=self.runWriter, args=(itemQueue, consumeFunc))
+        writerThread.daemon = True
+        writerThread.start()
+        try:
+            for item in iterable:
+                if not self.put(itemQueue, item):
+                    break
+            self.put(itemQueue, StagedPipeline.END_OF_STAGE)
+        except:
+            self.stopEvent.set()
+            raise
+        finally:
+            writerThread.join()
+        self.raiseFailure()
+
+    def runReader(self, iterable, itemQueue, readerFailure):
+        try:
+            for item in iterable:
+                if not self.put(itemQueue, item):
+                    return
+            self.put(itemQueue, StagedPipeline.END_OF_STAGE)
+        except:
+            readerFailure.append(sys.exc_info())
+            self.fail(readerFailure[0])
+
+    def runWriter(self, itemQueue, consumeFunc):
+        try:
+            while True:
+                item = self.get(itemQueue)
+                if item is StagedPipeline.END_OF_STAGE:
+                    return
+                consumeFunc(item)
+        except:
+            self.fail(sys.exc_info())
+
+    def put(self, itemQueue, item):
+        '''
+        Put item into itemQueue once there is room. Returns
+        False if the pipeline was stopped meanwhile.
+        '''
+        while not self.stopEvent.is_set():
+            try:
+                itemQueue.put(item, timeout=StagedPipeline.POLL_INTERVAL)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def get(self, itemQueue):
+        '''
+        Take the next item from itemQueue. Returns END_OF_STAGE
+        if the pipeline was stopped meanwhile.
+        '''
+        while not self.stopEvent.is_set():
+            try:
+                return itemQueue.get(timeout=StagedPipeline.POLL_INTERVAL)
+            except Queue.Empty:
+                pass
+        return StagedPipeline.END_OF_STAGE
+
+    def fail(self, excInfo):
+        if self.failure is None:
+            self.failure = excInfo
+        self.stopEvent.set()
+
+    def raiseFailure(self):
+        if self.failure is not None:
+            excType, excValue, excTraceback = self.failure
+            raise excType, excValue, excTraceback
@@ -0,0 +1,228 @@
+# Copyright (c) 2014, Stanford University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+'''
+Lets a conversion skip the posts that are unchanged since the
+previous successful run. Most posts of a nightly dump are identical
+to the night before, yet each would be anonymized and written again.
+
+For every post, a 64-bit hash of what can change is kept: raw body,
+author_id, votes, and updated_at. Votes are included because vote
+counts change without updated_at moving, which is why time
+watermarks alone (see watermarks.py) cannot catch them.
+
+PostHashIndex holds, for each post of a run, the 64-bit key of its
+forum_post_id and its content hash, in two arrays sorted by key:
+16 bytes per post. Like UserCache it is saved to a local file with
+a key that describes what it was built for.
+
+UnchangedPostFilter wraps a source of posts. It passes on only posts
+that are new or whose hash differs from the previous index, and
+builds the index of the current run as the posts flow by.
+'''
+
+from array import array
+from bisect import bisect_left
+import hashlib
+import json
+import os
+import struct
+
+
+def postKey(postId):
+    '''
+    64-bit key of a forum_post_id (usually an ObjectId)
+    '''
+    return struct.unpack('<q', hashlib.md5(str(postId)).digest()[:8])[0]
+
+def contentHash(mongoForumRec):
+    '''
+    64-bit hash of the parts of a raw post whose change
+    requires the post to be converted again.
+
+    :param mongoForumRec: raw forum post
+    :type mongoForumRec: dict
+    :rtype: int
+    '''
+    body = mongoForumRec.get('body')
+    if isinstance(body, unicode):
+        body = body.encode('utf-8')
+    # Votes are a nested dict; sorting its keys makes
+    # the serialization independent of dict order:
+    digest = hashlib.md5('\0'.join([str(body),
+                                    str(mongoForumRec.get('author_id')),
+                                    json.dumps(mongoForumRec.get('votes'), sort_keys=True, default=str),
+                                    str(mongoForumRec.get('updated_at'))])).digest()
+    return struct.unpack('<q', digest[:8])[0]
+
+
+class PostHashIndex(object):
+
+    FILE_MAGIC = 'FORUM_ETL_POST_HASHES 1'
+
+    # 64-bit on the platforms we run on; load()
+    # refuses files written with another size:
+    TYPECODE = 'l'
+
+    def __init__(self):
+        self.keys = array(PostHashIndex.TYPECODE)
+        self.hashes = array(PostHashIndex.TYPECODE)
+
+    def add(self, key, hashValue):
+        '''
+        Add one post. Posts may be added in any order.
+        Call finish() after the last post was added.
+        '''
+        self.keys.append(key)
+        self.hashes.append(hashValue)
+
+    def finish(self, dropKeys=None):
+        '''
+        Sort by key, and drop duplicate keys, of which the one
+        added last is kept.
+
+        :param dropKeys: keys to leave out, such as those of posts
+            that MySQL refused, so they are converted again next time
+        :type dropKeys: set
+        '''
+        keys = self.keys
+        dropKeys = dropKeys if dropKeys is not None else set()
+        # Stable sort, so that of duplicate keys the last added stays last:
+        order = sorted(xrange(len(keys)), key=keys.__getitem__)
+        newKeys = array(PostHashIndex.TYPECODE)
+        newHashes = array(PostHashIndex.TYPECODE)
+        for pos, postIdx in enumerate(order):
+            key = keys[postIdx]
+            if pos + 1 < len(order) and keys[order[pos + 1]] == key:
+                continue
+            if key in dropKeys:
+                continue
+            newKeys.append(key)
+            newHashes.append(self.hashes[postIdx])
+        self.keys = newKeys
+        self.hashes = newHashes
+
+    def get(self, key, default=None):
+        '''
+        Return the content hash recorded for the post
+        with the given key, or default.
+        '''
+        idx = bisect_left(self.keys, key)
+        if idx == len(self.keys) or self.keys[idx] != key:
+            return default
+        return self.hashes[idx]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def save(self, fileName, indexKey):
+        '''
+        Write the index to a file, under a temporary name that is
+        then renamed, so that readers never see a partial file.
+
+        :param fileName: path of the index file
+        :type fileName: String
+        :param indexKey: describes the table and settings the index
+            was built for; load() only accepts a matching key. No newlines.
+        :type indexKey: String
+        '''
+        tmpFileName = fileName + '.tmp'
+        with open(tmpFileName, 'wb') as fd:
+            fd.write('%s\n%s\n%d %d\n' % (PostHashIndex.FILE_MAGIC, indexKey, self.keys.itemsize, len(self.keys)))
+            self.keys.tofile(fd)
+            self.hashes.tofile(fd)
+        os.rename(tmpFileName, fileName)
+
+    @classmethod
+    def load(cls, fileName, indexKey):
+        '''
+        Read an index written by save(). Returns None if the file
+        does not exist, is damaged, was written with a different
+        integer size, or was built for a different indexKey.
+
+        :rtype: {PostHashIndex | None}
+        '''
+        try:
+            with open(fileName, 'rb') as fd:
+                if fd.readline().rstrip('\n') != PostHashIndex.FILE_MAGIC:
+                    return None
+                if fd.readline().rstrip('\n') != indexKey:
+                    return None
+                itemSize, numPosts = [int(num) for num in fd.readline().split()]
+                postHashes = cls()
+                if itemSize != postHashes.keys.itemsize:
+                    return None
+                postHashes.keys.fromfile(fd, numPosts)
+                postHashes.hashes.fromfile(fd, numPosts)
+                return postHashes
+        except (IOError, EOFError, ValueError):
+            return None
+
+
+class UnchangedPostFilter(object):
+    '''
+    Wraps a source of forum posts, and passes on only the posts
+    that are new, or changed since the run that built previousIndex.
+    While posts flow through query(), the index of all posts of
+    this run is collected in newIndex.
+    '''
+
+    def __init__(self, source, previousIndex):
+        '''
+        :param source: source of posts
+        :type source: {MongoDB | BsonForumReader}
+        :param previousIndex: hashes of the posts of the previous run
+        :type previousIndex: PostHashIndex
+        '''
+        self.source = source
+        self.previousIndex = previousIndex
+        self.newIndex = PostHashIndex()
+        # Posts of the most recent pass that were unchanged, and
+        # that were found in previousIndex at all (changed or not):
+        self.numPostsSkipped = 0
+        self.numPostsMatched = 0
+
+    def query(self, queryDict=None):
+        '''
+        Iterator over the new and changed posts of the source.
+
+        :param queryDict: handed to the source's query()
+        :type queryDict: {}
+        '''
+        self.newIndex = PostHashIndex()
+        self.numPostsSkipped = 0
+        self.numPostsMatched = 0
+        previousIndex = self.previousIndex
+        for mongoForumRec in self.source.query(queryDict if queryDict is not None else {}):
+            key = postKey(mongoForumRec.get('_id'))
+            hashValue = contentHash(mongoForumRec)
+            self.newIndex.add(key, hashValue)
+            previousHash = previousIndex.get(key)
+            if previousHash is not None:
+                self.numPostsMatched += 1
+                if previousHash == hashValue:
+                    self.numPostsSkipped += 1
+                    continue
+            yield mongoForumRec
+
+    def distinctValues(self, fieldName):
+        # Values over all posts, not only the changed ones. Sources
+        # that cannot compute them are scanned once:
+        sourceDistinct = getattr(self.source, 'distinctValues', None)
+        if sourceDistinct is not None:
+            return sourceDistinct(fieldName)
+        return set([mongoForumRec.get(fieldName) for mongoForumRec in self.source.query({})]) - set([None])
+
+    def close(self):
+        self.source.close()
@@ -0,0 +1,185 @@
+# Copyright (c) 2014, Stanford University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+'''
+Profiles a whole forum conversion, so that slowdowns that only
+show with particular course data can be reproduced from the
+command line, without editing the script.
+
+Two kinds of profile:
+
+   - deterministic: cProfile records every function call. Exact
+         call counts and times, but the run slows down by perhaps
+         a factor of two. The artifact is a pstats file, readable
+         with python -m pstats, snakeviz, gprof2dot, etc.
+   - sampling: a background thread looks at the stacks of all
+         other threads sampleRate times per second. Low overhead,
+         and the counts are statistical. The artifact has one line
+         per distinct stack, in the 'collapsed' format of
+         flamegraph.pl and speedscope: frame;frame;frame count
+
+Either way, a summary of the topN hottest functions is returned
+as text for the log. Only the process that runs the conversion is
+profiled; with --workers > 1 the anonymization time shows up as
+waiting for worker results.
+'''
+
+from collections import Counter
+import cProfile
+import pstats
+import StringIO
+import sys
+import threading
+import time
+
+
+class ConversionProfiler(object):
+
+    DETERMINISTIC = 'deterministic'
+    SAMPLING = 'sampling'
+    PROFILE_MODES = [DETERMINISTIC, SAMPLING]
+
+    # Stack samples per second taken by the sampling profiler:
+    DEFAULT_SAMPLE_RATE = 100
+
+    # Number of functions listed in the summary:
+    DEFAULT_TOP_N = 25
+
+    def __init__(self, mode=DETERMINISTIC, sampleRate=DEFAULT_SAMPLE_RATE, topN=DEFAULT_TOP_N):
+        '''
+        :param mode: DETERMINISTIC or SAMPLING
+        :type mode: String
+        :param sampleRate: with SAMPLING: stack samples per second
+        :type sampleRate: int
+        :param topN: number of hot functions in the summary
+        :type topN: int
+        '''
+        if mode not in ConversionProfiler.PROFILE_MODES:
+            raise ValueError("Profile mode must be one of %s; got '%s'" % (ConversionProfiler.PROFILE_MODES, mode))
+        if sampleRate <= 0:
+            raise ValueError("Sample rate must be positive; got %s" % sampleRate)
+        self.mode = mode
+        self.sampleRate = sampleRate
+        self.topN = topN
+        # Collapsed stack string --> number of samples:
+        self.stackSamples = Counter()
+        self.numSamples = 0
+
+    def artifactSuffix(self):
+        '''
+        File name extension of the profile artifact: '.prof'
+        for pstats files, '.folded' for collapsed stacks.
+        '''
+        return '.prof' if self.mode == ConversionProfiler.DETERMINISTIC else '.folded'
+
+    def run(self, func, artifactPath):
+        '''
+        Call func() under the profiler, and write the profile
+        to artifactPath, even if func() raises.
+
+        :param func: the work to profile. Called without arguments.
+        :type func: callable
+        :param artifactPath: file to which the profile is written
+        :type artifactPath: String
+        :returns: summary of the topN hottest functions
+        :rtype: String
+        '''
+        if self.mode == ConversionProfiler.DETERMINISTIC:
+            return self.runDeterministic(func, artifactPath)
+        else:
+            return self.runSampling(func, artifactPath)
+
+    def runDeterministic(self, func, artifactPath):
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(func)
+        finally:
+            profiler.dump_stats(artifactPath)
+        summary = StringIO.StringIO()
+        stats = pstats.Stats(profiler, stream=summary)
+        # Own time first, since that's where the work actually
+        # happens; cumulative time would list runConversion()
+        # and its direct callees at the top every time:
+        stats.sort_stats('tottime', 'cumulative').print_stats(self.topN)
+        return summary.getvalue()
+
+    def runSampling(self, func, artifactPath):
+        self.stackSamples = Counter()
+        self.numSamples = 0
+        stopEvent = threading.Event()
+        sampler = threading.Thread(target=self.sampleStacks, args=(stopEvent,), name='ProfileSampler')
+        sampler.daemon = True
+        sampler.start()
+        try:
+            func()
+        finally:
+            stopEvent.set()
+            sampler.join()
+            self.saveCollapsedStacks(artifactPath)
+        return self.samplingSummary()
+
+    def sampleStacks(self, stopEvent):
+        '''
+        Sampler thread: until stopEvent is set, record the current
+        stack of every other thread sampleRate times per second.
+        '''
+        interval = 1.0 / self.sampleRate
+        myThreadId = threading.current_thread().ident
+        threadNames = {}
+        while not stopEvent.wait(interval):
+            # Names of new threads, such as pipeline stages:
+            for thread in threading.enumerate():
+                threadNames[thread.ident] = thread.name
+            for threadId, frame in sys._current_frames().items():
+                if threadId == myThreadId:
+                    continue
+                frameNames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frameNames.append('%s (%s:%d)' % (code.co_name, code.co_filename, code.co_firstlineno))
+                    frame = frame.f_back
+                frameNames.append(threadNames.get(threadId, str(threadId)))
+                frameNames.reverse()
+                self.stackSamples[';'.join(frameNames)] += 1
+            self.numSamples += 1
+
+    def saveCollapsedStacks(self, artifactPath):
+        with open(artifactPath, 'w') as artifactFd:
+            for stack, count in self.stackSamples.most_common():
+                artifactFd.write('%s %d\n' % (stack, count))
+
+    def samplingSummary(self):
+        '''
+        Per function: the number of samples in which it was the
+        innermost frame (self), and the number in which it was on
+        the stack at all (total), listed by self samples.
+        Samples taken while a thread waits, say on a queue
+        or on MySQL, count as time in the waiting function.
+        '''
+        selfSamples = Counter()
+        totalSamples = Counter()
+        for stack, count in self.stackSamples.iteritems():
+            # Drop the thread name at the root:
+            frameNames = stack.split(';')[1:]
+            if len(frameNames) == 0:
+                continue
+            selfSamples[frameNames[-1]] += count
+            # Recursive functions count once per sample:
+            for frameName in set(frameNames):
+                totalSamples[frameName] += count
+        numStackSamples = sum(selfSamples.values())
+        lines = ['%d samples of all threads at %d/sec; %d thread stacks. Top %d functions by own samples:' %
+                 (self.numSamples, self.sampleRate, numStackSamples, self.topN),
+                 '%8s %8s %8s  %s' % ('self', 'self%', 'total', 'function')]
+        for frameName, count in selfSamples.most_common(self.topN):
+            lines.append('%8d %7.1f%% %8d  %s' %
+                         (count, 100.0 * count / numStackSamples, totalSamples[frameName], frameName))
+        return '\n'.join(lines)
@@ -0,0 +1,361 @@
+# Copyright (c) 2014, Stanford University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+Single-pass redaction of personally identifiable information
+(phone numbers, zip codes, email addresses) from forum post bodies.
+
+All patterns are compiled once, into one alternation. A body is
+scanned a single time, left to right, and the redacted result is
+assembled from the unchanged stretches between hits, and the
+replacement tokens.
+
+Most posts contain neither digits nor an '@'. Those are recognized
+with two quick membership tests, and returned untouched. Posts with
+digits but no '@' (or vice versa) are scanned with an alternation
+that leaves out the kinds that cannot match.
+
+Scan time is linear in the body length. None of the patterns has
+an unbounded repetition that can match across whitespace, and none
+nests repetitions; so each attempted match examines at most the
+run of non-whitespace (or, for phone numbers, whitespace) characters
+ahead of it, and those runs do not overlap from one attempt to the
+next. See the 'adversarial' mode of benchmark_redaction.py.
+'''
+
+import re
+
+
+class PIIRedactor(object):
+
+    PHONE = 'phone'
+    ZIP   = 'zip'
+    EMAIL = 'email'
+
+    ALL_KINDS = (EMAIL, PHONE, ZIP)
+
+    # Replacement for each kind of hit:
+    TOKENS = {PHONE : '<phoneRedac>',
+              ZIP   : '<zipRedac>',
+              EMAIL : '<emailRedac>'
+              }
+
+    # Phone number pattern from stackoverflow; same as originally used
+    # in EdxForumScrubber.prune_numbers(), but with all groups made
+    # non-capturing, so that only the named group of each kind remains:
+    PHONE_PATTERN = r'(?:(?:\+?1\s*(?:[.-]\s*)?)?(?:\(\s*(?:[2-9]1[02-9]|[2-9][02-8]1|[2-9][02-8][02-9])\s*\)|(?:[2-9]1[02-9]|[2-9][02-8]1|[2-9][02-8][02-9]))\s*(?:[.-]\s*)?)?(?:[2-9]1[02-9]|[2-9][02-9]1|[2-9][02-9]{2})\s*(?:[.-]\s*)?(?:[0-9]{4})(?:\s*(?:#|x\.?|ext\.?|extension)\s*(?:\d+))?'
+
+    ZIP_PATTERN = r'\d{5}(?:[-\s]\d{4})?'
+
+    # Email address: strings of letters/numbers/dots/hyphens, an @,
+    # and a domain ending in edu or com. Must be preceded by whitespace.
+    # Whitespace that follows the address is absorbed into the hit.
+    # Unlike the former '(.*)\s+...\s*(.*)', nothing here can
+    # backtrack across the body; local part and domain cannot
+    # contain whitespace or a second '@':
+    EMAIL_PATTERN = r'(?<=\s)[a-zA-Z0-9\(\.\-]+@[a-zA-Z0-9\.]+.(?:edu|com)\s*'
+
+    PATTERNS = {PHONE : PHONE_PATTERN,
+                ZIP   : ZIP_PATTERN,
+                EMAIL : EMAIL_PATTERN
+                }
+
+    # Lookahead that lets the regex engine skip a position
+    # quickly if no hit of the kind can start there:
+    GUARDS = {PHONE : r'(?=[\d(+])',
+              ZIP   : r'(?=\d)',
+              EMAIL : r'(?<=\s)'
+              }
+
+    # Kinds that need a digit, or an '@' to be present in a body:
+    NEEDS_DIGIT = (PHONE, ZIP)
+    NEEDS_AT    = (EMAIL,)
+
+    digitPattern = re.compile(r'\d')
+
+    def __init__(self, kinds=ALL_KINDS):
+        '''
+        :param kinds: the kinds of information to redact, in order of
+            precedence where two kinds could match at the same place.
+            Default: all kinds; email before phone before zip.
+        :type kinds: (String)
+        '''
+        for kind in kinds:
+            if kind not in PIIRedactor.PATTERNS:
+                raise ValueError("Unknown kind of redaction: '%s'; must be one of %s" % (kind, str(PIIRedactor.ALL_KINDS)))
+        self.kinds = tuple(kinds)
+
+        # One compiled alternation for each combination of 'body
+        # has a digit' and 'body has an @'. None if no kind can match:
+        self.patterns = {}
+        for hasDigit in (True, False):
+            for hasAt in (True, False):
+                self.patterns[(hasDigit, hasAt)] = self.compileAlternation(
+                    [kind for kind in self.kinds
+                     if (hasDigit or kind not in PIIRedactor.NEEDS_DIGIT) and (hasAt or kind not in PIIRedactor.NEEDS_AT)])
+
+    def compileAlternation(self, kinds):
+        if len(kinds) == 0:
+            return None
+        return re.compile('|'.join(['%s(?P<%s>%s)' % (PIIRedactor.GUARDS[kind], kind, PIIRedactor.PATTERNS[kind])
+                                    for kind in kinds]))
+
+    def redact(self, body):
+        '''
+        Return body with every phone number, zip code, and
+        email address replaced by its redaction token.
+
+        To stay compatible with the output of the earlier, multi-pass
+        email redaction, the whitespace character in front of each email
+        address and all whitespace after it are replaced by a single
+        space on either side of <emailRedac>, and a body in which an
+        email address was redacted gains a leading space.
+
+        :param body: forum post
+        :type body: String
+        :returns: redacted body
+        :rtype: String
+        '''
+        pattern = self.patterns[(PIIRedactor.digitPattern.search(body) is not None, '@' in body)]
+        if pattern is None:
+            return body
+        pieces = []
+        prevEnd = 0
+        foundEmail = False
+        for hit in pattern.finditer(body):
+            kind = hit.lastgroup
+            stretch = body[prevEnd:hit.start()]
+            if kind == PIIRedactor.EMAIL:
+                # The whitespace char that precedes every address
+                # becomes the space before the token. The stretch is
+                # empty when the previous email hit absorbed that char:
+                if len(stretch) > 0:
+                    pieces.append(stretch[:-1] + ' ')
+                pieces.append(PIIRedactor.TOKENS[kind] + ' ')
+                foundEmail = True
+            else:
+                pieces.append(stretch)
+                pieces.append(PIIRedactor.TOKENS[kind])
+            prevEnd = hit.end()
+        if len(pieces) == 0:
+            # No hits at all; the common case:
+            return body
+        pieces.append(body[prevEnd:])
+        if foundEmail:
+            pieces.insert(0, ' ')
+        return ''.join(pieces)
+
+
+class NameRedactor(object):
+    '''
+    Redacts every occurrence of any word from a (large) dictionary
+    of names, such as the first names and screen names of everyone
+    in a class. All names are compiled into one Aho-Corasick automaton,
+    so a body is scanned once, in time linear in its length, no matter
+    how many names the dictionary holds.
+
+    Matching ignores case. Whether a hit is redacted then depends on:
+       - wordBoundaries: if True, the hit must not be preceded or
+             followed by a letter, digit, or underscore. So 'Theo'
+             does not match within 'Theology'.
+       - requireCapitalized: set per name when the name is added.
+             If True, the hit must start with an upper case letter
+             in the body. Useful for first names, many of which are
+             also regular English words ('Will', 'Grant').
+       - stopWords: names in this set are never added to the automaton.
+
+    Where hits overlap, the leftmost, and among those the longest wins.
+    '''
+
+    DEFAULT_TOKEN = '<nameRedac>'
+
+    # Minimum name length; shorter names match too much:
+    DEFAULT_MIN_LENGTH = 3
+
+    # Common English words that are also given names or screen names.
+    # Used as stop-list unless the caller provides one:
+    DEFAULT_STOP_WORDS = frozenset([
+        'about', 'after', 'all', 'also', 'and', 'any', 'april', 'art', 'august', 'autumn',
+        'baker', 'bill', 'bob', 'brown', 'but', 'can', 'carol', 'case', 'chance', 'chase',
+        'christian', 'class', 'clay', 'cliff', 'cole', 'cook', 'could', 'course', 'dale',
+        'dawn', 'day', 'dean', 'drew', 'earl', 'easter', 'eve', 'faith', 'fisher', 'for',
+        'frank', 'from', 'gene', 'glen', 'golden', 'grace', 'grant', 'gray', 'green', 'guy',
+        'hall', 'happy', 'has', 'have', 'hazel', 'heath', 'her', 'hill', 'him', 'his', 'holly',
+        'homework', 'hope', 'hunter', 'ivy', 'jack', 'jade', 'james', 'jay', 'jean', 'joy',
+        'june', 'just', 'king', 'lane', 'lee', 'lecture', 'long', 'love', 'major', 'march',
+        'mark', 'martin', 'mason', 'max', 'may', 'miles', 'miller', 'moon', 'more', 'new',
+        'nick', 'not', 'now', 'one', 'only', 'page', 'park', 'pat', 'patience', 'pearl', 'penny',
+        'pierce', 'porter', 'price', 'problem', 'rain', 'ray', 'reed', 'rich', 'river', 'rob',
+        'rock', 'rose', 'ruby', 'rush', 'sage', 'scott', 'shadow', 'she', 'sky', 'smith',
+        'some', 'song', 'star', 'stone', 'storm', 'summer', 'sunny', 'sue', 'teacher', 'than',
+        'thank', 'thanks', 'that', 'the', 'then', 'there', 'they', 'this', 'tim', 'tom',
+        'true', 'turner', 'very', 'wade', 'walker', 'ward', 'was', 'west', 'what', 'when',
+        'white', 'who', 'will', 'winter', 'with', 'wood', 'would', 'young', 'you', 'your'
+        ])
+
+    def __init__(self, stopWords=None, wordBoundaries=True, minLength=DEFAULT_MIN_LENGTH, token=DEFAULT_TOKEN):
+        '''
+        :param stopWords: words never to redact, in any capitalization. Default: DEFAULT_STOP_WORDS
+        :type stopWords: set
+        :param wordBoundaries: if True, only whole words are redacted
+        :type wordBoundaries: Bool
+        :param minLength: names shorter than this are ignored
+        :type minLength: int
+        :param token: replacement for each redacted name
+        :type token: String
+        '''
+        if stopWords is None:
+            stopWords = NameRedactor.DEFAULT_STOP_WORDS
+        self.stopWords = frozenset([NameRedactor.toKey(word) for word in stopWords])
+        self.wordBoundaries = wordBoundaries
+        self.minLength = minLength
+        self.token = token
+
+        # The automaton; one list entry per node. Node 0 is the root.
+        #    goto:     char --> child node
+        #    fail:     node to continue from when no child matches
+        #    output:   (nameLength, requireCapitalized) if a name ends here, else None
+        #    dictLink: nearest node on the fail chain that has an output
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [None]
+        self.dictLink = [0]
+        self.numNames = 0
+        self.finalized = True
+
+    @staticmethod
+    def toKey(word):
+        if isinstance(word, unicode):
+            word = word.encode('utf-8')
+        return word.lower()
+
+    def addNames(self, names, requireCapitalized=False):
+        '''
+        Add names to the dictionary.
+
+        :param names: names to redact
+        :type names: iterable of {String | unicode}
+        :param requireCapitalized: if True, these names are only redacted
+            where they start with an upper case letter in the body
+        :type requireCapitalized: Bool
+        '''
+        for name in names:
+            if name is None:
+                continue
+            key = NameRedactor.toKey(name).strip()
+            if len(key) < self.minLength or key in self.stopWords:
+                continue
+            node = 0
+            for char in key:
+                child = self.goto[node].get(char)
+                if child is None:
+                    child = len(self.goto)
+                    self.goto[node][char] = child
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(None)
+                    self.dictLink.append(0)
+                node = child
+            prevOutput = self.output[node]
+            if prevOutput is None:
+                self.numNames += 1
+                self.output[node] = (len(key), requireCapitalized)
+            elif prevOutput[1] and not requireCapitalized:
+                # Same name added under both rules; the less strict wins:
+                self.output[node] = (len(key), False)
+        self.finalized = False
+
+    def finalize(self):
+        '''
+        Compute fail and dictionary links, breadth first. Called
+        automatically before the first redaction after names were added.
+        '''
+        queue = list(self.goto[0].values())
+        for child in queue:
+            self.fail[child] = 0
+            self.dictLink[child] = 0
+        queuePos = 0
+        while queuePos < len(queue):
+            node = queue[queuePos]
+            queuePos += 1
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                failNode = self.fail[node]
+                while failNode and char not in self.goto[failNode]:
+                    failNode = self.fail[failNode]
+                failTarget = self.goto[failNode].get(char, 0)
+                self.fail[child] = failTarget if failTarget != child else 0
+                self.dictLink[child] = self.fail[child] if self.output[self.fail[child]] is not None \
+                                       else self.dictLink[self.fail[child]]
+        self.finalized = True
+
+    def redact(self, body):
+        '''
+        Return body with every dictionary name replaced by the token.
+
+        :param body: forum post; UTF-8 encoded
+        :type body: String
+        :returns: redacted body
+        :rtype: String
+        '''
+        if self.numNames == 0 or len(body) == 0:
+            return body
+        if not self.finalized:
+            self.finalize()
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        dictLink = self.dictLink
+
+        hits = []
+        node = 0
+        for pos, char in enumerate(body.lower()):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            outNode = node if output[node] is not None else dictLink[node]
+            while outNode:
+                nameLength, requireCapitalized = output[outNode]
+                start = pos - nameLength + 1
+                if self.acceptHit(body, start, pos + 1, requireCapitalized):
+                    hits.append((start, pos + 1))
+                outNode = dictLink[outNode]
+        if len(hits) == 0:
+            return body
+
+        # Leftmost, then longest hit wins where hits overlap:
+        hits.sort(key=lambda hit: (hit[0], -hit[1]))
+        pieces = []
+        prevEnd = 0
+        for start, end in hits:
+            if start < prevEnd:
+                continue
+            pieces.append(body[prevEnd:start])
+            pieces.append(self.token)
+            prevEnd = end
+        pieces.append(body[prevEnd:])
+        return ''.join(pieces)
+
+    def acceptHit(self, body, start, end, requireCapitalized):
+        if requireCapitalized and not body[start].isupper():
+            return False
+        if self.wordBoundaries:
+            if start > 0 and NameRedactor.isWordChar(body[start - 1]):
+                return False
+            if end < len(body) and NameRedactor.isWordChar(body[end]):
+                return False
+        return True
+
+    @staticmethod
+    def isWordChar(char):
+        # Bytes of multi-byte UTF-8 characters count as word chars:
+        return char.isalnum() or char == '_' or char >= '\x80'
@@ -0,0 +1,260 @@
+# Copyright (c) 2014, Stanford University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+'''
+Reads a MongoDB collection of forum posts through several cursors
+in parallel. The collection is split into numShards ranges of _id
+(ObjectIds are ordered), each with about the same number of posts.
+A thread per range drains a cursor into a small queue of batches.
+
+Batches are handed out round-robin across the ranges: the first batch
+of range 0, then the first of range 1, ..., then the second batch of
+range 0, and so on. The order of posts is thus the same on every
+pass over an unchanged collection, which checkpoints of running
+conversions rely on.
+
+With a single shard, one cursor is read directly by the consumer,
+with no thread in between. Its order may then be either _id order,
+or the natural order in which the server stores the posts, which
+saves the sort.
+
+Cursors can be limited to a projection: the fields the consumer
+actually reads. Posts carry fields like abuse_flaggers, tags_array,
+or title that the conversion never looks at; leaving them on the
+server saves wire bytes and BSON decoding for every post. Cursors
+are opened without the server's idle timeout by default, since the
+consumer of a long conversion may take longer than ten minutes
+between two round trips.
+
+ShardedMongoReader offers the query()/distinctValues()/close()
+calls that EdxForumScrubber uses on its sources of posts.
+'''
+
+import Queue
+import threading
+
+from pymongo import ASCENDING, MongoClient
+
+
+class ShardedMongoReader(object):
+
+    DEFAULT_NUM_SHARDS = 4
+    DEFAULT_CURSOR_BATCH_SIZE = 1000
+
+    # Number of batches each range's thread may
+    # read ahead of the consumer:
+    QUEUE_DEPTH = 4
+
+    # Seconds between checks for an abandoned pass
+    # while a thread waits for room in its queue:
+    PUT_TIMEOUT = 1.0
+
+    def __init__(self,
+                 dbName,
+                 collection,
+                 numShards=DEFAULT_NUM_SHARDS,
+                 cursorBatchSize=DEFAULT_CURSOR_BATCH_SIZE,
+                 projection=None,
+                 idOrder=True,
+                 noCursorTimeout=True,
+                 mongoClient=None):
+        '''
+        :param dbName: name of the Mongo database. Ex: 'TmpForum'
+        :type dbName: String
+        :param collection: name of the collection of posts. Ex: 'contents'
+        :type collection: String
+        :param numShards: number of _id ranges read in parallel
+        :type numShards: int
+        :param cursorBatchSize: number of posts per cursor round trip,
+            and per batch handed from a range's thread to the consumer
+        :type cursorBatchSize: int
+        :param projection: names of the top level fields to fetch; _id is
+            always included. Default: all fields
+        :type projection: [String]
+        :param idOrder: with a single shard: if True, posts are read in _id
+            order, else in the server's natural order. Several shards are
+            always read in _id order within each range.
+        :type idOrder: Bool
+        :param noCursorTimeout: if True, the server keeps cursors open
+            however long the consumer pauses between batches
+        :type noCursorTimeout: Bool
+        :param mongoClient: connection to use. Default: a new connection to
+            the local mongod, closed by close()
+        :type mongoClient: MongoClient
+        '''
+        if numShards < 1:
+            raise ValueError("Number of shards must be at least 1; was %s" % str(numShards))
+        if cursorBatchSize < 1:
+            raise ValueError("Cursor batch size must be at least 1; was %s" % str(cursorBatchSize))
+        self.numShards = numShards
+        self.cursorBatchSize = cursorBatchSize
+        self.projection = None if projection is None else dict([(fieldName, 1) for fieldName in projection])
+        self.idOrder = idOrder
+        self.noCursorTimeout = noCursorTimeout
+        self.ownsClient = mongoClient is None
+        self.mongoClient = MongoClient() if mongoClient is None else mongoClient
+        self.collection = self.mongoClient[dbName][collection]
+
+    def shardRanges(self):
+        '''
+        Split the collection into at most numShards _id ranges
+        of about equal size. Boundaries are found by skipping
+        along the _id index.
+
+        :returns: list of (lowest _id, first _id beyond the range). None
+            stands for an open end.
+        :rtype: [(<any>, <any>)]
+        '''
+        numDocs = self.collection.count()
+        boundaries = []
+        for shardNum in range(1, self.numShards):
+            skip = numDocs * shardNum // self.numShards
+            if skip == 0:
+                continue
+            boundaryDocs = list(self.collection.find({}, {'_id' : 1}).sort('_id', ASCENDING).skip(skip).limit(1))
+            if len(boundaryDocs) > 0 and boundaryDocs[0]['_id'] not in boundaries:
+                boundaries.append(boundaryDocs[0]['_id'])
+        boundaries = [None] + boundaries + [None]
+        return zip(boundaries[:-1], boundaries[1:])
+
+    def query(self, queryDict=None):
+        '''
+        Iterator over the posts in the collection that match
+        queryDict; all posts by default. Mimics MongoDB.query().
+        With several shards, each range's cursor runs the query
+        within its range.
+
+        :param queryDict: Mongo query. Ex: {'course_id' : 'MITx/6.002x/2012_Fall'}
+        :type queryDict: {}
+        :returns: generator of forum post dicts
+        :rtype: generator
+        '''
+        queryDict = queryDict if queryDict is not None else {}
+        if self.numShards == 1:
+            return self.readCursor(queryDict)
+        return self.readShards(self.shardRanges(), queryDict)
+
+    def openCursor(self, queryDict, sortById):
+        '''
+        Open a cursor over the posts that match queryDict,
+        tuned as configured in the constructor.
+        '''
+        cursor = self.collection.find(queryDict, self.projection, no_cursor_timeout=self.noCursorTimeout)
+        if sortById:
+            cursor = cursor.sort('_id', ASCENDING)
+        return cursor.batch_size(self.cursorBatchSize)
+
+    def readCursor(self, queryDict):
+        '''
+        Iterator over the posts that match queryDict through
+        a single cursor, read by the consumer's own thread.
+        '''
+        cursor = self.openCursor(queryDict, self.idOrder)
+        try:
+            for mongoForumRec in cursor:
+                yield mongoForumRec
+        finally:
+            # Cursors without timeout linger on the
+            # server until closed explicitly:
+            cursor.close()
+
+    def readShards(self, shardRanges, queryDict):
+        stopEvent = threading.Event()
+        queues = [Queue.Queue(ShardedMongoReader.QUEUE_DEPTH) for _ in shardRanges]
+        threads = [threading.Thread(target=self.drainRange, args=(lowId, highId, queryDict, shardQueue, stopEvent))
+                   for (lowId, highId), shardQueue in zip(shardRanges, queues)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            activeQueues = list(queues)
+            while len(activeQueues) > 0:
+                for shardQueue in list(activeQueues):
+                    batch = shardQueue.get()
+                    if batch is None:
+                        # This range is done:
+                        activeQueues.remove(shardQueue)
+                    elif isinstance(batch, Exception):
+                        raise batch
+                    else:
+                        for mongoForumRec in batch:
+                            yield mongoForumRec
+        finally:
+            # Normal end, error, or the consumer stopped iterating:
+            stopEvent.set()
+            for thread in threads:
+                thread.join()
+
+    def drainRange(self, lowId, highId, queryDict, shardQueue, stopEvent):
+        '''
+        Thread body: read the posts of one _id range that match
+        queryDict in order, and put them into shardQueue,
+        cursorBatchSize at a time. A None marks the end of the
+        range; an exception is passed on to the consumer.
+        '''
+        idRange = {}
+        if lowId is not None:
+            idRange['$gte'] = lowId
+        if highId is not None:
+            idRange['$lt'] = highId
+        rangeQuery = [condition for condition in (queryDict, {'_id' : idRange} if len(idRange) > 0 else {})
+                      if len(condition) > 0]
+        if len(rangeQuery) > 1:
+            rangeQuery = {'$and' : rangeQuery}
+        else:
+            rangeQuery = rangeQuery[0] if len(rangeQuery) > 0 else {}
+        try:
+            cursor = self.openCursor(rangeQuery, True)
+            try:
+                batch = []
+                for mongoForumRec in cursor:
+                    batch.append(mongoForumRec)
+                    if len(batch) >= self.cursorBatchSize:
+                        if not self.putBatch(shardQueue, batch, stopEvent):
+                            return
+                        batch = []
+                if len(batch) > 0 and not self.putBatch(shardQueue, batch, stopEvent):
+                    return
+                self.putBatch(shardQueue, None, stopEvent)
+            finally:
+                cursor.close()
+        except Exception as e:
+            self.putBatch(shardQueue, e, stopEvent)
+
+    def putBatch(self, shardQueue, item, stopEvent):
+        '''
+        Put item into shardQueue once there is room. Returns
+        False if the consumer abandoned the pass meanwhile.
+        '''
+        while not stopEvent.is_set():
+            try:
+                shardQueue.put(item, timeout=ShardedMongoReader.PUT_TIMEOUT)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def distinctValues(self, fieldName, queryDict=None):
+        '''
+        Return the set of distinct values of the given top level
+        field, as computed by the server.
+
+        :param fieldName: name of a top level document field. Ex: 'author_id'
+        :type fieldName: String
+        :param queryDict: if given, only documents that match it are considered
+        :type queryDict: {}
+        :rtype: set
+        '''
+        return set(self.collection.distinct(fieldName, queryDict if queryDict else None))
+
+    def close(self):
+        if self.ownsClient:
+            self.mongoClient.close()
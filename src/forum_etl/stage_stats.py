@@ -0,0 +1,116 @@
+# Copyright (c) 2014, Stanford University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+'''
+Accumulates the wall time and number of calls of each stage of
+a forum conversion: reading posts, building records, the redaction
+steps, forum_uid lookup, writing to MySQL. EdxForumScrubber logs
+a report of the totals periodically, and at the end of a run.
+'''
+
+from collections import OrderedDict
+import threading
+import time
+
+
+class StageStats(object):
+
+    def __init__(self):
+        # Stage name --> [number of calls, total seconds],
+        # in order of the stages' first appearance:
+        self.stageTotals = OrderedDict()
+        # In pipelined runs the read, conversion, and write
+        # stages add their times from different threads:
+        self.lock = threading.Lock()
+
+    def add(self, stageName, secs, numCalls=1):
+        '''
+        Add the time of one or more calls of a stage.
+
+        :param stageName: name of the stage. Ex: 'read'
+        :type stageName: String
+        :param secs: wall time spent
+        :type secs: float
+        :param numCalls: number of calls the time covers
+        :type numCalls: int
+        '''
+        with self.lock:
+            try:
+                totals = self.stageTotals[stageName]
+            except KeyError:
+                totals = self.stageTotals[stageName] = [0, 0.0]
+            totals[0] += numCalls
+            totals[1] += secs
+
+    def timedIter(self, stageName, iterable):
+        '''
+        Generator over the items of iterable that adds the
+        time spent producing each item to the given stage.
+        '''
+        iterator = iter(iterable)
+        while True:
+            startTime = time.time()
+            try:
+                item = iterator.next()
+            except StopIteration:
+                return
+            self.add(stageName, time.time() - startTime)
+            yield item
+
+    def merge(self, stageTotals):
+        '''
+        Add totals that were collected elsewhere, such as
+        in an anonymization worker process.
+
+        :param stageTotals: stage name --> (number of calls, total seconds)
+        :type stageTotals: {String : (int, float)}
+        '''
+        for stageName, (numCalls, secs) in stageTotals.items():
+            self.add(stageName, secs, numCalls)
+
+    def takeTotals(self):
+        '''
+        Return the totals so far, and start over from zero.
+
+        :rtype: {String : (int, float)}
+        '''
+        with self.lock:
+            stageTotals = OrderedDict([(stageName, tuple(totals)) for stageName, totals in self.stageTotals.items()])
+            self.stageTotals = OrderedDict()
+        return stageTotals
+
+    def report(self, numRecords, wallSecs):
+        '''
+        Return a one-line summary: records per second of wall
+        time, and for each stage its share of the total stage
+        time, its number of calls, and the time per call. In
+        pipelined or parallel runs stages overlap, so stage
+        time can exceed wall time.
+
+        :param numRecords: number of records done so far
+        :type numRecords: int
+        :param wallSecs: wall time since the start of the run
+        :type wallSecs: float
+        :rtype: String
+        '''
+        with self.lock:
+            stageTotals = [(stageName, tuple(totals)) for stageName, totals in self.stageTotals.items()]
+        recordsPerSec = numRecords / wallSecs if wallSecs > 0 else 0.0
+        totalStageSecs = sum([secs for _, (_, secs) in stageTotals])
+        stageReports = []
+        for stageName, (numCalls, secs) in stageTotals:
+            stageReports.append('%s %.1f%% (%d calls, %.1f us/call)' %
+                                (stageName,
+                                 100.0 * secs / totalStageSecs if totalStageSecs > 0 else 0.0,
+                                 numCalls,
+                                 1e6 * secs / numCalls if numCalls > 0 else 0.0))
+        return '%d records in %.1f sec (%.1f records/sec); %s' % \
+            (numRecords, wallSecs, recordsPerSec, ', '.join(stageReports))
@@ -0,0 +1,342 @@
+# Copyright (c) 2014, Stanford University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+'''
+Writes synthetic OpenEdX Forum dumps in mongodump .bson format,
+for benchmarking EdxForumScrubber at production scale. The only
+real fixtures hold six posts.
+
+The dump is written one post at a time, so 10M posts take no
+more memory than 10k. What can be controlled:
+
+   - body length: the number of words per body is log-normally
+         distributed, with given mean and sigma, as in real forums:
+         many short posts, a long tail of very long ones.
+   - PII density: share of body words that are a phone number,
+         zip code, or email address.
+   - name density: share of body words that are the poster's own
+         first name or screen name, or a classmate's first name.
+   - author fan-out: posts are assigned to authors by a Zipf
+         distribution. authorSkew 0 spreads posts evenly; around 1
+         a few prolific posters write much of the forum.
+
+Next to the .bson file a tab-separated users file is written
+(user_int_id, name, screen_name, anon_screen_name), for loading
+into the table that EdxForumScrubber takes as allUsersTableName.
+The same seed always produces the same dump.
+
+Usage: python synth_forum.py [options] outFile.bson numPosts
+       numPosts may use the suffixes k and M. Ex: 10k, 1M, 10M
+'''
+
+import argparse
+import bisect
+from datetime import datetime, timedelta
+import math
+import os
+import random
+import struct
+import sys
+
+from bson import BSON
+from bson.objectid import ObjectId
+
+
+class SyntheticForum(object):
+
+    # Vocabulary of ordinary body words:
+    WORDS = ['the', 'circuit', 'voltage', 'homework', 'question', 'thanks', 'I', 'think',
+             'answer', 'is', 'wrong', 'because', 'resistor', 'current', 'lecture', 'video',
+             'problem', 'set', 'why', 'does', 'my', 'code', 'fail', 'on', 'test', 'case',
+             'can', 'someone', 'explain', 'this', 'step', 'please', 'graph', 'of', 'a',
+             'function', 'derivative', 'and', 'it', 'works', 'now', 'great', 'course']
+
+    FIRST_NAMES = ['Otto', 'Bebe', 'Andreas', 'Maria', 'Jose', 'Wei', 'Aisha', 'Lena', 'Ravi',
+                   'Sofia', 'Kenji', 'Olga', 'Pedro', 'Fatima', 'John', 'Mei', 'Ahmed', 'Ingrid']
+    LAST_NAMES = ['van Homberg', 'Winter', 'Fritz', 'Garcia', 'Chen', 'Okafor', 'Novak',
+                  'Patel', 'Rossi', 'Tanaka', 'Ivanova', 'Silva', 'Haddad', 'Smith', 'Lee']
+
+    # Longest body the TEXT column of the forum table holds:
+    MAX_BODY_LEN = 65535
+
+    # Time of the first post, and mean seconds between posts:
+    FIRST_POST_TIME = datetime(2013, 1, 7, 8, 0, 0)
+    MEAN_POST_INTERVAL = 30
+
+    def __init__(self,
+                 numPosts,
+                 numAuthors=None,
+                 numCourses=10,
+                 meanBodyWords=60,
+                 bodyWordsSigma=1.0,
+                 piiDensity=0.01,
+                 nameDensity=0.01,
+                 authorSkew=1.1,
+                 threadShare=0.2,
+                 seed=4711):
+        '''
+        :param numPosts: number of posts in the dump
+        :type numPosts: int
+        :param numAuthors: number of distinct users who post. Default: one per 20 posts
+        :type numAuthors: int
+        :param numCourses: number of course_ids the posts are spread over
+        :type numCourses: int
+        :param meanBodyWords: mean number of words per body
+        :type meanBodyWords: float
+        :param bodyWordsSigma: sigma of the log-normal body length distribution.
+            0: all bodies have meanBodyWords words.
+        :type bodyWordsSigma: float
+        :param piiDensity: share of body words that are phone numbers, zips, or emails
+        :type piiDensity: float
+        :param nameDensity: share of body words that are names of the poster or of classmates
+        :type nameDensity: float
+        :param authorSkew: exponent of the Zipf distribution of posts over authors
+        :type authorSkew: float
+        :param threadShare: share of posts that start a thread; the rest are comments
+        :type threadShare: float
+        :param seed: random seed
+        :type seed: int
+        '''
+        self.numPosts = numPosts
+        self.numAuthors = numAuthors if numAuthors is not None else max(10, numPosts // 20)
+        self.courseIds = ['SynthX/CS%03d/2013_Spring' % courseNum for courseNum in range(numCourses)]
+        self.meanBodyWords = meanBodyWords
+        self.bodyWordsSigma = bodyWordsSigma
+        self.piiDensity = piiDensity
+        self.nameDensity = nameDensity
+        self.threadShare = threadShare
+        self.seed = seed
+
+        # Authors, as (user_int_id, name, screen_name, anon_screen_name):
+        rand = random.Random(seed)
+        self.authors = []
+        for authorIndex in range(self.numAuthors):
+            firstName = rand.choice(SyntheticForum.FIRST_NAMES)
+            name = '%s %s' % (firstName, rand.choice(SyntheticForum.LAST_NAMES))
+            screenName = '%s%d' % (firstName.lower(), authorIndex)
+            anonScreenName = '%040x' % rand.getrandbits(160)
+            self.authors.append((authorIndex + 1, name, screenName, anonScreenName))
+
+        # Cumulative Zipf weights: the author at rank r
+        # gets posts in proportion to 1/r**authorSkew:
+        self.authorCumWeights = []
+        totalWeight = 0.0
+        for rank in range(1, self.numAuthors + 1):
+            totalWeight += 1.0 / rank ** authorSkew
+            self.authorCumWeights.append(totalWeight)
+
+    def pickAuthor(self, rand):
+        authorIndex = bisect.bisect_left(self.authorCumWeights, rand.random() * self.authorCumWeights[-1])
+        return self.authors[min(authorIndex, self.numAuthors - 1)]
+
+    def makePii(self, rand):
+        kind = rand.randint(0, 2)
+        if kind == 0:
+            return '%d-%03d-%04d' % (rand.choice([650, 415, 212, 617]), rand.randint(200, 999), rand.randint(0, 9999))
+        elif kind == 1:
+            return '%05d' % rand.randint(10000, 99999)
+        else:
+            return '%s.%d@%s' % (rand.choice(SyntheticForum.WORDS), rand.randint(1, 999),
+                                 rand.choice(['gmail.com', 'comcast.com', 'cs.stanford.edu']))
+
+    def makeBody(self, rand, author):
+        '''
+        Body of a post by the given author: log-normally many
+        words, sprinkled with PII and names.
+        '''
+        if self.bodyWordsSigma > 0:
+            # Choose mu so that the mean of the distribution is meanBodyWords:
+            mu = math.log(self.meanBodyWords) - self.bodyWordsSigma ** 2 / 2
+            numWords = max(1, int(rand.lognormvariate(mu, self.bodyWordsSigma)))
+        else:
+            numWords = max(1, int(self.meanBodyWords))
+        # Cap early; each word is at least two chars with its space:
+        numWords = min(numWords, SyntheticForum.MAX_BODY_LEN // 2)
+        words = SyntheticForum.WORDS
+        numVocab = len(words)
+        piiDensity = self.piiDensity
+        nameLimit = piiDensity + self.nameDensity
+        bodyWords = []
+        for _ in xrange(numWords):
+            dice = rand.random()
+            if dice >= nameLimit:
+                bodyWords.append(words[int(rand.random() * numVocab)])
+            elif dice < piiDensity:
+                bodyWords.append(self.makePii(rand))
+            else:
+                # Poster's own first name or screen name, or a classmate's first name:
+                nameKind = rand.randint(0, 2)
+                if nameKind == 0:
+                    bodyWords.append(author[1].split()[0])
+                elif nameKind == 1:
+                    bodyWords.append(author[2])
+                else:
+                    bodyWords.append(rand.choice(self.authors)[1].split()[0])
+        return ' '.join(bodyWords)[:SyntheticForum.MAX_BODY_LEN]
+
+    def makeVotes(self, rand):
+        upVoters = [str(rand.randint(1, self.numAuthors)) for _ in range(rand.randint(0, 4))]
+        downVoters = [str(rand.randint(1, self.numAuthors)) for _ in range(rand.randint(0, 2))]
+        return {'count' : len(upVoters) + len(downVoters),
+                'up' : upVoters,
+                'down' : downVoters,
+                'up_count' : len(upVoters),
+                'down_count' : len(downVoters),
+                'point' : len(upVoters) - len(downVoters)}
+
+    def posts(self):
+        '''
+        Generator of all posts, in order of creation. Each
+        comment belongs to one of the recent threads of its course.
+        '''
+        rand = random.Random(self.seed + 1)
+        postTime = SyntheticForum.FIRST_POST_TIME
+        # Course --> ids of its most recent threads:
+        recentThreads = dict([(courseId, []) for courseId in self.courseIds])
+        for postNum in xrange(self.numPosts):
+            postTime += timedelta(seconds=rand.expovariate(1.0 / SyntheticForum.MEAN_POST_INTERVAL))
+            # ObjectIds are time plus counter, so _id order is creation order:
+            postId = ObjectId(struct.pack('>ii', int((postTime - datetime(1970, 1, 1)).total_seconds()), 0) +
+                              struct.pack('>i', postNum))
+            courseId = rand.choice(self.courseIds)
+            author = self.pickAuthor(rand)
+            threads = recentThreads[courseId]
+            post = {'_id' : postId,
+                    'anonymous' : rand.random() < 0.02,
+                    'anonymous_to_peers' : False,
+                    'at_position_list' : [],
+                    'author_id' : str(author[0]),
+                    'author_username' : author[2],
+                    'body' : self.makeBody(rand, author),
+                    'course_id' : courseId,
+                    'created_at' : postTime,
+                    'updated_at' : postTime,
+                    'votes' : self.makeVotes(rand)}
+            if len(threads) == 0 or rand.random() < self.threadShare:
+                post['_type'] = 'CommentThread'
+                post['title'] = ' '.join([rand.choice(SyntheticForum.WORDS) for _ in range(6)])
+                post['commentable_id'] = 'video_%d' % rand.randint(1, 50)
+                post['closed'] = False
+                post['comment_count'] = 0
+                post['last_activity_at'] = postTime
+                post['tags_array'] = []
+                threads.append(postId)
+                # Comments go to one of the last 50 threads of the course:
+                if len(threads) > 50:
+                    del threads[0]
+            else:
+                threadId = rand.choice(threads)
+                post['_type'] = 'Comment'
+                post['comment_thread_id'] = threadId
+                post['parent_ids'] = []
+                post['sk'] = str(postId)
+                post['endorsed'] = False
+            yield post
+
+    def writeBson(self, bsonFileName):
+        '''
+        Write all posts to a .bson file, as mongodump would.
+
+        :param bsonFileName: file to create
+        :type bsonFileName: String
+        :returns: number of posts written
+        :rtype: int
+        '''
+        numWritten = 0
+        with open(bsonFileName, 'wb') as bsonFd:
+            for post in self.posts():
+                bsonFd.write(BSON.encode(post))
+                numWritten += 1
+        return numWritten
+
+    def writeUsers(self, usersFileName):
+        '''
+        Write the authors as tab-separated user_int_id, name,
+        screen_name, anon_screen_name; ready for LOAD DATA INFILE.
+
+        :param usersFileName: file to create
+        :type usersFileName: String
+        '''
+        with open(usersFileName, 'w') as usersFd:
+            for author in self.authors:
+                usersFd.write('%d\t%s\t%s\t%s\n' % author)
+
+def usersFileNameFor(bsonFileName):
+    '''
+    Name of the users file that goes with a synthetic dump:
+    /tmp/forum1M.bson --> /tmp/forum1M_users.tsv
+    '''
+    return os.path.splitext(bsonFileName)[0] + '_users.tsv'
+
+def parseCount(countStr):
+    '''
+    '10k' --> 10000, '1M' --> 1000000, '500' --> 500
+    '''
+    multipliers = {'k' : 1000, 'K' : 1000, 'M' : 1000000}
+    if countStr[-1] in multipliers:
+        return int(float(countStr[:-1]) * multipliers[countStr[-1]])
+    return int(countStr)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]), formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--authors',
+                        help='Number of distinct posters. Default: one per 20 posts',
+                        type=int,
+                        default=None)
+    parser.add_argument('--courses',
+                        help='Number of courses. Default: 10',
+                        type=int,
+                        default=10)
+    parser.add_argument('--bodyWords',
+                        help='Mean number of words per post body. Default: 60',
+                        type=float,
+                        default=60)
+    parser.add_argument('--bodySigma',
+                        help='Sigma of the log-normal body length distribution. 0: fixed length. Default: 1.0',
+                        type=float,
+                        default=1.0)
+    parser.add_argument('--piiDensity',
+                        help='Share of body words that are phone numbers, zip codes, or emails. Default: 0.01',
+                        type=float,
+                        default=0.01)
+    parser.add_argument('--nameDensity',
+                        help='Share of body words that are names of the poster or classmates. Default: 0.01',
+                        type=float,
+                        default=0.01)
+    parser.add_argument('--authorSkew',
+                        help='Zipf exponent of posts per author. 0: even. Default: 1.1',
+                        type=float,
+                        default=1.1)
+    parser.add_argument('--seed',
+                        help='Random seed. Default: 4711',
+                        type=int,
+                        default=4711)
+    parser.add_argument('bsonFile',
+                        help='The .bson file to create. The users file is written next to it.')
+    parser.add_argument('numPosts',
+                        help='Number of posts. Ex: 10k, 1M, 10M')
+    args = parser.parse_args();
+
+    forum = SyntheticForum(parseCount(args.numPosts),
+                           numAuthors=args.authors,
+                           numCourses=args.courses,
+                           meanBodyWords=args.bodyWords,
+                           bodyWordsSigma=args.bodySigma,
+                           piiDensity=args.piiDensity,
+                           nameDensity=args.nameDensity,
+                           authorSkew=args.authorSkew,
+                           seed=args.seed)
+    usersFileName = usersFileNameFor(args.bsonFile)
+    forum.writeUsers(usersFileName)
+    print('Wrote %d users to %s' % (forum.numAuthors, usersFileName))
+    numPosts = forum.writeBson(args.bsonFile)
+    print('Wrote %d posts to %s' % (numPosts, args.bsonFile))
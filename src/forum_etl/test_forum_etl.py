@@ -17,18 +17,113 @@ from collections import OrderedDict
 import datetime
 import json
 import os
+import re
+import shutil
+import stat
+import tempfile
+import time
 import unittest
 
+from bson import BSON
+import MySQLdb
 from json_to_relation.mongodb import MongoDB
 
-from extractor import EdxForumScrubber
+from benchmark_forum_etl import loadUsers
+from bson_reader import BsonForumReader
+from checkpoint import ConversionCheckpoint
+from course_driver import CourseParallelDriver
+from extractor import EdxForumScrubber, ForumRecord
+import forum_writers
+from forum_writers import BatchInsertWriter, LoadDataInfileWriter, ParquetWriter
+from pipeline import StagedPipeline
+from post_hashes import PostHashIndex, UnchangedPostFilter
+from profiling import ConversionProfiler
+from redaction import NameRedactor, PIIRedactor
+from sharded_reader import ShardedMongoReader
+from stage_stats import StageStats
+from synth_forum import SyntheticForum, usersFileNameFor
+from user_cache import UserCache
+from watermarks import WatermarkFilter
 from pymysql_utils.pymysql_utils import MySQLDB
 
+# In-memory stand-in for a mongod, if installed:
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
 # To run just one selected test method,
 # set the following to False, and comment
 # the desired method's 'skip-if' decoration:
 RUN_ALL_TESTS = True
 
+class TestCheckpoint(unittest.TestCase):
+
+    def testSaveLoadRemove(self):
+        checkpointDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, checkpointDir)
+        checkpoint = ConversionCheckpoint(os.path.join(checkpointDir, 'checkpoint.json'))
+        self.assertIsNone(checkpoint.load())
+        checkpoint.save('forum.bson', 1000, 'p999', 'contents_staging', 500)
+        self.assertEqual({'bsonFileName' : 'forum.bson', 'numPostsDone' : 1000, 'lastPostId' : 'p999',
+                          'loadTableName' : 'contents_staging', 'batchSize' : 500},
+                         checkpoint.load())
+        # Nothing is left under the temporary name:
+        self.assertEqual(['checkpoint.json'], os.listdir(checkpointDir))
+        # Unreadable and incomplete checkpoints are ignored:
+        with open(checkpoint.fileName, 'w') as fd:
+            fd.write('{"bsonFileName" : "forum.bson", "numPostsDone"')
+        self.assertIsNone(checkpoint.load())
+        with open(checkpoint.fileName, 'w') as fd:
+            json.dump({'bsonFileName' : 'forum.bson', 'numPostsDone' : 1000}, fd)
+        self.assertIsNone(checkpoint.load())
+        checkpoint.remove()
+        self.assertEqual([], os.listdir(checkpointDir))
+        # Removing twice is harmless:
+        checkpoint.remove()
+
+class TestCourseDriver(unittest.TestCase):
+
+    def testCourseTableNames(self):
+        driver = CourseParallelDriver('unused.bson', numProcesses=1)
+        self.assertEqual('contents_MITx_6_002x_2012_Fall', driver.courseTableName('MITx/6.002x/2012_Fall'))
+        longNames = [driver.courseTableName('Engineering/Introduction_to_Something_Quite_Long/2014_Spring_Term_%d' % termNum)
+                     for termNum in (1, 2)]
+        # Room is left for the staging table's suffix:
+        for longName in longNames:
+            self.assertLessEqual(len(longName + EdxForumScrubber.STAGING_TABLE_SUFFIX), CourseParallelDriver.MAX_TABLE_NAME_LEN)
+        self.assertNotEqual(longNames[0], longNames[1])
+
+    @unittest.skipIf(not RUN_ALL_TESTS,
+                     'Uncomment this decoration if RUN_ALL_TESTS is False, and you want to run just this test.')
+    def testRerunReplacesPosts(self):
+        # Needs MySQL: the courses' scrubbers connect to EdxForum
+        # the way a command line run does.
+        tmpDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpDir)
+        bsonFileName = os.path.join(tmpDir, 'driverTest.bson')
+        synthForum = SyntheticForum(60, numCourses=3, seed=3)
+        synthForum.writeBson(bsonFileName)
+        synthForum.writeUsers(usersFileNameFor(bsonFileName))
+        scrubberArgs = {'allUsersTableName' : 'EdxForum.DriverTestUsers', 'userCacheDir' : None, 'statsInterval' : 0,
+                        'stagingSwap' : True}
+        # A scrubber that only provides the connection:
+        scrubber = EdxForumScrubber(bsonFileName, forumTableName='DriverTestContents', appendToTable=True, **scrubberArgs)
+        mydb = scrubber.mydb
+        self.addCleanup(mydb.close)
+        for tableName in ('DriverTestContents', 'DriverTestContents_staging', 'DriverTestUsers'):
+            self.addCleanup(mydb.dropTable, 'EdxForum.' + tableName)
+        loadUsers(mydb, 'EdxForum.DriverTestUsers', usersFileNameFor(bsonFileName))
+
+        # A rerun replaces the posts of the first run, rather than adding to them:
+        for _ in range(2):
+            results = CourseParallelDriver(bsonFileName, numProcesses=2, forumTableName='DriverTestContents',
+                                           scrubberArgs=scrubberArgs).run()
+            self.assertEqual([], [errorMsg for _, _, _, errorMsg in results if errorMsg is not None])
+            self.assertEqual(60, mydb.query('SELECT COUNT(*) FROM DriverTestContents').next()[0])
+        self.assertEqual(0, mydb.query("SELECT COUNT(*) FROM information_schema.tables " +
+                                       "WHERE table_schema = 'EdxForum' AND table_name = 'DriverTestContents_staging'").next()[0])
+
 class TestForumEtl(unittest.TestCase):
 
     # Forum rows have the following columns:
@@ -138,7 +233,31 @@ class TestForumEtl(unittest.TestCase):
             # print(str(rowNum) + ':' + str(forumPost))
             self.assertEqual(TestForumEtl.tinyForumGoldClear[rowNum], forumPost)
 
+    @unittest.skipIf(not RUN_ALL_TESTS, 
+                     'Uncomment this decoration if RUN_ALL_TESTS is False, and you want to run just this test.')    
+    def testAnonymizedFromBsonFile(self):
+        # Same posts as in the MongoDB, but read straight
+        # from a .bson file, without any mongod involved:
+        bsonReader = BsonForumReader(self.makeTinyForumBsonFile())
+        self.forumScrubberAnonymized.populateUserCache()
+        self.forumScrubberAnonymized.forumMongoToRelational(bsonReader, self.mysqldb, 'contents')  
+        self.assertEqual(6, bsonReader.numDocsRead)
+        for rowNum, forumPost in enumerate(self.mysqldb.query('SELECT * FROM unittest.contents')):
+            self.assertEqual(TestForumEtl.tinyForumGoldAnonymized[rowNum], forumPost)
 
+    def makeTinyForumBsonFile(self):
+        '''
+        Write the posts of data/tinyForum.json into a temporary
+        .bson file, as mongodump would. Returns the file name.
+        '''
+        currDir = os.path.dirname(__file__)
+        bsonFd = tempfile.NamedTemporaryFile(prefix='tinyForum', suffix='.bson', delete=False)
+        with open(os.path.join(currDir, 'data/tinyForum.json'), 'r') as jsonFd:
+            for line in jsonFd:
+                bsonFd.write(BSON.encode(json.loads(line)))
+        bsonFd.close()
+        self.addCleanup(os.remove, bsonFd.name)
+        return bsonFd.name
     
     def resetMongoTestDb(self):
         self.mongoDb.clearCollection()
@@ -175,6 +294,580 @@ class TestForumEtl(unittest.TestCase):
                                  ('Bebe Winter', 'bebeW',10,'History of Baking',1,'passing',10,'ghi')
                                  ])
 
+class TestForumRecord(unittest.TestCase):
+
+    def testPostWithoutVotes(self):
+        forumRecord = ForumRecord({'_id' : 'noVotes', '_type' : 'Comment', 'body' : 'No votes here.',
+                                   'author_id' : 5, 'author_username' : 'otto_king'})
+        self.assertEqual('None', forumRecord.votes)
+        self.assertEqual('-1', forumRecord.up)
+        self.assertEqual(('', '', '', ''),
+                         (forumRecord.count, forumRecord.down_count, forumRecord.up_count, forumRecord.down))
+
+    def testScreenNameInTheClear(self):
+        forumRecord = ForumRecord({'_id' : 'clear', '_type' : 'Comment', 'body' : 'Hi.',
+                                   'author_id' : 5, 'author_username' : 'otto_king'})
+        # Clear tables show the poster's screen name, not an empty string:
+        self.assertEqual('otto_king', forumRecord['screen_name'])
+        self.assertEqual('otto_king', forumRecord.getUserNameClear())
+
+class TestForumWriters(unittest.TestCase):
+
+    class RefusingDb(object):
+        # Stand-in for MySQLDB that refuses rows whose body is 'bad':
+        def __init__(self):
+            self.rows = []
+        def bulkInsert(self, tblName, colNames, rows):
+            if any([row[1] == 'bad' for row in rows]):
+                raise MySQLdb.Error(1366, 'Incorrect string value')
+            self.rows.extend(rows)
+        def insert(self, tblName, colValDict):
+            if colValDict['body'] == 'bad':
+                raise MySQLdb.Error(1366, 'Incorrect string value')
+            self.rows.append((colValDict['forum_post_id'], colValDict['body']))
+
+    def testRefusedBatchFallsBackToSingleRows(self):
+        mydb = TestForumWriters.RefusingDb()
+        refused = []
+        writer = BatchInsertWriter(mydb, 'unittest.contents', ['forum_post_id', 'body'], batchSize=3,
+                                   rowErrorCallback=lambda recordObj, recordNum, e: refused.append((recordObj, recordNum)))
+        for postNum, body in enumerate(['good', 'bad', 'good', 'good']):
+            writer.write(('p%d' % postNum, body), 'record%d' % postNum)
+        writer.close()
+        # Only the bad row is lost; the good rows of its batch are in:
+        self.assertEqual([('p0', 'good'), ('p2', 'good'), ('p3', 'good')], mydb.rows)
+        self.assertEqual([('record1', 1)], refused)
+        self.assertEqual((4, 3), (writer.numRowsReceived, writer.numRowsWritten))
+
+    class WarningDb(object):
+        # Stand-in for MySQLDB whose LOAD DATA truncates the
+        # second row of a chunk, and skips the third:
+        class Cursor(object):
+            def __init__(self):
+                self.rowcount = -1
+            def execute(self, cmd):
+                if cmd.startswith('LOAD DATA'):
+                    self.rowcount = 2
+            def fetchall(self):
+                return (('Warning', 1265, "Data truncated for column 'body' at row 2"),
+                        ('Warning', 1062, "Duplicate entry 'p2' for key 'PRIMARY'"),
+                        ('Warning', 1262, 'Row 3 was truncated; it contained more data than there were input columns'))
+            def close(self):
+                pass
+        class Connection(object):
+            def cursor(self):
+                return TestForumWriters.WarningDb.Cursor()
+            def commit(self):
+                pass
+        def __init__(self):
+            self.connection = TestForumWriters.WarningDb.Connection()
+
+    def testLoadWarningsReportRows(self):
+        refused = []
+        infos = []
+        writer = LoadDataInfileWriter(TestForumWriters.WarningDb(), 'unittest.contents', ['forum_post_id', 'body'],
+                                      maxRowsPerChunk=3, logInfo=infos.append,
+                                      rowErrorCallback=lambda rowDict, recordNum, e: refused.append((rowDict, recordNum)))
+        for postNum, body in enumerate(['good', 'too long', 'extra\tcolumn']):
+            writer.write(('p%d' % postNum, body))
+        writer.close()
+        self.assertEqual([({'forum_post_id' : 'p1', 'body' : 'too long'}, 1),
+                          ({'forum_post_id' : 'p2', 'body' : 'extra\\tcolumn'}, 2)],
+                         refused)
+        # Only the rows MySQL loaded count as written:
+        self.assertEqual((3, 2), (writer.numRowsReceived, writer.numRowsWritten))
+        # Warnings that name no row are only logged:
+        self.assertTrue(any(['Duplicate entry' in info for info in infos]))
+
+    def testSpoolEscaping(self):
+        # Quotes pass through; backslashes, tabs and newlines are escaped:
+        self.assertEqual('He said \\\\"hi\\\\" and \'bye\'\\nsee\\ttab \\\\ slash',
+                         LoadDataInfileWriter.escapeValue('He said \\"hi\\" and \'bye\'\nsee\ttab \\ slash'))
+        self.assertEqual('\\N', LoadDataInfileWriter.escapeValue(None))
+        self.assertEqual('10', LoadDataInfileWriter.escapeValue(10L))
+        self.assertEqual('caf\xc3\xa9', LoadDataInfileWriter.escapeValue(u'caf\xe9'))
+
+    @unittest.skipIf(forum_writers.pyarrow is None, 'pyarrow not installed')
+    def testParquetPartitions(self):
+        import pyarrow.parquet
+        outDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, outDir)
+        writer = ParquetWriter(outDir,
+                               ['forum_post_id', 'course_display_name', 'created_at', 'count'],
+                               ['varchar(40)', 'varchar(100)', 'datetime NOT NULL', 'int(11) NOT NULL'],
+                               rowGroupSize=2)
+        writer.write(('p1', 'MITx/6.002x/2012_Fall', '2013-05-16T04:32:20.868Z', 1))
+        writer.write(('p2', 'MITx/6.002x/2012_Fall', '2013-05-17 10:00:00', 2))
+        writer.write(('p3', 'MITx/6.002x/2012_Fall', '2013-06-01 10:00:00', 3))
+        writer.close()
+        self.assertEqual(3, writer.numRowsWritten)
+        courseDir = os.path.join(outDir, 'course_display_name=MITx%2F6.002x%2F2012_Fall')
+        self.assertEqual(['created_month=2013-05', 'created_month=2013-06'], sorted(os.listdir(courseDir)))
+        table = pyarrow.parquet.read_table(os.path.join(courseDir, 'created_month=2013-05', 'part-00000.parquet'))
+        # Course comes from the path, not the file:
+        self.assertEqual(['forum_post_id', 'created_at', 'count'], table.schema.names)
+        self.assertEqual({'forum_post_id' : ['p1', 'p2'],
+                          'created_at' : [datetime.datetime(2013, 5, 16, 4, 32, 20, 868000), datetime.datetime(2013, 5, 17, 10)],
+                          'count' : [1, 2]},
+                         table.to_pydict())
+        # An earlier run's files are never mixed in:
+        self.assertRaises(ValueError, ParquetWriter, outDir, ['course_display_name', 'created_at'], ['varchar(100)', 'datetime'])
+
+class TestPostHashes(unittest.TestCase):
+
+    class PostList(object):
+        # Stand-in for a BsonForumReader:
+        def __init__(self, posts):
+            self.posts = posts
+        def query(self, queryDict):
+            return iter(self.posts)
+
+    def testOnlyChangedPostsPass(self):
+        posts = [{'_id' : 'p1', 'body' : 'Hi', 'author_id' : '5', 'votes' : {'up_count' : 1, 'down_count' : 0}},
+                 {'_id' : 'p2', 'body' : u'Caf\xe9', 'author_id' : '7', 'votes' : {'up_count' : 0, 'down_count' : 0}}]
+        postFilter = UnchangedPostFilter(TestPostHashes.PostList(posts), PostHashIndex())
+        self.assertEqual(2, len(list(postFilter.query({}))))
+        postFilter.newIndex.finish()
+
+        indexFd = tempfile.NamedTemporaryFile(suffix='.bin', delete=False)
+        indexFd.close()
+        self.addCleanup(os.remove, indexFd.name)
+        postFilter.newIndex.save(indexFd.name, 'EdxForum.contents anonymize=True')
+        self.assertIsNone(PostHashIndex.load(indexFd.name, 'EdxForum.contents anonymize=False'))
+        previousIndex = PostHashIndex.load(indexFd.name, 'EdxForum.contents anonymize=True')
+
+        # A vote without a new updated_at counts as a change:
+        posts[0]['votes'] = {'down_count' : 0, 'up_count' : 2}
+        posts.append({'_id' : 'p3', 'body' : 'New'})
+        postFilter = UnchangedPostFilter(TestPostHashes.PostList(posts), previousIndex)
+        self.assertEqual(['p1', 'p3'], [post['_id'] for post in postFilter.query({})])
+        self.assertEqual(1, postFilter.numPostsSkipped)
+        self.assertEqual(2, postFilter.numPostsMatched)
+
+class TestProfiling(unittest.TestCase):
+
+    def testSamplingProfile(self):
+        def busyConversion():
+            endTime = time.time() + 0.3
+            while time.time() < endTime:
+                sum(xrange(1000))
+        artifactFd = tempfile.NamedTemporaryFile(suffix='.folded', delete=False)
+        artifactFd.close()
+        self.addCleanup(os.remove, artifactFd.name)
+        profiler = ConversionProfiler(ConversionProfiler.SAMPLING, sampleRate=200, topN=5)
+        summary = profiler.run(busyConversion, artifactFd.name)
+        self.assertIn('busyConversion', summary)
+        with open(artifactFd.name, 'r') as artifactFd:
+            # Collapsed stacks: 'frame;frame;... count', rooted at the thread:
+            stack, count = artifactFd.readline().rsplit(' ', 1)
+        self.assertTrue(stack.startswith('MainThread;'))
+        self.assertTrue(int(count) > 0)
+        self.assertRaises(ValueError, ConversionProfiler, 'statistical')
+
+class TestRedaction(unittest.TestCase):
+
+    def setUp(self):
+        self.redactor = PIIRedactor()
+
+    def testPhoneZipEmail(self):
+        self.assertEqual('Call <phoneRedac> in <zipRedac> today',
+                         self.redactor.redact('Call 650-333-4567 in 94305-1234 today'))
+        self.assertEqual(' Body with <emailRedac> email.',
+                         self.redactor.redact('Body with joe@comcast.com email.'))
+        self.assertEqual(' Mail <emailRedac> or <emailRedac> ',
+                         self.redactor.redact('Mail ann@cs.stanford.edu or bob@comcast.com'))
+        self.assertEqual('Nothing to see here', self.redactor.redact('Nothing to see here'))
+
+    def testSingleKind(self):
+        self.assertEqual('Call <phoneRedac> in 94305',
+                         PIIRedactor([PIIRedactor.PHONE]).redact('Call 650-333-4567 in 94305'))
+
+    def testClassmateNames(self):
+        nameRedactor = NameRedactor()
+        nameRedactor.addNames(['Otto', 'Theo', 'Will'], requireCapitalized=True)
+        nameRedactor.addNames(['otto_king'])
+        # Whole words only; first names only where capitalized;
+        # 'Will' is on the stop-list:
+        self.assertEqual('Ask <nameRedac> or <nameRedac> about Theology; otto knows. Will he?',
+                         nameRedactor.redact('Ask Theo or OTTO_KING about Theology; otto knows. Will he?'))
+
+class TestPipeline(unittest.TestCase):
+
+    def testOrderAndFailure(self):
+        written = []
+        pipeline = StagedPipeline(queueSize=2)
+        pipeline.writeBehind((item * 2 for item in pipeline.readAhead(xrange(100))), written.append)
+        self.assertEqual(range(0, 200, 2), written)
+
+        def brokenSource():
+            yield 1
+            raise IOError('source broke')
+        pipeline = StagedPipeline(queueSize=2)
+        self.assertRaises(IOError, pipeline.writeBehind, pipeline.readAhead(brokenSource()), written.append)
+
+class TestScrubber(unittest.TestCase):
+
+    class UserDb(object):
+        # Stand-in for MySQLDB with the users of TestForumEtl's UserGrade
+        # table, whose forum_uids are 'fuid' + user_int_id:
+        USERS = [(5, 'Otto van Homberg', 'otto_king', 'abc'),
+                 (7, 'Andreas Fritz', 'fritzL', 'def'),
+                 (10, 'Bebe Winter', 'bebeW', 'ghi')]
+        def __init__(self):
+            self.tables = {}
+            self.queries = []
+            self.executed = []
+        def dbName(self):
+            return 'unittest'
+        def execute(self, cmd):
+            self.executed.append(cmd)
+        def dropTable(self, tblName):
+            self.tables.pop(tblName, None)
+        def bulkInsert(self, tblName, colNames, rows):
+            self.tables.setdefault(tblName, []).extend(rows)
+        def query(self, queryStr):
+            self.queries.append(queryStr)
+            if 'FROM ForumUidPrefetch' in queryStr:
+                return iter([(row[0], 'fuid%d' % row[0]) for row in self.tables.get('ForumUidPrefetch', [])])
+            if 'idInt2Forum(' in queryStr:
+                return iter([('fuid%s' % queryStr.split('(')[1].split(')')[0],)])
+            if 'UserGrade' in queryStr and ' in (' in queryStr:
+                userIntIds = [int(userIntId) for userIntId in queryStr.split(' in (')[1].split(')')[0].split(',')]
+                return iter([user for user in TestScrubber.UserDb.USERS if user[0] in userIntIds])
+            if 'UserGrade' in queryStr:
+                return iter(TestScrubber.UserDb.USERS)
+            if 'COUNT(*)' in queryStr:
+                return iter([(0,)])
+            return iter([])
+        def close(self):
+            pass
+
+    class SchemaDb(UserDb):
+        # UserDb that also keeps track of which tables exist, and
+        # of their indexed columns. Tables of the 'unittest' db are
+        # known by their bare names. Each RENAME TABLE is recorded,
+        # together with the number of rows that 'contents' held,
+        # and whether the scrubber's checkpoint still existed:
+        def __init__(self, checkpointFileName):
+            TestScrubber.UserDb.__init__(self)
+            self.checkpointFileName = checkpointFileName
+            self.indexes = {}
+            self.renames = []
+        def bareName(self, tblName):
+            return tblName.split('.')[-1]
+        def execute(self, cmd):
+            TestScrubber.UserDb.execute(self, cmd)
+            createMatch = re.match(r'CREATE TABLE (IF NOT EXISTS )?(\w+)', cmd)
+            if createMatch is not None and createMatch.group(2) not in self.indexes:
+                self.indexes[createMatch.group(2)] = set()
+                self.tables[createMatch.group(2)] = []
+            elif cmd.startswith('ALTER TABLE'):
+                self.indexes[cmd.split()[2]].update(re.findall(r'ADD INDEX \w+ \((\w+)\)', cmd))
+            elif cmd.startswith('RENAME TABLE'):
+                self.renames.append((cmd, len(self.tables.get('contents', [])), os.path.exists(self.checkpointFileName)))
+                for fromName, toName in re.findall(r'(\w+) TO (\w+)', cmd):
+                    self.indexes[toName] = self.indexes.pop(fromName)
+                    self.tables[toName] = self.tables.pop(fromName)
+        def dropTable(self, tblName):
+            self.indexes.pop(self.bareName(tblName), None)
+            self.tables.pop(self.bareName(tblName), None)
+        def bulkInsert(self, tblName, colNames, rows):
+            TestScrubber.UserDb.bulkInsert(self, self.bareName(tblName), colNames, rows)
+        def query(self, queryStr):
+            tableMatch = re.search(r"table_name = '(\w+)'", queryStr)
+            if tableMatch is None:
+                return TestScrubber.UserDb.query(self, queryStr)
+            if 'information_schema.tables' in queryStr:
+                return iter([(1 if tableMatch.group(1) in self.indexes else 0,)])
+            return iter([(colName,) for colName in self.indexes.get(tableMatch.group(1), [])])
+
+    def makeScrubber(self, bsonFileName=None, mysqlDbObj=None, **scrubberArgs):
+        # The user cache is not saved between tests:
+        scrubberArgs.setdefault('userCacheDir', None)
+        return EdxForumScrubber(bsonFileName,
+                                mysqlDbObj=mysqlDbObj if mysqlDbObj is not None else TestScrubber.UserDb(),
+                                forumTableName='contents', allUsersTableName='unittest.UserGrade', **scrubberArgs)
+
+    def makeCheckpoint(self, bsonFileName, numPostsDone, lastPostId, batchSize):
+        '''
+        Save a checkpoint of an interrupted conversion into a
+        temporary directory, and return the directory.
+        '''
+        checkpointDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, checkpointDir)
+        ConversionCheckpoint(os.path.join(checkpointDir, 'checkpoint_EdxForum_contents.json')).save(
+            bsonFileName, numPostsDone, lastPostId, batchSize=batchSize)
+        return checkpointDir
+
+    def tinyForumPosts(self, numCopies=1):
+        '''
+        Return numCopies copies of the posts in data/tinyForum.json,
+        each copy with its own _ids.
+        '''
+        currDir = os.path.dirname(__file__)
+        with open(os.path.join(currDir, 'data/tinyForum.json'), 'r') as jsonFd:
+            posts = [json.loads(line) for line in jsonFd]
+        copies = []
+        for copyNum in range(numCopies):
+            for post in posts:
+                postCopy = dict(post)
+                postCopy['_id'] = '%s-%d' % (post['_id'], copyNum)
+                copies.append(postCopy)
+        return copies
+
+    def convertedRows(self, source, **scrubberArgs):
+        scrubber = self.makeScrubber(**scrubberArgs)
+        scrubber.populateUserCache()
+        scrubber.forumMongoToRelational(source, scrubber.mydb, 'contents')
+        return scrubber.mydb.tables['unittest.contents']
+
+    def testStagedRebuild(self):
+        tmpDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpDir)
+        bsonFileName = os.path.join(tmpDir, 'forum.bson')
+        with open(bsonFileName, 'wb') as bsonFd:
+            for post in self.tinyForumPosts():
+                bsonFd.write(BSON.encode(post))
+        mydb = TestScrubber.SchemaDb(os.path.join(tmpDir, 'checkpoint_EdxForum_contents.json'))
+        # The forum table of an earlier run, with 4 posts:
+        mydb.execute('CREATE TABLE contents (forum_post_id varchar(40)) engine=MyISAM;')
+        mydb.bulkInsert('unittest.contents', ('forum_post_id',), [('old%d' % postNum,) for postNum in range(4)])
+
+        scrubber = self.makeScrubber(bsonFileName, mysqlDbObj=mydb, stagingSwap=True, checkpointDir=tmpDir, insertBatchSize=2)
+        self.assertEqual('contents_staging', scrubber.loadTableName)
+        scrubber.runConversion()
+        # The old posts were served until the one RENAME, while
+        # the checkpoint still covered the unfinished swap:
+        self.assertEqual([('RENAME TABLE contents TO contents_old, contents_staging TO contents;', 4, True)], mydb.renames)
+        self.assertEqual(6, len(mydb.tables['contents']))
+        self.assertTrue(set(EdxForumScrubber.DEFERRED_INDEXES.values()).issubset(mydb.indexes['contents']))
+        self.assertEqual(['contents'], mydb.indexes.keys())
+        self.assertFalse(os.path.exists(scrubber.checkpoint.fileName))
+
+    def testRedactionMemo(self):
+        scrubber = self.makeScrubber(allowAnonScreenName=True)
+        scrubber.populateUserCache()
+        def redact(body, authorId):
+            return scrubber.anonymizeRecord(ForumRecord({'_id' : 'p1', 'body' : body, 'author_id' : authorId})).body
+        body = 'Thanks, Otto and Andreas!'
+        self.assertEqual('Thanks, <nameRedac_abc> and Andreas!', redact(body, 5))
+        # The same body by another poster has that poster's name redacted:
+        self.assertEqual('Thanks, Otto and <nameRedac_def>!', redact(body, 7))
+        self.assertEqual('Thanks, <nameRedac_abc> and Andreas!', redact(body, 5))
+        self.assertEqual((2, 1), (len(scrubber.redactionMemo), scrubber.redactionMemo.hits))
+        # Long bodies are redacted, but not memoized:
+        longBody = 'Otto ' * (EdxForumScrubber.REDACTION_MEMO_MAX_BODY_LEN / 5 + 1)
+        self.assertEqual(len(longBody) / 5, redact(longBody, 5).count('<nameRedac_abc>'))
+        redact(longBody, 5)
+        self.assertEqual((2, 1), (len(scrubber.redactionMemo), scrubber.redactionMemo.hits))
+
+    def testResumeOnlyFromSameFile(self):
+        checkpointDir = self.makeCheckpoint('/data/otherForum.bson', 6, 'p5', 3)
+        scrubber = self.makeScrubber('/data/forum.bson', checkpointDir=checkpointDir, resume=True)
+        self.assertIsNone(scrubber.resumeState)
+        self.assertEqual(0, scrubber.numPostsResumed)
+
+    def testResumeChecksLastPostDone(self):
+        checkpointDir = self.makeCheckpoint('/data/forum.bson', 3, 'p2', 3)
+        scrubber = self.makeScrubber('/data/forum.bson', checkpointDir=checkpointDir, resume=True)
+        posts = [{'_id' : 'p%d' % postNum} for postNum in range(5)]
+        self.assertEqual(['p3', 'p4'], [post['_id'] for post in scrubber.skipDonePosts(posts)])
+        # The source changed since the interrupted run:
+        posts[2]['_id'] = 'p2new'
+        self.assertRaises(ValueError, scrubber.skipDonePosts, posts)
+        # The source shrank:
+        self.assertRaises(ValueError, scrubber.skipDonePosts, posts[:2])
+
+    def testResumeReplacesLastInterruptedBatch(self):
+        # The interrupted run wrote batches of 3; ours are of 2:
+        posts = self.tinyForumPosts()
+        checkpointDir = self.makeCheckpoint('/data/forum.bson', 1, posts[0]['_id'], 3)
+        scrubber = self.makeScrubber('/data/forum.bson', checkpointDir=checkpointDir, resume=True, insertBatchSize=2)
+        scrubber.populateUserCache()
+        scrubber.forumMongoToRelational(TestWatermarks.PostList(posts), scrubber.mydb, 'contents')
+        deletedKeys = [cmd.split(' IN ')[1] for cmd in scrubber.mydb.executed if cmd.startswith('DELETE')]
+        # Posts 2-4 may be in the table already; posts 5 and 6 cannot be:
+        self.assertEqual(["('%s','%s');" % (posts[1]['_id'], posts[2]['_id']),
+                          "('%s','%s');" % (posts[3]['_id'], posts[4]['_id'])],
+                         deletedKeys)
+        self.assertEqual(5, len(scrubber.mydb.tables['unittest.contents']))
+
+    def testOnlyPostersCached(self):
+        scrubber = self.makeScrubber(usersFromDumpOnly=True)
+        posts = [post for post in self.tinyForumPosts() if post['author_id'] != '7']
+        scrubber.populateUserCache(scrubber.collectAuthorIds(TestWatermarks.PostList(posts)))
+        self.assertEqual([5, 10], [userEntry[0] for userEntry in scrubber.userCache.iterEntries()])
+        self.assertEqual(set(['Otto', 'Bebe']), scrubber.userSet)
+        # The users table was never read in full:
+        self.assertFalse(any(['order by user_int_id' in queryStr for queryStr in scrubber.mydb.queries]))
+
+    def testParallelMatchesSerial(self):
+        # Enough posts for several batches per worker:
+        posts = self.tinyForumPosts(numCopies=500)
+        serialRows = self.convertedRows(TestWatermarks.PostList(posts), numWorkers=1)
+        self.assertEqual(len(posts), len(serialRows))
+        self.assertEqual(serialRows, self.convertedRows(TestWatermarks.PostList(posts), numWorkers=2))
+
+    @unittest.skipIf(mongomock is None, 'mongomock not installed')
+    def testProjectionKeepsAllFieldsRead(self):
+        mongoClient = mongomock.MongoClient()
+        mongoClient['TmpForum']['contents'].insert_many(self.tinyForumPosts())
+        for scrubberArgs in ({}, {'allowAnonScreenName' : True}):
+            fullRows = self.convertedRows(ShardedMongoReader('TmpForum', 'contents', numShards=1, mongoClient=mongoClient),
+                                          **scrubberArgs)
+            projectedRows = self.convertedRows(ShardedMongoReader('TmpForum', 'contents', numShards=1, mongoClient=mongoClient,
+                                                                  projection=EdxForumScrubber.MONGO_POST_FIELDS),
+                                               **scrubberArgs)
+            self.assertEqual(6, len(fullRows))
+            self.assertEqual(fullRows, projectedRows)
+
+    def testPosterNamePatternCache(self):
+        scrubber = self.makeScrubber()
+        scrubber.populateUserCache()
+        anon_screen_name, posterNamePattern = scrubber.getPosterNamePattern(5)
+        # Repeated posters are served from the cache:
+        self.assertIs(posterNamePattern, scrubber.getPosterNamePattern(5)[1])
+        self.assertEqual((1, 1), (scrubber.posterNameCache.hits, scrubber.posterNameCache.misses))
+        # Unknown posters have nothing to redact:
+        self.assertIsNone(scrubber.getPosterNamePattern(99)[1])
+        # The single pattern redacts what one pattern per name part did:
+        nameToken = '<nameRedac_%s>' % anon_screen_name
+        for body in ['Body with poster name Otto embedded.',
+                     'Body with poster screen name OTTO_KING embedded.',
+                     'Body with poster screen name Otto van Homberg embedded.',
+                     'Ottoman Theology, by Homberger.']:
+            uncachedBody = body
+            for namePart in ('Otto', 'van', 'Homberg'):
+                uncachedBody = re.sub(r'(?i)\b%s\b' % namePart, nameToken, uncachedBody)
+            uncachedBody = re.sub(r'(?i)otto_king', nameToken, uncachedBody)
+            self.assertEqual(uncachedBody, posterNamePattern.sub(nameToken, body))
+
+    def testForumUidPrefetch(self):
+        scrubber = self.makeScrubber()
+        posts = [{'_id' : 'p%d' % postNum, 'author_id' : str(authorId), 'course_id' : 'c1',
+                  'created_at' : '2013-05-%02dT00:00:00Z' % (postNum + 1)}
+                 for postNum, authorId in enumerate([5, 7, 5, 10, 'notAnId'])]
+        scrubber.prefetchForumUids(scrubber.collectAuthorIds(WatermarkFilter(TestWatermarks.PostList(posts), {})))
+        self.assertEqual({5 : 'fuid5', 7 : 'fuid7', 10 : 'fuid10'}, scrubber.forumUidCache)
+        # All posters in one query; none converted one at a time:
+        self.assertEqual(1, len([queryStr for queryStr in scrubber.mydb.queries if 'idInt2Forum' in queryStr]))
+        self.assertEqual('fuid7', scrubber.lookupForumUid(7))
+        self.assertEqual(1, len([queryStr for queryStr in scrubber.mydb.queries if 'idInt2Forum' in queryStr]))
+
+class TestStageStats(unittest.TestCase):
+
+    def testAddMergeAndReport(self):
+        stats = StageStats()
+        self.assertEqual(['a', 'b', 'c'], list(stats.timedIter('read', ['a', 'b', 'c'])))
+        stats.add('mysqlWrite', 3.0, 2)
+        # Totals from an anonymization worker:
+        workerStats = StageStats()
+        workerStats.add('piiRedaction', 1.0)
+        stats.merge(workerStats.takeTotals())
+        self.assertEqual({}, workerStats.takeTotals())
+        self.assertEqual(['read', 'mysqlWrite', 'piiRedaction'], stats.stageTotals.keys())
+        self.assertEqual(3, stats.stageTotals['read'][0])
+        self.assertTrue(stats.report(3, 2.0).startswith('3 records in 2.0 sec (1.5 records/sec); read '))
+        self.assertIn('mysqlWrite', stats.report(3, 2.0))
+
+class TestSyntheticForum(unittest.TestCase):
+
+    def testDumpReadsBack(self):
+        forum = SyntheticForum(200, numAuthors=20, piiDensity=0.5, seed=42)
+        bsonFd = tempfile.NamedTemporaryFile(suffix='.bson', delete=False)
+        bsonFd.close()
+        self.addCleanup(os.remove, bsonFd.name)
+        self.assertEqual(200, forum.writeBson(bsonFd.name))
+        posts = list(BsonForumReader(bsonFd.name))
+        self.assertEqual(200, len(posts))
+        # Same seed, same dump:
+        self.assertEqual(posts[-1]['body'], list(forum.posts())[-1]['body'])
+        # Posts are in _id order, and all authors are known users:
+        self.assertEqual(sorted([post['_id'] for post in posts]), [post['_id'] for post in posts])
+        self.assertTrue(set([post['author_id'] for post in posts]) <= set([str(author[0]) for author in forum.authors]))
+        self.assertIn('CommentThread', [post['_type'] for post in posts])
+        redactedBodies = [PIIRedactor().redact(post['body']) for post in posts]
+        self.assertTrue(any(['Redac>' in body for body in redactedBodies]))
+
+    def testCourseIndex(self):
+        forum = SyntheticForum(300, numCourses=3, seed=42)
+        bsonFd = tempfile.NamedTemporaryFile(suffix='.bson', delete=False)
+        bsonFd.close()
+        self.addCleanup(os.remove, bsonFd.name)
+        forum.writeBson(bsonFd.name)
+        offsetsByCourse = BsonForumReader(bsonFd.name).indexByField('course_id')
+        self.assertEqual(sorted(forum.courseIds), sorted(offsetsByCourse.keys()))
+        self.assertEqual(300, sum([len(docOffsets) for docOffsets in offsetsByCourse.values()]))
+        # A reader given one course's offsets sees exactly that course:
+        courseId, docOffsets = offsetsByCourse.items()[0]
+        coursePosts = list(BsonForumReader(bsonFd.name, docOffsets=docOffsets).query({}))
+        self.assertEqual(len(docOffsets), len(coursePosts))
+        self.assertEqual(set([courseId]), set([post['course_id'] for post in coursePosts]))
+
+class TestUserCache(unittest.TestCase):
+
+    def testSaveAndLoad(self):
+        userCache = UserCache()
+        userCache.add(10, 'Bebe Winter', 'bebeW', 'ghi')
+        userCache.add(5, u'Otto van Homberg', 'otto_king', 'abc')
+        userCache.add(7, 'Andreas Fritz', 'fritzL', 'def')
+        userCache.finish()
+        self.assertEqual(('Otto van Homberg', 'otto_king', 'abc'), userCache.get(5))
+        self.assertIsNone(userCache.get(6))
+
+        cacheFd = tempfile.NamedTemporaryFile(suffix='.bin', delete=False)
+        cacheFd.close()
+        self.addCleanup(os.remove, cacheFd.name)
+        userCache.save(cacheFd.name, 'checksum 42')
+        # Real names in the file are for its owner's eyes only:
+        self.assertEqual(0600, stat.S_IMODE(os.stat(cacheFd.name).st_mode))
+        # Only a matching key is accepted:
+        self.assertIsNone(UserCache.load(cacheFd.name, 'checksum 43'))
+        reloadedCache = UserCache.load(cacheFd.name, 'checksum 42')
+        self.assertEqual(list(userCache.iterEntries()), list(reloadedCache.iterEntries()))
+
+class TestWatermarks(unittest.TestCase):
+
+    class PostList(object):
+        # Stand-in for a MongoDB post source:
+        def __init__(self, posts):
+            self.posts = posts
+        def query(self, queryDict):
+            return iter(self.posts)
+
+    def testOnlyNewPostsPass(self):
+        posts = [{'_id' : 'old', 'course_id' : 'c1', 'created_at' : '2013-05-16T04:32:20.868Z'},
+                 {'_id' : 'edited', 'course_id' : 'c1', 'created_at' : '2013-05-16T04:32:20.868Z',
+                  'updated_at' : datetime.datetime(2013, 6, 1, 12, 0, 0)},
+                 {'_id' : 'otherCourse', 'course_id' : 'c2', 'created_at' : '2012-01-01T00:00:00Z'},
+                 {'_id' : 'noDate', 'course_id' : 'c1'}]
+        watermarkFilter = WatermarkFilter(TestWatermarks.PostList(posts), {'c1' : '2013-05-17T00:00:00.000000'})
+        self.assertEqual(['edited', 'otherCourse', 'noDate'], [post['_id'] for post in watermarkFilter.query({})])
+        self.assertEqual(1, watermarkFilter.numPostsSkipped)
+        self.assertEqual({'c1' : '2013-06-01T12:00:00.000000', 'c2' : '2012-01-01T00:00:00.000000'},
+                         watermarkFilter.newHighWaterMarks)
+        # Only the posts that pass count toward distinct values:
+        self.assertEqual(set(['edited', 'otherCourse', 'noDate']), watermarkFilter.distinctValues('_id'))
+
+    @unittest.skipIf(mongomock is None, 'mongomock not installed')
+    def testMongoOnlyHandsOutNewPosts(self):
+        mongoClient = mongomock.MongoClient()
+        mongoClient['TmpForum']['contents'].insert_many(
+                [{'_id' : 'old', 'course_id' : 'c1', 'created_at' : datetime.datetime(2013, 5, 16, 4, 32, 20)},
+                 {'_id' : 'edited', 'course_id' : 'c1', 'created_at' : datetime.datetime(2013, 5, 16, 4, 32, 20),
+                  'updated_at' : datetime.datetime(2013, 6, 1, 12, 0, 0)},
+                 {'_id' : 'oldString', 'course_id' : 'c1', 'created_at' : '2013-05-16T04:32:20.868Z'},
+                 {'_id' : 'otherCourse', 'course_id' : 'c2', 'created_at' : datetime.datetime(2012, 1, 1)},
+                 {'_id' : 'noDate', 'course_id' : 'c1'}])
+        for numShards in (1, 2):
+            mongoReader = ShardedMongoReader('TmpForum', 'contents', numShards=numShards, mongoClient=mongoClient)
+            watermarkFilter = WatermarkFilter(mongoReader, {'c1' : '2013-05-17T00:00:00.000000'}, pushDown=True)
+            self.assertEqual(['edited', 'noDate', 'otherCourse'], sorted([post['_id'] for post in watermarkFilter.query({})]))
+            # The server cannot compare the string date; the filter does:
+            self.assertEqual(1, watermarkFilter.numPostsSkipped)
+            # Distinct values are computed under the same query:
+            self.assertEqual(set(['edited', 'oldString', 'noDate', 'otherCourse']), watermarkFilter.distinctValues('_id'))
+
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testForumEtl']
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,192 @@
+# Copyright (c) 2014, Stanford University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+Compact, read-mostly cache of the course participants that
+EdxForumScrubber needs for redacting posters' names: for each
+user_int_id the full name, screen name, and anon_screen_name.
+
+Rather than one dict entry, list, and three string objects per
+user, all users are held in three flat structures:
+    - ids:     array of user_int_ids, ascending
+    - offsets: array of start positions into data; entry i+1 is
+               the end of user i
+    - data:    one string with each user's three names, UTF-8
+               encoded, separated by NUL characters
+Lookups are binary searches over ids.
+
+The whole cache can be saved to, and loaded from a local file,
+together with a key that identifies the state of the table it
+was built from. Since the file holds real names in clear text,
+only its owner may read it.
+'''
+
+from array import array
+from bisect import bisect_left
+from cStringIO import StringIO
+import os
+import tempfile
+
+
+class UserCache(object):
+
+    FILE_MAGIC = 'FORUM_ETL_USER_CACHE 1'
+
+    ID_TYPECODE = 'l'
+
+    FIELD_SEPARATOR = '\0'
+
+    def __init__(self):
+        self.ids = array(UserCache.ID_TYPECODE)
+        self.offsets = array(UserCache.ID_TYPECODE, [0])
+        self.data = ''
+        # While users are being added, data accumulates here;
+        # finish() turns it into self.data:
+        self.dataBuffer = StringIO()
+        self.dataLen = 0
+
+    def add(self, userIntId, fullName, screenName, anonScreenName):
+        '''
+        Add one user. Users may be added in any order; if a
+        user_int_id is added more than once, the last one wins.
+        Call finish() after the last user was added.
+        '''
+        packed = UserCache.FIELD_SEPARATOR.join([UserCache.toUtf8(fullName),
+                                                 UserCache.toUtf8(screenName),
+                                                 UserCache.toUtf8(anonScreenName)])
+        self.dataBuffer.write(packed)
+        self.dataLen += len(packed)
+        self.ids.append(int(userIntId))
+        self.offsets.append(self.dataLen)
+
+    def finish(self):
+        '''
+        Freeze the cache after all users were added: sort
+        by user_int_id if needed, and drop duplicates.
+        '''
+        self.data = self.dataBuffer.getvalue()
+        self.dataBuffer = StringIO()
+        ids = self.ids
+        isStrictlyAscending = all(ids[i] < ids[i + 1] for i in xrange(len(ids) - 1))
+        if isStrictlyAscending:
+            return
+        # Stable sort, so that of duplicate ids the last added stays last:
+        order = sorted(xrange(len(ids)), key=ids.__getitem__)
+        newIds = array(UserCache.ID_TYPECODE)
+        newOffsets = array(UserCache.ID_TYPECODE, [0])
+        dataBuffer = StringIO()
+        dataLen = 0
+        for pos, userIdx in enumerate(order):
+            if pos + 1 < len(order) and ids[order[pos + 1]] == ids[userIdx]:
+                # A later entry for the same id follows:
+                continue
+            packed = self.data[self.offsets[userIdx]:self.offsets[userIdx + 1]]
+            dataBuffer.write(packed)
+            dataLen += len(packed)
+            newIds.append(ids[userIdx])
+            newOffsets.append(dataLen)
+        self.ids = newIds
+        self.offsets = newOffsets
+        self.data = dataBuffer.getvalue()
+
+    def get(self, userIntId, default=None):
+        '''
+        Return (fullName, screenName, anonScreenName) of the
+        given user, or default if the user is unknown.
+        '''
+        idx = bisect_left(self.ids, userIntId)
+        if idx == len(self.ids) or self.ids[idx] != userIntId:
+            return default
+        return tuple(self.data[self.offsets[idx]:self.offsets[idx + 1]].split(UserCache.FIELD_SEPARATOR))
+
+    def iterEntries(self):
+        '''
+        Iterator over (userIntId, fullName, screenName, anonScreenName).
+        '''
+        for idx, userIntId in enumerate(self.ids):
+            yield (userIntId,) + tuple(self.data[self.offsets[idx]:self.offsets[idx + 1]].split(UserCache.FIELD_SEPARATOR))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, userIntId):
+        return self.get(userIntId) is not None
+
+    def save(self, fileName, cacheKey):
+        '''
+        Write the cache to a file. The cacheKey identifies the
+        source table state; load() only accepts a file whose
+        key matches. The file is written under a temporary name,
+        and then renamed, so readers never see a partial file.
+        The temporary name is unique to this call, so processes
+        saving the same cache at once do not write into each
+        other's copy. Files are created readable by their owner
+        only (mode 0600).
+
+        :param fileName: path of the cache file
+        :type fileName: String
+        :param cacheKey: identifier of the source table state. No newlines.
+        :type cacheKey: String
+        '''
+        # mkstemp() creates the file with mode 0600:
+        tmpFd, tmpFileName = tempfile.mkstemp(prefix=os.path.basename(fileName) + '.',
+                                              suffix='.tmp',
+                                              dir=os.path.dirname(os.path.abspath(fileName)))
+        try:
+            with os.fdopen(tmpFd, 'wb') as fd:
+                fd.write('%s\n%s\n%d %d %d\n' % (UserCache.FILE_MAGIC, cacheKey, self.ids.itemsize, len(self.ids), len(self.data)))
+                self.ids.tofile(fd)
+                self.offsets.tofile(fd)
+                fd.write(self.data)
+            os.rename(tmpFileName, fileName)
+        except:
+            os.remove(tmpFileName)
+            raise
+
+    @classmethod
+    def load(cls, fileName, cacheKey):
+        '''
+        Read a cache that was written by save(). Returns None if the file
+        does not exist, is damaged, was written on a platform with a
+        different integer size, or was built for a different cacheKey.
+
+        :param fileName: path of the cache file
+        :type fileName: String
+        :param cacheKey: the key the file must have been saved with
+        :type cacheKey: String
+        :rtype: {UserCache | None}
+        '''
+        try:
+            with open(fileName, 'rb') as fd:
+                if fd.readline().rstrip('\n') != UserCache.FILE_MAGIC:
+                    return None
+                if fd.readline().rstrip('\n') != cacheKey:
+                    return None
+                itemSize, numUsers, dataLen = [int(num) for num in fd.readline().split()]
+                userCache = cls()
+                if itemSize != userCache.ids.itemsize:
+                    return None
+                userCache.ids.fromfile(fd, numUsers)
+                userCache.offsets = array(UserCache.ID_TYPECODE)
+                userCache.offsets.fromfile(fd, numUsers + 1)
+                userCache.data = fd.read(dataLen)
+                if len(userCache.data) != dataLen:
+                    return None
+                return userCache
+        except (IOError, EOFError, ValueError):
+            return None
+
+    @staticmethod
+    def toUtf8(value):
+        if value is None:
+            return ''
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+        return str(value)
@@ -0,0 +1,193 @@
+# Copyright (c) 2014, Stanford University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+'''
+Support for incremental forum loads. A high-water mark is kept
+for each course: the most recent updated_at (or, if later,
+created_at) of any post of the course that was loaded. The
+next run only needs to look at posts at or beyond the mark.
+
+Posts are checked against the marks as they pass through a
+WatermarkFilter. Sources that run Mongo queries are in addition
+asked for just the posts the filter may pass (see watermarkQuery()),
+so that older posts are not even pulled from the server.
+
+Marks are normalized to strings of the form
+'YYYY-MM-DDTHH:MM:SS.ffffff', which sort chronologically.
+'''
+
+from datetime import datetime
+
+
+# Format of normalized time stamps:
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+def normalizeTimestamp(timestamp):
+    '''
+    Turn a post time stamp into a string that sorts
+    chronologically. Mongo dates arrive as datetime
+    objects; JSON exports carry ISO strings, such as
+    '2013-05-16T04:32:20.868Z'.
+
+    :param timestamp: time stamp from a post
+    :type timestamp: {datetime | String | None}
+    :returns: normalized time stamp, or None if timestamp is missing or not understood
+    :rtype: {String | None}
+    '''
+    if isinstance(timestamp, datetime):
+        return timestamp.strftime(TIMESTAMP_FORMAT)
+    if not isinstance(timestamp, basestring):
+        return None
+    timestamp = timestamp.strip().rstrip('Z')
+    for strFormat in (TIMESTAMP_FORMAT, '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S'):
+        try:
+            return datetime.strptime(timestamp, strFormat).strftime(TIMESTAMP_FORMAT)
+        except ValueError:
+            pass
+    return None
+
+def postTimestamp(mongoForumRec):
+    '''
+    Return the normalized time of the most recent change
+    to the given raw post, or None if the post has no
+    usable time stamp.
+    '''
+    timestamps = [normalizeTimestamp(mongoForumRec.get(fieldName)) for fieldName in ('updated_at', 'created_at')]
+    timestamps = [timestamp for timestamp in timestamps if timestamp is not None]
+    return max(timestamps) if len(timestamps) > 0 else None
+
+
+def watermarkQuery(highWaterMarks):
+    '''
+    Return a Mongo query for the posts that may be at or beyond
+    their course's high-water mark: posts of courses without a mark,
+    posts with updated_at or created_at at or after the mark, and
+    posts whose time stamps are not Mongo dates. The server cannot
+    compare the latter to the marks, so they are left for the
+    client side check of WatermarkFilter.
+
+    :param highWaterMarks: course_id --> normalized time stamp
+    :type highWaterMarks: {String : String}
+    :returns: Mongo query; {} if there are no marks
+    :rtype: {}
+    '''
+    if len(highWaterMarks) == 0:
+        return {}
+    alternatives = [{'course_id' : {'$nin' : highWaterMarks.keys()}}]
+    for fieldName in ('updated_at', 'created_at'):
+        alternatives.append({fieldName : {'$exists' : True, '$not' : {'$type' : 'date'}}})
+    alternatives.append({'updated_at' : {'$exists' : False}, 'created_at' : {'$exists' : False}})
+    for courseId, highWaterMark in highWaterMarks.items():
+        markDate = datetime.strptime(highWaterMark, TIMESTAMP_FORMAT)
+        alternatives.append({'course_id' : courseId,
+                             '$or' : [{'updated_at' : {'$gte' : markDate}},
+                                      {'created_at' : {'$gte' : markDate}}]})
+    return {'$or' : alternatives}
+
+class WatermarkFilter(object):
+    '''
+    Wraps a source of forum posts (MongoDB or BsonForumReader),
+    and passes on only the posts that are at or beyond their course's
+    high-water mark. Posts of courses without a mark, and posts
+    without a usable time stamp, are always passed on. Posts exactly
+    at the mark are passed on again, so that none are missed; the
+    loader replaces them.
+
+    While posts flow through query(), the new mark of each
+    course is collected in newHighWaterMarks.
+
+    Sources that take Mongo queries, such as ShardedMongoReader,
+    can be asked for only the posts that may pass (see pushDown).
+    The filter then still checks each post it receives; that check
+    is exact, and collects the new marks.
+    '''
+
+    def __init__(self, source, highWaterMarks, pushDown=False):
+        '''
+        :param source: source of posts
+        :type source: {MongoDB | BsonForumReader}
+        :param highWaterMarks: course_id --> normalized time stamp, from the previous run
+        :type highWaterMarks: {String : String}
+        :param pushDown: if True, the source is sent watermarkQuery(), so that
+            it only hands out posts that may be at or beyond their marks.
+            Only for sources that run Mongo queries; BsonForumReader cannot.
+        :type pushDown: Bool
+        '''
+        self.source = source
+        self.highWaterMarks = highWaterMarks
+        self.pushDown = pushDown
+        # course_id --> most recent normalized time stamp seen:
+        self.newHighWaterMarks = {}
+        # Number of posts passed over in the most recent pass. With
+        # pushDown, posts that the source left out are not counted:
+        self.numPostsSkipped = 0
+
+    def query(self, queryDict=None):
+        '''
+        Iterator over the new and changed posts of the source.
+
+        :param queryDict: handed to the source's query(); with pushDown,
+            together with watermarkQuery()
+        :type queryDict: {}
+        '''
+        self.numPostsSkipped = 0
+        for mongoForumRec in self.source.query(self.sourceQuery(queryDict)):
+            courseId = mongoForumRec.get('course_id')
+            timestamp = postTimestamp(mongoForumRec)
+            if timestamp is not None:
+                if self.isBehindMark(courseId, timestamp):
+                    self.numPostsSkipped += 1
+                    continue
+                if timestamp > self.newHighWaterMarks.get(courseId, ''):
+                    self.newHighWaterMarks[courseId] = timestamp
+            yield mongoForumRec
+
+    def distinctValues(self, fieldName):
+        '''
+        Return the set of distinct values of the given top level
+        field among the posts that query() passes on. With pushDown,
+        the source computes them under watermarkQuery(). Otherwise
+        the source's posts are scanned once, without collecting marks.
+
+        :param fieldName: name of a top level document field. Ex: 'author_id'
+        :type fieldName: String
+        :rtype: set
+        '''
+        if self.pushDown:
+            return self.source.distinctValues(fieldName, self.sourceQuery())
+        values = set()
+        for mongoForumRec in self.source.query({}):
+            timestamp = postTimestamp(mongoForumRec)
+            if timestamp is not None and self.isBehindMark(mongoForumRec.get('course_id'), timestamp):
+                continue
+            value = mongoForumRec.get(fieldName)
+            if value is not None:
+                values.add(value)
+        return values
+
+    def sourceQuery(self, queryDict=None):
+        '''
+        Return the query to send to the source: queryDict,
+        combined with watermarkQuery() if pushDown is set.
+        '''
+        queryDict = queryDict if queryDict is not None else {}
+        if self.pushDown:
+            markQuery = watermarkQuery(self.highWaterMarks)
+            if len(markQuery) > 0:
+                queryDict = {'$and' : [queryDict, markQuery]} if len(queryDict) > 0 else markQuery
+        return queryDict
+
+    def isBehindMark(self, courseId, timestamp):
+        highWaterMark = self.highWaterMarks.get(courseId)
+        return highWaterMark is not None and timestamp < highWaterMark
+
+    def close(self):
+        self.source.close()